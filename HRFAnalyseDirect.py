@@ -32,7 +32,7 @@ Usage: ./HRFAnalyseDirectory.py INPUT_DIRECTORY COMMAND COMMAND_OPTIONS
 
 Common operations can be found in the examples section.
 
-Three COMMANDs are available: clean, compress and entropy. 
+Four COMMANDs are available: clean, compress, entropy and features.
 
 It is assumed that when using compress or entropy the files only
 contain the one column with the relevant information (hrf in our
@@ -95,6 +95,14 @@ compress: This command allows you to compress all the files in the
                         compressor was chosen]
      --decompression    Use this option if you also wish to calculate how long
                         it takes to decompress the file once it's compressed
+     -j N, --jobs N     Number of files compressed at the same time (threads
+                        for the python compressors, processes for the
+                        external ones); default:[1]
+     --cache-dir DIRECTORY
+                        Directory where the results are cached, files that
+                        were already analysed with the same parameters are
+                        not calculated again. [default:~/.cache/hrfanalyse]
+     --no-cache         Calculate every result, without the cache
 
 
 entropy: This command allows you to calculate the entropy for all
@@ -113,6 +121,31 @@ entropy: This command allows you to calculate the entropy for all
      sampen              Sample Entropy
      apen                Approximate Entropy
      apenv2              A slightly different implementation of Approximate Entropy
+     permen              Permutation Entropy (-d is the permutation order, there
+                         is no tolerance)
+     hurst               Hurst exponent (no dimension or tolerance)
+     dfa                 DFA scaling exponents (-d 1 for alpha1, 2 for alpha2,
+                         --overlap to use every box of each length, the
+                         output file's name has the box layout, e.g.
+                         dfa_overlap)
+     lle                 Largest Lyapunov exponent (-d is the embedding
+                         dimension, there is no tolerance)
+
+     --backend {discrete,blocked,packed,sorted,kdtree}
+                        Algorithm used by sampen and apen to count template
+                        matches, the results are the same but discrete (for
+                        integer valued series, the others fall back to
+                        blocked), sorted and kdtree are much faster on long
+                        series, and packed keeps the matches as bits to use
+                        less memory. [default:discrete]
+     -j N, --jobs N     Number of processes used to calculate the entropy of
+                        the files, a file that fails is reported and left
+                        out of the results. [default:1]
+     --cache-dir DIRECTORY
+                        Directory where the results are cached, files that
+                        were already analysed with the same parameters are
+                        not calculated again. [default:~/.cache/hrfanalyse]
+     --no-cache         Calculate every result, without the cache
 
     For a sampen and apen documentation please look at:
              pyeeg (http://code.google.com/p/pyeeg/downloads/list)
@@ -122,6 +155,31 @@ entropy: This command allows you to calculate the entropy for all
 
    ./HRFAnalyseDirectory.py INPUT_DIRECTORY entropy ENTROPY -h
 
+features: This command calculates several features of every file at
+     once (the values the features have in common, like the std, the
+     first differences or the embedding's singular values, are only
+     calculated once per file).
+
+     OUTCOME: Calling this command will create a csv file using ';'
+     as a field delimiter, named
+     after the directory with a _features suffix, with one row per file
+     and one column per feature.
+
+     COMMAND_OPTIONS for this command are:
+     -f FEATURES, --features FEATURES
+                        Comma separated list of the features to calculate,
+                        available features: sampen, apen, svd_entropy,
+                        fisher_info, permen, pfd, hfd, hjorth_mobility,
+                        hjorth_complexity, vlf, lf, hf, lf_hf,
+                        spectral_entropy. [default: all of them]
+     -d, -t             Matrix dimension and tolerance of sampen and apen
+     --tau, --order, --embedding-dimension, --kmax
+                        Lag, permutation order, embedding dimension and
+                        Kmax of the other features
+     --fs HZ            Sampling frequency of the series, for the spectral
+                        features (vlf, lf and hf band powers, lf_hf ratio
+                        and spectral_entropy). [default:2.0]
+
 
 Examples :
 
@@ -165,6 +223,19 @@ Examples :
       dimension 2 (reference values for the analysis of biological data)
      ./HRFAnalyseDirectory.py unittest_dataset entropy apen -t 0.2
 
+     Calculate the Sample entropy for the tolerances 0.1, 0.15 and 0.2 at
+      once (one column per tolerance)
+     ./HRFAnalyseDirectory.py unittest_dataset entropy sampen -t 0.1,0.15,0.2
+
+     Calculate the Sample entropy for the dimensions 1 to 4 at once (one column
+      per dimension)
+     ./HRFAnalyseDirectory.py unittest_dataset entropy sampen -d 1:4
+
+
+  =>Features
+     Calculate the fractal dimensions and Hjorth parameters of every file
+     ./HRFAnalyseDirectory.py unittest_dataset features -f pfd,hfd,hjorth_mobility,hjorth_complexity
+
 """
 
 import argparse
@@ -173,6 +244,7 @@ import tools.clean
 import tools.compress
 import tools.partition
 import tools.entropy
+import tools.features
 import csv
 import logging
 
@@ -245,6 +317,10 @@ if __name__ == "__main__":
     entropy = subparsers.add_parser('entropy', help='calculate entropy for all the files in the given directory')
     tools.entropy.add_parser_options(entropy)
 
+    features = subparsers.add_parser('features', help='calculate several features of all the files in the given '
+                                                      'directory at once')
+    tools.features.add_parser_options(features)
+
     args = parser.parse_args()
     options = vars(args)
 
@@ -279,7 +355,8 @@ if __name__ == "__main__":
     if options['command'] == 'compress':
         compressor = options['compressor']
         level = tools.compress.set_level(options)
-        resulting_dict = tools.compress.compress(inputdir, compressor, level, options['decompress'])
+        resulting_dict = tools.compress.compress(inputdir, compressor, level, options['decompress'],
+                                                 options['jobs'], options['cache_dir'])
         if options['decompress']:
             outfile = "%s_decompress_%s_%d.csv" % (output_name, compressor, level)
         else:
@@ -297,17 +374,41 @@ if __name__ == "__main__":
             writer.writerow(data_row)
 
     elif options['command'] == 'entropy':
-        files_stds = tools.entropy.calculate_std(inputdir)
-        tolerances = dict((filename, files_stds[filename] * options["tolerance"]) for filename in files_stds)
+        files_stds = tools.entropy.calculate_std(inputdir, options['jobs'])
+        tolerances = dict((filename, [files_stds[filename] * tolerance for tolerance in options["tolerance"]])
+                          for filename in files_stds)
         resulting_dict = tools.entropy.entropy(inputdir,
                                                options['entropy'],
                                                options['dimension'],
-                                               tolerances)
+                                               tolerances,
+                                               tools.entropy.entropy_backend(options),
+                                               options['jobs'],
+                                               options['cache_dir'])
+
+        outfile = "%s_%s_%s_%s.csv" % (output_name, tools.entropy.entropy_name(options),
+                                       '-'.join('%d' % dimension for dimension in options['dimension']),
+                                       '_'.join('%f' % tolerance for tolerance in options['tolerance']))
+
+        writer = csv.writer(open(outfile, "w"), delimiter=";")
+        writer.writerow(["Filename"] + tools.entropy.entropy_columns(options['dimension'], options['tolerance'],
+                                                                     entropy_function=options['entropy']))
+        for filename in sorted(resulting_dict.keys()):
+            writer.writerow([filename] + tools.entropy.entropy_values(resulting_dict[filename]))
+
+    elif options['command'] == 'features':
+        resulting_dict = tools.features.features(inputdir,
+                                                 options['features'],
+                                                 options['dimension'],
+                                                 options['tolerance'],
+                                                 options['tau'],
+                                                 options['order'],
+                                                 options['embedding_dimension'],
+                                                 options['kmax'],
+                                                 options['fs'])
 
-        outfile = "%s_%s_%d_%f.csv" % (output_name, options['entropy'], options['dimension'], options['tolerance'])
+        outfile = "%s_features.csv" % output_name
 
         writer = csv.writer(open(outfile, "w"), delimiter=";")
-        writer.writerow(["Filename", "Entropy"])
+        writer.writerow(["Filename"] + options['features'])
         for filename in sorted(resulting_dict.keys()):
-            entropyData = resulting_dict[filename]
-            writer.writerow([filename, entropyData.entropy])
+            writer.writerow([filename] + [resulting_dict[filename][feature] for feature in options['features']])
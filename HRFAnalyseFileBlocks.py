@@ -43,7 +43,7 @@ To define how to create the blocks you can change BLOCK OPTIONS:
                         gap between sections (if using --full-file option)
   --use-lines           Partition using line count instead of time
 
-There are two command available compress and entropy.
+There are three command available compress, entropy and features.
 
 compress: This command allows you to compress all the files in the
      given directory.  The list of available compressors is
@@ -73,6 +73,14 @@ compress: This command allows you to compress all the files in the
                         compressor was chosen]
      --decompression    Use this option if you also wish to calculate how long it takes to
                         decompress the file once it's compressed
+     -j N, --jobs N     Number of blocks compressed at the same time (threads
+                        for the python compressors, processes for the
+                        external ones); default:[1]
+     --cache-dir DIRECTORY
+                        Directory where the results are cached, files that
+                        were already analysed with the same parameters are
+                        not calculated again. [default:~/.cache/hrfanalyse]
+     --no-cache         Calculate every result, without the cache
 
 
 entropy: This command allows you to calculate the entropy for all
@@ -91,10 +99,55 @@ entropy: This command allows you to calculate the entropy for all
      sampen              Sample Entropy
      apen                Aproximate Entropy
      apenv2              A slightly different implementation of Aproximate Entropy
+     permen              Permutation Entropy (-d is the permutation order, there
+                         is no tolerance)
+     hurst               Hurst exponent (no dimension or tolerance)
+     dfa                 DFA scaling exponents (-d 1 for alpha1, 2 for alpha2,
+                         --overlap to use every box of each length, the
+                         output file's name has the box layout, e.g.
+                         dfa_overlap)
+     lle                 Largest Lyapunov exponent (-d is the embedding
+                         dimension, there is no tolerance)
+
+    When the blocks overlap (the gap is smaller than the section) sampen
+    with the blocked or packed backend (or discrete on real values, where it
+    falls back to blocked) reuses the distances between the points
+    consecutive blocks have in common instead of calculating each block from
+    scratch (the results are the same). The discrete (on integer values),
+    sorted and kdtree backends are usually faster on each block on its own,
+    --sliding makes them reuse the distances too.
+
+    The entropy options (--backend, --jobs, --sliding, --cache-dir and --no-cache)
+    come before the entropy measure.
 
     For a particular function's documentation please look at:
              pyeeg (http://code.google.com/p/pyeeg/downloads/list)
 
+features: This command calculates several features of every block at
+     once (the values the features have in common, like the std, the
+     first differences or the embedding's singular values, are only
+     calculated once per block, and the spectra and singular values of
+     all the blocks with the same length are calculated together).
+
+     OUTCOME: Calling this command will create a csv file using ';'
+     as a field delimiter, for each
+     file, with one row per block and one column per feature.
+
+     COMMAND_OPTIONS for this command are:
+     -f FEATURES, --features FEATURES
+                        Comma separated list of the features to calculate,
+                        available features: sampen, apen, svd_entropy,
+                        fisher_info, permen, pfd, hfd, hjorth_mobility,
+                        hjorth_complexity, vlf, lf, hf, lf_hf,
+                        spectral_entropy. [default: all of them]
+     -d, -t             Matrix dimension and tolerance of sampen and apen
+     --tau, --order, --embedding-dimension, --kmax
+                        Lag, permutation order, embedding dimension and
+                        Kmax of the other features
+     --fs HZ            Sampling frequency of the series, for the spectral
+                        features (vlf, lf and hf band powers, lf_hf ratio
+                        and spectral_entropy). [default:2.0]
+
 Examples:
 
 
@@ -124,12 +177,26 @@ Calculte each files entropy using the Sample entropy.
 ./HRFAnalyseFileBlocks.py unittest_dataset/ -s 300 -g 60 entropy sampen
 
 
+=>Features
+
+Cut files into 5min blocks with no overlap and calculate all the features of each block
+
+./HRFAnalyseFileBlocks.py unittest_dataset/ -s 300 features
+
+
+Calculate the spectral features of each block (the blocks with the same
+length are transformed with a single fft)
+
+./HRFAnalyseFileBlocks.py unittest_dataset/ -s 300 features -f vlf,lf,hf,lf_hf,spectral_entropy
+
+
 """
 
 import argparse
 import tools.partition
 import tools.compress
 import tools.entropy
+import tools.features
 import tools.separate_blocks
 import os
 import csv
@@ -151,7 +218,10 @@ if __name__ == "__main__":
     tools.compress.add_parser_options(compress)
 
     entropy = subparsers.add_parser('entropy', help='calculate entropy for all the files in the given directory')
-    tools.entropy.add_parser_options(entropy)
+    tools.entropy.add_parser_options(entropy, sliding_option=True)
+
+    features = subparsers.add_parser('features', help='calculate several features of all the blocks at once')
+    tools.features.add_parser_options(features)
     #    tools.separate_blocks.add_parser_options(parser)
 
     args = parser.parse_args()
@@ -206,7 +276,8 @@ if __name__ == "__main__":
             # creating the block for compatibility with windows, so this line
             # changes the filename
             compressed[bfile] = tools.compress.compress(os.path.join(dest_dir, "%s_blocks" % bfile),
-                                                        options['compressor'], options['level'], options['decompress'])
+                                                        options['compressor'], options['level'], options['decompress'],
+                                                        options['jobs'], options['cache_dir'])
             logger.info("Compression complete")
         for filename in compressed:
             if options['decompress']:
@@ -229,19 +300,58 @@ if __name__ == "__main__":
         for filename in block_minutes:
             bfile = os.path.splitext(filename)[0]
             logger.info("Entropy calculations started for %s" % os.path.join(dest_dir, "%s_blocks" % bfile))
-            files_stds = tools.entropy.calculate_std(os.path.join(dest_dir, "%s_blocks" % bfile))
-            tolerances = dict((filename, files_stds[filename] * options["tolerance"]) for filename in files_stds)
-            entropy[bfile] = tools.entropy.entropy(os.path.join(dest_dir, "%s_blocks" % bfile),
-                                                   options['entropy'],
-                                                   options['dimension'],
-                                                   tolerances)
+            files_stds = tools.entropy.calculate_std(os.path.join(dest_dir, "%s_blocks" % bfile), options['jobs'])
+            tolerances = dict((filename, [files_stds[filename] * tolerance for tolerance in options["tolerance"]])
+                              for filename in files_stds)
+            if options['entropy'] == 'sampen' and options['gap'] < options['section']:
+                entropy[bfile] = tools.entropy.sampen_blocks(os.path.join(dest_dir, "%s_blocks" % bfile),
+                                                             options['dimension'],
+                                                             tolerances,
+                                                             options['backend'],
+                                                             options['jobs'],
+                                                             options['cache_dir'],
+                                                             options['sliding'])
+            else:
+                entropy[bfile] = tools.entropy.entropy(os.path.join(dest_dir, "%s_blocks" % bfile),
+                                                       options['entropy'],
+                                                       options['dimension'],
+                                                       tolerances,
+                                                       tools.entropy.entropy_backend(options),
+                                                       options['jobs'],
+                                                       options['cache_dir'])
             logger.info("Entropy calculations complete")
         for filename in entropy:
-            fboutname = "%s_%s_%d_%f.csv" % (filename, options['entropy'], options['dimension'], options['tolerance'])
+            fboutname = "%s_%s_%s_%s.csv" % (filename, tools.entropy.entropy_name(options),
+                                             '-'.join('%d' % dimension for dimension in options['dimension']),
+                                             '_'.join('%f' % tolerance for tolerance in options['tolerance']))
             writer = csv.writer(open(fboutname, "w"), delimiter=";")
-            header = ["Block", "Entropy"]
+            header = ["Block"] + tools.entropy.entropy_columns(options['dimension'], options['tolerance'],
+                                                               entropy_function=options['entropy'])
             writer.writerow(header)
-            for blocknum in range(1, len(entropy[filename]) + 1):
+            # Blocks that failed were reported and left out
+            for blocknum in sorted(int(block.rsplit('_', 1)[1]) for block in entropy[filename]):
                 block_results = entropy[filename]['%s_%d' % (filename, blocknum)]
-                row_data = [blocknum, block_results.entropy]
+                row_data = [blocknum] + tools.entropy.entropy_values(block_results)
                 writer.writerow(row_data)
+    elif options['command'] == 'features':
+        features = {}
+        for filename in block_minutes:
+            bfile = os.path.splitext(filename)[0]
+            logger.info("Feature calculations started for %s" % os.path.join(dest_dir, "%s_blocks" % bfile))
+            features[bfile] = tools.features.features(os.path.join(dest_dir, "%s_blocks" % bfile),
+                                                      options['features'],
+                                                      options['dimension'],
+                                                      options['tolerance'],
+                                                      options['tau'],
+                                                      options['order'],
+                                                      options['embedding_dimension'],
+                                                      options['kmax'],
+                                                      options['fs'])
+            logger.info("Feature calculations complete")
+        for filename in features:
+            fboutname = "%s_features.csv" % filename
+            writer = csv.writer(open(fboutname, "w"), delimiter=";")
+            writer.writerow(["Block"] + options['features'])
+            for blocknum in sorted(int(block.rsplit('_', 1)[1]) for block in features[filename]):
+                block_results = features[filename]['%s_%d' % (filename, blocknum)]
+                writer.writerow([blocknum] + [block_results[feature] for feature in options['features']])
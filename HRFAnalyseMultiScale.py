@@ -38,6 +38,9 @@ OPTIONS to apply when creating the scales:
                         number in the series by MUL ORDER, -1 disables this
                         option; Default:[-1]
   --round-to-int
+  --keep-scales         Also write the scale files, the entropy and the
+                        compression are calculated from scales built in
+                        memory so they are only written when asked for
 
 The two available commands are compress and entropy.
 
@@ -56,6 +59,8 @@ compress: This command allows you to compress all the files in the
      file will be created in the parent of the directory we are
      working with. Each file is represented by a row with two
      columns per scale, it's original size and it's compressed size.
+     The scales are built and compressed in memory, no scale files are
+     written unless --keep-scales is used.
 
      COMMAND_OPTIONS for this command are:
      -c COMPRESSOR, --compressor COMPRESSOR
@@ -67,6 +72,14 @@ compress: This command allows you to compress all the files in the
                         compressor was chosen]
      --decompression    Use this option if you also wish to calculate how long it
                         takes to decompress the file once it's compressed
+     -j N, --jobs N     Number of files compressed at the same time (threads
+                        for the python compressors, processes for the
+                        external ones); default:[1]
+     --cache-dir DIRECTORY
+                        Directory where the results are cached, files that
+                        were already analysed with the same parameters are
+                        not calculated again. [default:~/.cache/hrfanalyse]
+     --no-cache         Calculate every result, without the cache
 
 
 entropy: This command allows you to calculate the entropy for all
@@ -77,14 +90,33 @@ entropy: This command allows you to calculate the entropy for all
      compression level used are used to name the resulting file. This
      file will be created in the parent of the directory we are
      working with. Each file is represented by a row with one column per scale,
-     it's entropy.
+     it's entropy. Each file is read only once and its scales are built in
+     memory, no scale files are written unless --keep-scales is used.
 
 
+    --composite {rcmse,cmse}
+                        Use the refined composite (rcmse) or the composite
+                        (cmse) multiscale sample entropy, only for sampen. The
+                        name of the method is added to the resulting file's
+                        name.
     COMMAND_OPTIONS are the available entropy measures:
 
      sampen              Sample Entropy
      apen                Aproximate Entropy
      apenv2              A slightly different implementation of Aproximate Entropy
+     permen              Permutation Entropy (-d is the permutation order, there
+                         is no tolerance)
+     hurst               Hurst exponent (no dimension or tolerance)
+     dfa                 DFA scaling exponents (-d 1 for alpha1, 2 for alpha2,
+                         --overlap to use every box of each length, the
+                         output file's name has the box layout, e.g.
+                         dfa_overlap)
+     lle                 Largest Lyapunov exponent (-d is the embedding
+                         dimension, there is no tolerance)
+
+    The entropy of each scale is cached as in the compress command
+    (--cache-dir and --no-cache, before the entropy measure), except
+    with --composite.
 
 
     For a sampen and apen documentation please look at:
@@ -102,6 +134,10 @@ Multiscale entropy for all the files starting at scale 1(original files)
  and ending in scale 20
 ./HRFAnalyseMultiscale unittest_dataset entropy sampen
 
+Refined composite multiscale sample entropy, with the same tolerance (0.15 of the
+original file's std) in every scale
+./HRFAnalyseMultiscale unittest_dataset entropy --composite rcmse sampen -t 0.15
+
 Multiscale compression with rounded results for scale, since the scales are constructed
 by avaraging a given number of point we are bound to have floats, this options
 rounds those numbers to an integer.
@@ -141,6 +177,7 @@ if __name__ == "__main__":
     entropy = commands.add_parser("entropy", help="use entropy on multiscale")
 
     tools.entropy.add_parser_options(entropy)
+    tools.multiscale.add_entropy_parser_options(entropy)
 
     args = parser.parse_args()
     options = vars(args)
@@ -168,10 +205,11 @@ if __name__ == "__main__":
     if options['mul_order'] != -1:
         scales_dir += '_%d' % (options['mul_order'])
 
-    logger.info("Creating Scales Directory")
-    tools.multiscale.create_scales(input_dir, scales_dir, options["scale_start"], options["scale_stop"] + 1,
-                                   options["scale_step"], options['mul_order'], options['round'])
-    logger.info("Scales Directory created")
+    if options["keep_scales"]:
+        logger.info("Creating Scales Directory")
+        tools.multiscale.create_scales(input_dir, scales_dir, options["scale_start"], options["scale_stop"] + 1,
+                                       options["scale_step"], options['mul_order'], options['round'])
+        logger.info("Scales Directory created")
 
     if options["command"] == "compress":
         options["level"] = tools.compress.set_level(options)
@@ -195,7 +233,11 @@ if __name__ == "__main__":
                                                                     options["scale_step"],
                                                                     options["compressor"],
                                                                     options["level"],
-                                                                    options["decompress"])
+                                                                    options["decompress"],
+                                                                    options["mul_order"],
+                                                                    options["round"],
+                                                                    options["jobs"],
+                                                                    options["cache_dir"])
 
         writer = csv.writer(open(outfile, "w"), delimiter=";")
         if options['decompress']:
@@ -212,14 +254,22 @@ if __name__ == "__main__":
             writer.writerow([filename] + compression_table[filename])
 
     elif options["command"] == "entropy":
-        if options['entropy'] == 'apen' or options['entropy'] == 'apenv2' or options['entropy'] == "sampen":
-            outfile = "%s_multiscale_%d_%d_%d_%s%d%.2f.csv" % (input_dir,
-                                                               options["scale_start"],
-                                                               options["scale_stop"],
-                                                               options["scale_step"],
-                                                               options["entropy"],
-                                                               options["dimension"],
-                                                               options["tolerance"])
+        if options['composite'] is not None and options['entropy'] != "sampen":
+            logger.error("Composite multiscale not implemented for %s" % options["entropy"])
+        elif options['entropy'] in ('apen', 'apenv2', 'sampen', 'permen', 'hurst', 'dfa', 'lle'):
+            if options['composite'] is None:
+                entropy_name = tools.entropy.entropy_name(options)
+            else:
+                entropy_name = "%s_%s" % (options["composite"], options["entropy"])
+            outfile = "%s_multiscale_%d_%d_%d_%s%s%s.csv" % (input_dir,
+                                                             options["scale_start"],
+                                                             options["scale_stop"],
+                                                             options["scale_step"],
+                                                             entropy_name,
+                                                             '-'.join('%d' % dimension
+                                                                      for dimension in options["dimension"]),
+                                                             '_'.join('%.2f' % tolerance
+                                                                      for tolerance in options["tolerance"]))
             entropy_table = {}
 
             entropy_table = tools.multiscale.multiscale_entropy(input_dir,
@@ -228,11 +278,20 @@ if __name__ == "__main__":
                                                                 options["scale_step"],
                                                                 options["entropy"],
                                                                 options["dimension"],
-                                                                options["tolerance"])
+                                                                options["tolerance"],
+                                                                tools.entropy.entropy_backend(options),
+                                                                options["jobs"],
+                                                                options["mul_order"],
+                                                                options["round"],
+                                                                options["composite"],
+                                                                options["cache_dir"])
 
             writer = csv.writer(open(outfile, "w"), delimiter=";")
-            header = ["Filename"] + ["Escala%d Entropy" % s for s in
-                                     range(options["scale_start"], options["scale_stop"] + 1, options["scale_step"])]
+            header = ["Filename"] + ["Escala%d %s" % (s, column) for s in
+                                     range(options["scale_start"], options["scale_stop"] + 1, options["scale_step"])
+                                     for column in tools.entropy.entropy_columns(
+                                         options["dimension"], options["tolerance"],
+                                         entropy_function=options["entropy"])]
             writer.writerow(header)
             for filename in sorted(entropy_table.keys()):
                 writer.writerow([filename] + entropy_table[filename])
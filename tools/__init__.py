@@ -29,6 +29,8 @@ distance -- Calculate the distance between two files
 
 entropy -- Application of pyeeg and other tool to data to determine entropy
 
+features -- Calculate several pyeeg measures of a series at once, sharing what they have in common
+
 multiscale -- construction and calls for multiscale.
 
 partition -- File partition -- partition a file in blocks or cut of a chunk of the file using either minutes or lines.
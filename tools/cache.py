@@ -0,0 +1,260 @@
+"""
+Copyright (C) 2012 Mara Matias
+
+This file is part of HRFAnalyse.
+
+    HRFAnalyse is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published
+    by the Free Software Foundation, either version 3 of the License,
+    or (at your option) any later version.
+
+    HRFAnalyse is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with HRFAnalyse.  If not, see
+    <http://www.gnu.org/licenses/>.
+
+_______________________________________________________________________________
+
+This module keeps the results of compress and entropy on disk, so analysing
+the same files again (with the same or other parameters) only calculates
+what wasn't calculated before.
+
+A result is stored under a hash of the contents it was calculated on (the
+file or the series, never its name) and of every parameter that changes it,
+so renaming or moving files keeps their results and changing a file or a
+parameter never returns an old result. The results are kept in a SQLite
+database in the cache directory, which may be shared by several processes;
+when it grows over CACHE_MAX_SIZE the least recently used results are
+removed.
+
+A cache that can't be read or written is reported in the log and everything
+is calculated as if there was no cache.
+
+MODULE EXTERNAL DEPENDENCIES:
+numpy(http://numpy.scipy.org/)
+
+ENTRY POINT: cached(cache_dir,files,calculate)
+             cached_value(cache_dir,data,parameters,calculate)
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+import numpy
+
+module_logger = logging.getLogger('hrfanalyse.cache')
+
+"""The cache directory used by the command line scripts unless they are given
+another one"""
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                 "hrfanalyse")
+
+"""Name of the database file in the cache directory"""
+CACHE_FILE = "results.sqlite"
+
+"""Maximum size in bytes of the cached results, the least recently used ones
+are removed when the database grows over it"""
+CACHE_MAX_SIZE = 64 * 2 ** 20
+
+"""Number of least recently used results removed at a time while the cache
+is over CACHE_MAX_SIZE"""
+EVICTION_BATCH = 256
+
+"""Part of every key, increase it when a change in a measure or compressor
+changes its results so the old ones are no longer used"""
+CACHE_VERSION = 1
+
+"""Seconds a process waits for another one that is writing to the cache"""
+CACHE_TIMEOUT = 60
+
+
+# ENTRY POINT FUNCTION
+def cached(cache_dir, files, calculate):
+    """
+    (str, dict of str: (str, tuple), function) -> dict of str: object
+
+    Return the results of the files (name: (path, parameters)), the ones
+    in the cache in cache_dir are read from it and the others calculated with
+    calculate(list of names), which returns a dictionary with the result of
+    each name, and stored. A name calculate leaves out of its result (a
+    failed file) is also left out here. With no cache_dir everything is
+    calculated.
+    """
+    if cache_dir is None:
+        return calculate(list(files))
+    keys = {}
+    for name in files:
+        try:
+            keys[name] = file_key(*files[name])
+        except OSError:
+            # calculate reports it
+            keys[name] = None
+    found = lookup(cache_dir, [key for key in keys.values() if key is not None])
+    results = dict((name, found[keys[name]]) for name in keys if keys[name] in found)
+    missing = [name for name in keys if keys[name] not in found]
+    if missing:
+        calculated = calculate(missing)
+        store(cache_dir, dict((keys[name], calculated[name]) for name in calculated if keys[name] is not None))
+        results.update(calculated)
+    return results
+
+
+def cached_value(cache_dir, data, parameters, calculate):
+    """
+    (str, bytes-like, tuple, function) -> object
+
+    Return the result of calculate() for data (any C contiguous object with
+    the buffer protocol) and parameters, from the cache in cache_dir if it
+    is there, otherwise calculated and stored. With no cache_dir it is
+    always calculated.
+    """
+    if cache_dir is None:
+        return calculate()
+    key = content_key(data, parameters)
+    found = lookup(cache_dir, [key])
+    if key in found:
+        return found[key]
+    value = calculate()
+    store(cache_dir, {key: value})
+    return value
+
+
+# IMPLEMENTATION
+def lookup(cache_dir, keys):
+    """
+    (str, list of str) -> dict of str: object
+
+    Read the results of keys that are in the cache, marking them as used.
+    """
+    found = {}
+    try:
+        with closing(open_cache(cache_dir)) as connection, connection:
+            for start in range(0, len(keys), EVICTION_BATCH):
+                batch = keys[start:start + EVICTION_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = connection.execute("SELECT key, value FROM results WHERE key IN (%s)" % placeholders,
+                                          batch).fetchall()
+                connection.execute("UPDATE results SET last_used = ? WHERE key IN (%s)" % placeholders,
+                                   [time.time()] + batch)
+                found.update((key, pickle.loads(value)) for key, value in rows)
+    except (sqlite3.Error, OSError) as error:
+        module_logger.warning("Could not read the cache in %s: %s" % (cache_dir, error))
+    return found
+
+
+def store(cache_dir, values):
+    """
+    (str, dict of str: object) -> NoneType
+
+    Store the results in values under their keys, and remove the least
+    recently used results while the cache is bigger than CACHE_MAX_SIZE.
+    """
+    if not values:
+        return
+    try:
+        with closing(open_cache(cache_dir)) as connection, connection:
+            now = time.time()
+            connection.executemany("INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+                                   [(key, pickle.dumps(values[key], pickle.HIGHEST_PROTOCOL), now)
+                                    for key in values])
+            while used_size(connection) > CACHE_MAX_SIZE:
+                removed = connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY "
+                                             "last_used LIMIT ?)", (EVICTION_BATCH,)).rowcount
+                if not removed:
+                    break
+    except (sqlite3.Error, OSError) as error:
+        module_logger.warning("Could not write to the cache in %s: %s" % (cache_dir, error))
+
+
+# AUXILIARY FUNCTIONS
+
+def open_cache(cache_dir):
+    """
+    (str) -> sqlite3.Connection
+
+    !!!Auxiliary function!!! Open the cache database in cache_dir, creating
+    the directory and the database if needed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(cache_dir, CACHE_FILE), timeout=CACHE_TIMEOUT)
+    try:
+        # Several processes read and write the cache at the same time
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                           "last_used REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def used_size(connection):
+    """
+    (sqlite3.Connection) -> int
+
+    !!!Auxiliary function!!! Size in bytes of the database pages in use, the
+    free pages left by removed results are not counted.
+    """
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+
+def file_key(filename, parameters):
+    """
+    (str, tuple) -> str
+
+    !!!Auxiliary function!!! Key of the result of parameters calculated on
+    the contents of filename (see content_key).
+    """
+    with open(filename, "rb") as fdin:
+        return content_key(fdin.read(), parameters)
+
+
+def content_key(data, parameters):
+    """
+    (bytes-like, tuple) -> str
+
+    !!!Auxiliary function!!! Key of the result of parameters calculated on
+    data: the sha256 of data, CACHE_VERSION and the parameters (numpy values
+    are taken as the python values they hold, so 0.1 and numpy.float64(0.1)
+    give the same key).
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps([CACHE_VERSION] + list(parameters),
+                             default=lambda value: numpy.asarray(value).tolist()).encode())
+    return digest.hexdigest()
+
+
+def add_parser_options(parser):
+    """
+    (argparse.ArgumentParser) -> NoneType
+
+    !!!Auxiliary function!!!  These are arguments for an argparse
+    parser or subparser, cache_dir is None when no cache is to be used.
+
+    """
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--cache-dir",
+                             dest="cache_dir",
+                             metavar="DIRECTORY",
+                             action="store",
+                             default=DEFAULT_CACHE_DIR,
+                             help="Directory where the results are cached, files that were already analysed with "
+                                  "the same parameters are not calculated again; default:[%(default)s]")
+    cache_group.add_argument("--no-cache",
+                             dest="cache_dir",
+                             action="store_const",
+                             const=None,
+                             help="Calculate every result, without reading or writing the cache")
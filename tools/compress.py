@@ -27,9 +27,10 @@ COMPRESSORS IMPLEMENTED: paq8l, lzma, gzip, bzip2, ppmd, spbio.
 means those compressors produce a compressed file with the exact same name as the
 original but with some extra prefix. To mantain some coherence troughout the code
 a choice was made to force the same behavior in all the compressors who write 
-output files. This however means the same directory/file cannot be compressed in
-the same machine at the same time since one of the processes could delete or rewrite
-the temporary file before the other was finished using it.!!!
+output files. Each call copies its file to a private scratch directory (in
+SCRATCH_ROOT) and runs the compressor there, so the same directory/file can be
+compressed by several processes at the same time and nothing is ever written
+next to the original files.!!!
 
 MODULE EXTERNAL DEPENDENCIES: 
                      lzma module for python.
@@ -37,18 +38,22 @@ MODULE EXTERNAL DEPENDENCIES:
                      path if you would like to use them.
 
 
-ENTRY POINT: compress(input_name,compression_algorithm,level,decompress=False)
+ENTRY POINT: compress(input_name,compression_algorithm,level,decompress=False,jobs=1,cache_dir=None)
+             compress_bytes(data,compression_algorithm,level,decompress=False,cache_dir=None)
 
 """
 
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import zlib
 import bz2
 import timeit
 import time
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import sys
 # path = os.path.abspath(__file__)
 # os.path.dirname(path)+
@@ -56,6 +61,8 @@ import sys
 
 # print sys.path
 import brotli
+from tools import cache
+from tools.pool import run_in_pool, job_count
 
 try:
     import lzma
@@ -72,8 +79,6 @@ import logging
 
 module_logger = logging.getLogger('hrfanalyse.compress')
 
-# from memoize import Memoize
-
 # DATA TYPE DEFINITIONS
 """This is a data type defined to be used as a return for compression it has
 three atributes original contains the original size of the file, compressed,
@@ -83,38 +88,73 @@ CompressionData = namedtuple('CompressionData', 'original compressed time')
 
 
 # ENTRY POINT FUNCTION
-# @Memoize
-def compress(input_name, compression_algorithm, level, decompress=False):
+def compress(input_name, compression_algorithm, level, decompress=False, jobs=1, cache_dir=None):
     """
 
-    (str,str,int,bool)-> dict of str : CompressionData
+    (str,str,int,bool,int,str)-> dict of str : CompressionData
 
     Given a file or directory named input_name, apply the desired
     compression algorithm to all the files. Optionaly a timming on
     decompression may also be run.
 
+    The files in a directory are spread over jobs workers (see
+    compression_executor). With a cache_dir the sizes of files that were
+    already compressed with the same compressor and level are read from the
+    cache (see cache.cached), decompression times are always measured.
+
     Levels will be set to the compressor's maximum or minimum respectively
     if the level passed as argument is not valid.
     """
 
-    compressed = {}
     method_to_call = getattr(sys.modules[__name__], compression_algorithm + '_compress')
-
-    if level > AVAILABLE_COMPRESSORS[compression_algorithm][1]:
-        level = AVAILABLE_COMPRESSORS[compression_algorithm][1]
-    elif level < AVAILABLE_COMPRESSORS[compression_algorithm][0]:
-        level = AVAILABLE_COMPRESSORS[compression_algorithm][0]
+    level = valid_level(compression_algorithm, level)
 
     if os.path.isdir(input_name):
-        filelist = os.listdir(input_name)
-        for filename in filelist:
-            filename = filename.strip()  # removes the tailing \n
-            compression_data = method_to_call(os.path.join(input_name, filename), level, decompress)
-            compressed[filename.strip()] = compression_data
+        filelist = [filename.strip() for filename in os.listdir(input_name)]  # removes the tailing \n
+        file_arguments = dict((filename, (os.path.join(input_name, filename), level, decompress))
+                              for filename in filelist)
     else:
-        compression_data = method_to_call(input_name.strip(), level, decompress)
-        compressed[input_name.strip()] = compression_data
-    return compressed
+        file_arguments = {input_name.strip(): (input_name.strip(), level, decompress)}
+    if decompress:
+        cache_dir = None
+    files = dict((filename, (file_arguments[filename][0], compress_parameters(file_arguments[filename][0],
+                                                                              compression_algorithm, level)))
+                 for filename in file_arguments)
+
+    def calculate(filenames):
+        if os.path.isdir(input_name):
+            return run_in_pool(method_to_call, dict((filename, file_arguments[filename]) for filename in filenames),
+                               jobs, compression_executor(compression_algorithm))
+        return dict((filename, method_to_call(*file_arguments[filename])) for filename in filenames)
+
+    return cache.cached(cache_dir, files, calculate)
+
+
+def compress_bytes(data, compression_algorithm, level, decompress=False, cache_dir=None):
+    """
+    (bytes-like, str, int, bool, str) -> CompressionData
+
+    Apply the desired compression algorithm to data, any object with the
+    buffer protocol (bytes, bytearray, memoryview, a numpy array...), so
+    the compressed size of values that are only in memory can be measured
+    without writing them to a file. Optionaly a timming on decompression may
+    also be run.
+
+    The compressors implemented in python compress the buffer itself,
+    without copying it, the external ones only read files so the data is
+    written to a temporary one. Levels and the cache are used as in
+    compress.
+    """
+    method_to_call = getattr(sys.modules[__name__], compression_algorithm + '_compress_bytes')
+    level = valid_level(compression_algorithm, level)
+    data = memoryview(data)
+    if not data.c_contiguous:
+        data = memoryview(data.tobytes())
+    data = data.cast('B')
+    if decompress:
+        cache_dir = None
+    return cache.cached_value(cache_dir, data, ("compress_bytes", compression_algorithm, level),
+                              lambda: method_to_call(data, level, decompress))
 
 
 # IMPLEMENTATION
@@ -122,7 +162,17 @@ def gzip_compress(inputfile, level, decompress):
     """
     (str, int, bool)-> CompressionData
 
-    Compresses one file using the python implementation of zlib.
+    Compresses one file using the python implementation of zlib (see
+    gzip_compress_bytes).
+    """
+    return file_compress(gzip_compress_bytes, inputfile, level, decompress)
+
+
+def gzip_compress_bytes(data, level, decompress):
+    """
+    (memoryview, int, bool)-> CompressionData
+
+    Compresses a buffer using the python implementation of zlib.
 
     NOTE: Although this uses the name gzip the actual tool being used
     is python's zlib which has the actual implementation of the deflate 
@@ -130,48 +180,55 @@ def gzip_compress(inputfile, level, decompress):
     gzip and zlib is the header added to the compressed file, which is not in the 
     resulting compressed string, nor is it added in our case.
     """
-
-    original_size = int(os.stat(inputfile).st_size)
-    with open(inputfile, "rU") as fdorig:
-        origlines = fdorig.read()
-    origtext = memoryview(bytearray(origlines, "utf8"))
-    compressedtext = memoryview(zlib.compress(origtext.tobytes(), int(level)))
-    compressed_size = len(compressedtext)
+    compressedtext = zlib.compress(data, int(level))
 
     decompress_time = None
     if decompress:
-        decompress_time = min(timeit.repeat(lambda: zlib.decompress(compressedtext.tobytes()),
+        decompress_time = min(timeit.repeat(lambda: zlib.decompress(compressedtext),
                                             number=10,
-                                            repeat=3, timer=time.clock))
+                                            repeat=3, timer=time.thread_time))
 
-    cd = CompressionData(original_size, compressed_size, decompress_time)
-
-    return cd
+    return CompressionData(data.nbytes, len(compressedtext), decompress_time)
 
 
 def paq8l_compress(inputfile, level, decompress):
     """
     (str, int, bool) -> CompressionData
 
-    Compresses one file using the paq8l compressor, the size is
-    determined by quering the file paq8l creates, this temporary file
-    is removed at the end of this function.
+    Compresses one file using the paq8l compressor (see
+    external_compress).
+    """
+    return external_compress(paq8l_compress_scratch, inputfile, level, decompress)
+
+
+def paq8l_compress_bytes(data, level, decompress):
+    """
+    (memoryview, int, bool) -> CompressionData
+
+    Compresses a buffer using the paq8l compressor (see
+    external_compress_bytes).
+    """
+    return external_compress_bytes(paq8l_compress_scratch, data, level, decompress)
+
 
+def paq8l_compress_scratch(scratchfile, level, decompress):
     """
-    subprocess.check_output('paq8l -%d "%s"' % (level, inputfile),
-                            shell=True,
-                            stderr=subprocess.STDOUT)
-    original_size = int(os.stat(inputfile).st_size)
-    compressed_size = int(os.stat(inputfile + '.paq8l').st_size)
+    (str, int, bool) -> CompressionData
+
+    Compresses a file in a scratch directory using the paq8l compressor,
+    the size is determined by quering the file paq8l creates next to it.
+    """
+    scratch_dir, filename = os.path.split(scratchfile)
+    subprocess.check_output(["paq8l", "-%d" % level, filename], cwd=scratch_dir, stderr=subprocess.STDOUT)
+    original_size = int(os.stat(scratchfile).st_size)
+    compressed_size = int(os.stat(scratchfile + '.paq8l').st_size)
     decompress_time = None
     if decompress:
-        decompress_time = min(timeit.repeat(
-            'subprocess.check_output(\'paq8l -d "%s.paq8l"\',shell=True,stderr=subprocess.STDOUT)' % inputfile,
-            number=1,
-            repeat=3,
-            setup='import subprocess'))
-
-    os.remove('%s.paq8l' % inputfile)
+        decompress_time = min(timeit.repeat(lambda: subprocess.check_output(["paq8l", "-d", filename + '.paq8l'],
+                                                                            cwd=scratch_dir,
+                                                                            stderr=subprocess.STDOUT),
+                                            number=1,
+                                            repeat=3))
 
     cd = CompressionData(original_size, compressed_size, decompress_time)
 
@@ -181,84 +238,107 @@ def paq8l_compress(inputfile, level, decompress):
 def lzma_compress(inputfile, level, decompress):
     """
     (str,int,bool) -> CompressionData
+
+    Compresses one file using the python implementation of lzma (see
+    lzma_compress_bytes).
+    """
+    return file_compress(lzma_compress_bytes, inputfile, level, decompress)
+
+
+def lzma_compress_bytes(data, level, decompress):
+    """
+    (memoryview,int,bool) -> CompressionData
     
-    Compresses one file using the python implementation of lzma.
+    Compresses a buffer using the python implementation of lzma.
     
     NOTE: The lzma module was created for python3, the backported version for 
     python2.7, does not have a level parameter, a decision was made to keep this
     code backwards compatible so the level parameter is never used. The 
     default the level being used is 6.
      """
-
-    original_size = int(os.stat(inputfile).st_size)
-    with open(inputfile, "rU") as fdorig:
-        origlines = fdorig.read()
-    origtext = memoryview(bytearray(origlines, "utf8"))
-    compressedtext = memoryview(lzma.compress(origtext.tobytes()))
-    compressed_size = len(compressedtext)
+    compressedtext = lzma.compress(data)
 
     decompress_time = None
     if decompress:
-        decompress_time = min(timeit.repeat(lambda: lzma.decompress(compressedtext.tobytes()),
+        decompress_time = min(timeit.repeat(lambda: lzma.decompress(compressedtext),
                                             number=10,
-                                            repeat=3, timer=time.clock))
+                                            repeat=3, timer=time.thread_time))
 
-    cd = CompressionData(original_size, compressed_size, decompress_time)
-
-    return cd
+    return CompressionData(data.nbytes, len(compressedtext), decompress_time)
 
 
 def bzip2_compress(inputfile, level, decompress):
     """
     (str, int, bool) -> CompressionData
     
-    Compresses one file using the python implementation of bzip2.
+    Compresses one file using the python implementation of bzip2 (see
+    bzip2_compress_bytes).
+    """
+    return file_compress(bzip2_compress_bytes, inputfile, level, decompress)
 
+
+def bzip2_compress_bytes(data, level, decompress):
     """
+    (memoryview, int, bool) -> CompressionData
+
+    Compresses a buffer using the python implementation of bzip2.
 
-    original_size = int(os.stat(inputfile).st_size)
-    with open(inputfile, "rU") as fdorig:
-        origlines = fdorig.read()
-    origtext = memoryview(bytearray(origlines, "utf8"))
-    compressedtext = memoryview(bz2.compress(origtext.tobytes(), level))
-    compressed_size = len(compressedtext)
+    """
+    compressedtext = bz2.compress(data, level)
 
     decompress_time = None
     if decompress:
-        decompress_time = min(timeit.repeat(lambda: bz2.decompress(compressedtext.tobytes()),
+        decompress_time = min(timeit.repeat(lambda: bz2.decompress(compressedtext),
                                             number=10,
-                                            repeat=3, timer=time.clock))
-
-    cd = CompressionData(original_size, compressed_size, decompress_time)
+                                            repeat=3, timer=time.thread_time))
 
-    return cd
+    return CompressionData(data.nbytes, len(compressedtext), decompress_time)
 
 
 def ppmd_compress(inputfile, level, decompress):
     """
     (str, int, bool) -> CompressionData
 
-    Compresses one file using the ppmd compressor.
+    Compresses one file using the ppmd compressor (see
+    external_compress).
+    """
+    return external_compress(ppmd_compress_scratch, inputfile, level, decompress)
+
+
+def ppmd_compress_bytes(data, level, decompress):
+    """
+    (memoryview, int, bool) -> CompressionData
+
+    Compresses a buffer using the ppmd compressor (see
+    external_compress_bytes).
+    """
+    return external_compress_bytes(ppmd_compress_scratch, data, level, decompress)
+
+
+def ppmd_compress_scratch(scratchfile, level, decompress):
+    """
+    (str, int, bool) -> CompressionData
+
+    Compresses a file in a scratch directory using the ppmd compressor.
     
     NOTE: This algorithm does not have a standard level, but the model
     order behaves as a compression level, so level here refers to the
     order level. Maximum memory is always used.
     """
-    subprocess.call('ppmd e -s -f"%s.ppmd" -m256 -o%d "%s"' % (inputfile, level, inputfile),
-                    shell=True)
-    original_size = int(os.stat(inputfile).st_size)
-    compressed_size = int(os.stat(inputfile + '.ppmd').st_size)
+    scratch_dir, filename = os.path.split(scratchfile)
+    subprocess.call(["ppmd", "e", "-s", "-f%s.ppmd" % filename, "-m256", "-o%d" % level, filename], cwd=scratch_dir,
+                    stdout=subprocess.DEVNULL)
+    original_size = int(os.stat(scratchfile).st_size)
+    compressed_size = int(os.stat(scratchfile + '.ppmd').st_size)
 
     decompress_time = None
     if decompress:
-        decompress_time = min(
-            timeit.repeat(
-                'subprocess.call(\'ppmd d -s "%s.ppmd"\',shell=True,stderr=subprocess.STDOUT)' % inputfile,
-                number=5,
-                repeat=3,
-                setup='import subprocess'))
-
-    os.remove('%s.ppmd' % inputfile)
+        decompress_time = min(timeit.repeat(lambda: subprocess.call(["ppmd", "d", "-s", filename + '.ppmd'],
+                                                                    cwd=scratch_dir,
+                                                                    stdout=subprocess.DEVNULL,
+                                                                    stderr=subprocess.STDOUT),
+                                            number=5,
+                                            repeat=3))
 
     cd = CompressionData(original_size, compressed_size, decompress_time)
 
@@ -269,16 +349,34 @@ def spbio_compress(inputfile, level, decompress):
     """
     (str, int, bool) -> CompressionData
 
-    Compresses one file using the spbio tool.
+    Compresses one file using the spbio tool (see external_compress).
+    """
+    return external_compress(spbio_compress_scratch, inputfile, level, decompress)
+
+
+def spbio_compress_bytes(data, level, decompress):
+    """
+    (memoryview, int, bool) -> CompressionData
+
+    Compresses a buffer using the spbio tool (see external_compress_bytes).
+    """
+    return external_compress_bytes(spbio_compress_scratch, data, level, decompress)
+
+
+def spbio_compress_scratch(scratchfile, level, decompress):
+    """
+    (str, int, bool) -> CompressionData
+
+    Compresses a file in a scratch directory using the spbio tool.
 
     NOTE: This compressor is only available for Windows and has no
     compression levels.
     """
-    os.system('spbio "' + inputfile + '"')
-    original_size = int(os.stat(inputfile).st_size)
-    compressed_size = int(os.stat(inputfile + '.sph').st_size)
-    os.remove(inputfile + '.sph')
-    return original_size, compressed_size
+    scratch_dir, filename = os.path.split(scratchfile)
+    subprocess.call(["spbio", filename], cwd=scratch_dir)
+    original_size = int(os.stat(scratchfile).st_size)
+    compressed_size = int(os.stat(scratchfile + '.sph').st_size)
+    return CompressionData(original_size, compressed_size, None)
 
 
 def brotli_compress(infile, level, decompress):
@@ -288,31 +386,150 @@ def brotli_compress(infile, level, decompress):
     @param decompress
     @return CompressionData
 
-    Compresses one file using the brotli algorithm by google.
+    Compresses one file using the brotli algorithm by google (see
+    brotli_compress_bytes).
+
+    """
+    return file_compress(brotli_compress_bytes, infile, level, decompress)
+
 
+def brotli_compress_bytes(data, level, decompress):
     """
+    @param data
+    @param level
+    @param decompress
+    @return CompressionData
+
+    Compresses a buffer using the brotli algorithm by google.
 
-    original_size = int(os.stat(infile).st_size)
-    with open(infile, "rU") as fdorig:
-        origlines = fdorig.read()
-    origtext = memoryview(bytearray(origlines, "utf8"))
-    # compressedtext = memoryview(zlib.compress(origtext.tobytes(), int(level)))
-    compressedtext = memoryview(brotli.compress(origtext.tobytes(), quality=int(level)))
-    compressed_size = len(compressedtext)
+    """
+    compressedtext = brotli.compress(data, quality=int(level))
 
     decompress_time = None
     if decompress:
-        decompress_time = min(timeit.repeat(lambda: zlib.decompress(compressedtext.tobytes()),
+        decompress_time = min(timeit.repeat(lambda: brotli.decompress(compressedtext),
                                             number=10,
-                                            repeat=3, timer=time.clock))
-
-    cd = CompressionData(original_size, compressed_size, decompress_time)
+                                            repeat=3, timer=time.thread_time))
 
-    return cd
+    return CompressionData(data.nbytes, len(compressedtext), decompress_time)
 
 
 # AUXILIARY FUNCTIONS
 
+def compression_executor(compression_algorithm):
+    """
+    (str) -> class
+
+    !!!Auxiliary function!!! The executor class the files compressed with
+    compression_algorithm are spread over (see pool.run_in_pool). The python
+    compressors release the GIL while they compress, so their workers are
+    threads; the EXTERNAL_COMPRESSORS' workers are processes, each waiting on
+    its compressor.
+    """
+    if compression_algorithm in EXTERNAL_COMPRESSORS:
+        return ProcessPoolExecutor
+    return ThreadPoolExecutor
+
+
+def compress_parameters(inputfile, compression_algorithm, level):
+    """
+    (str, str, int) -> tuple
+
+    !!!Auxiliary function!!! The parameters a file's compressed size depends
+    on, besides its contents (see cache.cached). The external compressors
+    store the file's name in the compressed file, so it is one of them.
+    """
+    if compression_algorithm in EXTERNAL_COMPRESSORS:
+        return "compress", compression_algorithm, level, os.path.basename(inputfile)
+    return "compress", compression_algorithm, level
+
+
+def file_compress(method_to_call, inputfile, level, decompress):
+    """
+    (function, str, int, bool) -> CompressionData
+
+    !!!Auxiliary function!!! Compress the contents of inputfile (see
+    read_data) with one of the buffer compressors, the original size is the
+    size of the file.
+    """
+    compression_data = method_to_call(memoryview(read_data(inputfile)), level, decompress)
+    return compression_data._replace(original=int(os.stat(inputfile).st_size))
+
+
+def external_compress(method_to_call, inputfile, level, decompress):
+    """
+    (function, str, int, bool) -> CompressionData
+
+    !!!Auxiliary function!!! Compress a file with one of the external
+    compressors: its contents are copied to a scratch file with the same
+    name (the compressors store the name in the compressed file, so the
+    sizes don't depend on where the file is) and compressed there (see
+    external_compress_bytes).
+    """
+    with open(inputfile, "rb") as fdorig:
+        data = fdorig.read()
+    return external_compress_bytes(method_to_call, memoryview(data), level, decompress, os.path.basename(inputfile))
+
+
+def external_compress_bytes(method_to_call, data, level, decompress, filename="data"):
+    """
+    (function, memoryview, int, bool, str) -> CompressionData
+
+    !!!Auxiliary function!!! Compress a buffer with one of the external
+    compressors, which only read files: the data is written to a file named
+    filename in a scratch directory of its own, compressed there with
+    method_to_call (which runs the compressor in that directory, so every
+    file it writes is also there) and the directory removed.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="hrfanalyse_", dir=SCRATCH_ROOT)
+    try:
+        scratchfile = os.path.join(scratch_dir, filename)
+        with open(scratchfile, "wb") as fdout:
+            fdout.write(data)
+        return method_to_call(scratchfile, level, decompress)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def read_data(inputfile):
+    """
+    (str) -> bytes
+
+    !!!Auxiliary function!!! Read the contents of inputfile as the
+    compressors see them, with the line endings translated to '\\n' as when
+    the file is read as text.
+    """
+    with open(inputfile, "rb") as fdorig:
+        data = fdorig.read()
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data
+
+
+def valid_level(compression_algorithm, level):
+    """
+    (str, int) -> int
+
+    !!!Auxiliary function!!! Return level, or the compressor's maximum or
+    minimum level if it is above or below them.
+    """
+    if level > AVAILABLE_COMPRESSORS[compression_algorithm][1]:
+        level = AVAILABLE_COMPRESSORS[compression_algorithm][1]
+    elif level < AVAILABLE_COMPRESSORS[compression_algorithm][0]:
+        level = AVAILABLE_COMPRESSORS[compression_algorithm][0]
+    return level
+
+
+"""The compressors that run as external programs, with their minimum and
+maximum levels"""
+EXTERNAL_COMPRESSORS = {"paq8l": (1, 8), "ppmd": (2, 16), "spbio": (-1, -1)}
+
+"""Directory where the external compressors' scratch directories are made,
+a tmpfs when there is one (so their files never reach the disk), otherwise
+the system's temporary directory"""
+SCRATCH_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
 def test_compressors():
     """
     (NoneType) -> NoneType
@@ -324,7 +541,7 @@ def test_compressors():
     if there are no levels implemented both minimum and maximum are
     -1.
     """
-    compressor_list = {"paq8l": (1, 8), "ppmd": (2, 16), "spbio": (-1, -1)}
+    compressor_list = EXTERNAL_COMPRESSORS
     available = dict()
     available["gzip"] = (1, 9)
     available["bzip2"] = (1, 9)
@@ -347,13 +564,14 @@ def test_compressors():
 AVAILABLE_COMPRESSORS = test_compressors()
 
 
-def add_parser_options(parser):
+def add_parser_options(parser, jobs_option=True, cache_option=True):
     """
-    (argparse.ArgumentParser) -> NoneType
+    (argparse.ArgumentParser, bool, bool) -> NoneType
 
     !!!Auxiliary function!!!  These are arguments for an argparse
     parser or subparser, and are the parameters taken by the entry function 
-    in this module
+    in this module. The jobs_option and cache_option disable/enable the
+    presence of the jobs and cache options (see cache.add_parser_options).
 
     """
     parser.add_argument("-c",
@@ -376,6 +594,18 @@ def add_parser_options(parser):
                         action="store",
                         type=int,
                         help="compression level to be used, this variable is compressor dependent; default:[The maximum of wathever compressor was chosen]")
+    if jobs_option:
+        parser.add_argument("-j",
+                            "--jobs",
+                            dest="jobs",
+                            metavar="N",
+                            action="store",
+                            type=job_count,
+                            default=1,
+                            help="Number of files compressed at the same time (threads for the python compressors, "
+                                 "processes for the external ones); default:[%(default)s]")
+    if cache_option:
+        cache.add_parser_options(parser)
 
 
 def set_level(options):
@@ -38,9 +38,7 @@ level, decompress):
 """
 
 import sys
-import os
 import compress
-import tempfile
 
 
 # ENTRY POINT FUNCTION
@@ -79,22 +77,12 @@ def nid(filename1, filename2, compressor, level, decompress):
     RETURN: A float that represents the distance between the two files.
 
     """
-    file_total_data = []
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    with open(filename1, "r") as file1:
-        file_total_data += file1.readlines()
-    with open(filename2, "r") as file2:
-        file_total_data += file2.readlines()
-    for line in file_total_data:
-        temp_file.write(line)
-    temp_file.close()
-
-    file1_cdata = compress.compress(filename1, compressor, level, decompress)[filename1]
-    file2_cdata = compress.compress(filename2, compressor, level, decompress)[filename2]
-    temp_file_cdata = compress.compress(temp_file.name,
-                                        compressor,
-                                        level,
-                                        decompress)[temp_file.name]
+    file1_data = compress.read_data(filename1)
+    file2_data = compress.read_data(filename2)
+
+    file1_cdata = compress.compress_bytes(file1_data, compressor, level, decompress)
+    file2_cdata = compress.compress_bytes(file2_data, compressor, level, decompress)
+    temp_file_cdata = compress.compress_bytes(file1_data + file2_data, compressor, level, decompress)
 
     if decompress:
         dist = (temp_file_cdata.time - min(file1_cdata.time, file2_cdata.time)) / float(
@@ -103,7 +91,6 @@ def nid(filename1, filename2, compressor, level, decompress):
         dist = (temp_file_cdata.compressed - min(file1_cdata.compressed, file2_cdata.compressed)) / float(
                 max(file1_cdata.compressed, file2_cdata.compressed))
 
-    os.unlink(temp_file.name)
     return dist
 
 
@@ -127,17 +114,14 @@ def d1(filename1, filename2, compressor, level, decompress):
     Return: A float that represents the distance between the two
     files.
 
-    Algorithm: Both files are opened and their content concatenated in
-    a temporary file. Compression is then calculated for each file
-    including the concatenation file, and the formula is applied.
+    Algorithm: Both files are read and their content concatenated in
+    memory. Compression is then calculated for each file including the
+    concatenations (see compress.compress_bytes), and the formula is
+    applied.
     """
-
-    file1_file2, file2_file1 = create_concatenated_files(filename1, filename2)
-
-    file1_cdata = compress.compress(filename1, compressor, level, decompress)[filename1]
-    file2_cdata = compress.compress(filename2, compressor, level, decompress)[filename2]
-    file1_file2_cdata = compress.compress(file1_file2.name, compressor, level, decompress)[file1_file2.name]
-    file2_file1_cdata = compress.compress(file2_file1.name, compressor, level, decompress)[file2_file1.name]
+    file1_cdata, file2_cdata, file1_file2_cdata, file2_file1_cdata = concatenated_compression(filename1, filename2,
+                                                                                            compressor, level,
+                                                                                            decompress)
 
     if decompress:
         # this float conversion will become unecessary if the code is ever migrated to python3
@@ -148,9 +132,6 @@ def d1(filename1, filename2, compressor, level, decompress):
                    file2_file1_cdata.compressed - file2_cdata.compressed) / float(
                 max(file1_cdata.compressed, file2_cdata.compressed))
 
-    # os.unlink(file1_file2.name)
-    #    os.unlink(file2_file1.name)
-
     return dist
 
 
@@ -174,16 +155,14 @@ def d2(filename1, filename2, compressor, level, decompress):
     Return: A float that represents the distance between the two
     files.
 
-    Algorithm: Both files are opened and their content concatenated in
-    a temporary file. Compression is then calculated for each file
-    including the concatenation file, and the formula is applied.
+    Algorithm: Both files are read and their content concatenated in
+    memory. Compression is then calculated for each file including the
+    concatenations (see compress.compress_bytes), and the formula is
+    applied.
     """
-    file1_file2, file2_file1 = create_concatenated_files(filename1, filename2)
-
-    file1_cdata = compress.compress(filename1, compressor, level, decompress)[filename1]
-    file2_cdata = compress.compress(filename2, compressor, level, decompress)[filename2]
-    file1_file2_cdata = compress.compress(file1_file2.name, compressor, level, decompress)[file1_file2.name]
-    file2_file1_cdata = compress.compress(file2_file1.name, compressor, level, decompress)[file2_file1.name]
+    file1_cdata, file2_cdata, file1_file2_cdata, file2_file1_cdata = concatenated_compression(filename1, filename2,
+                                                                                            compressor, level,
+                                                                                            decompress)
 
     if decompress:
         dist = (file1_file2_cdata.time - file1_cdata.time + file2_file1_cdata.time - file2_cdata.time) / (
@@ -192,31 +171,25 @@ def d2(filename1, filename2, compressor, level, decompress):
         dist = (file1_file2_cdata.compressed - file1_cdata.compressed + file2_file1_cdata.compressed -
                 file2_cdata.compressed) / (1 / 2.0 * (file1_file2_cdata.compressed + file2_file1_cdata.compressed))
 
-    os.unlink(file1_file2.name)
-    os.unlink(file2_file1.name)
-
     return dist
 
 
 # AUXILIARY FUNCTION
 
-def create_concatenated_files(filename1, filename2):
-    file1_file2 = tempfile.NamedTemporaryFile(delete=False)
-    file2_file1 = tempfile.NamedTemporaryFile(delete=False)
-    with open(filename1, "r") as file1:
-        with open(filename2, "r") as file2:
-            file1_data = file1.readlines()
-            file2_data = file2.readlines()
-            file1_file2_data = file1_data + file2_data
-            file2_file1_data = file2_data + file1_data
-    for line in file1_file2_data:
-        file1_file2.write(line)
-    for line in file2_file1_data:
-        file2_file1.write(line)
-
-    file1_file2.close()
-    file2_file1.close()
-    return file1_file2, file2_file1
+def concatenated_compression(filename1, filename2, compressor, level, decompress):
+    """
+    !!!Auxiliary function!!! Compress the contents of both files and of
+    their concatenations in both orders, all in memory.
+
+    Arguments: filename for both files, compressor, level of compression,
+    bool decompress.
+
+    Return: The CompressionData of f1, f2, f1.f2 and f2.f1.
+    """
+    file1_data = compress.read_data(filename1)
+    file2_data = compress.read_data(filename2)
+    return [compress.compress_bytes(data, compressor, level, decompress)
+            for data in (file1_data, file2_data, file1_data + file2_data, file2_data + file1_data)]
 
 
 def add_parser_options(parser):
@@ -238,6 +211,6 @@ def add_parser_options(parser):
     d2 = parser.add_parser('d2',
                            help="Distance 2 ( d2(f1,f2) = c(f1.f2) − c(f1) + c(f2.f1) − c(f2)/( 1/2*(c(f1.f2) + c(f2.f1)))) proposed in the article --> http://www.dm.unibo.it/~farinell/paginelink/articolinostri/HRVLZ.pdf")
 
-    compress.add_parser_options(nid)
-    compress.add_parser_options(d1)
-    compress.add_parser_options(d2)
+    compress.add_parser_options(nid, jobs_option=False, cache_option=False)
+    compress.add_parser_options(d1, jobs_option=False, cache_option=False)
+    compress.add_parser_options(d2, jobs_option=False, cache_option=False)
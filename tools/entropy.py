@@ -22,97 +22,281 @@ _______________________________________________________________________________
 This module implements the calculation of entropy (sample and aproximate since 
 after some testing these seem to be the only ones that have significant results 
 for our specific purposes. Some of the functions are calls to the pyeeg 
-implementation.
+implementation. The permutation entropy (permen) is also available, it has no
+tolerance, and so are the Hurst exponent (hurst), the DFA scaling exponents
+(dfa) and the largest Lyapunov exponent (lle), which are not entropies but are
+calculated on the same files, blocks and scales.
 
 
 MODULE EXTERNAL DEPENDENCIES:
 pyeeg(http://code.google.com/p/pyeeg/downloads/list),
 numpy(http://numpy.scipy.org/),
+scipy(http://www.scipy.org/) is optional, it is only needed by the kdtree backend.
 
-ENTRY POINT: entropy(input_name,function,dimension,tolerances)
-             calculate_std(input_name)
+ENTRY POINT: entropy(input_name,function,dimension,tolerances,backend,jobs,cache_dir)
+             series_entropy(X,function,dimension,tolerance,backend,cache_dir)
+             sampen_blocks(blocks_dir,dimension,tolerances,backend,jobs,cache_dir)
+             calculate_std(input_name,jobs)
 """
 
 import sys
-from tools.pyeeg import samp_entropy, ap_entropy
+import logging
+from tools.pyeeg import embed_seq
+from tools import pyeeg
+from tools import cache
+from tools.pool import run_in_pool, job_count
 import os
 import numpy
 from collections import namedtuple
 
+try:
+    from scipy.spatial import cKDTree
+
+    scipy_available = True
+except ImportError:
+    scipy_available = False
+
+module_logger = logging.getLogger('hrfanalyse.entropy')
+
 # DATA TYPE DEFINITIONS
 """This is a data type defined to be used as a return for entropy; it
 contains the number of points in the file, and the file's entropy"""
 EntropyData = namedtuple('EntropyData', 'points entropy')
 
+"""Number of template rows the blocked kernels compare against all the other
+templates at a time. Peak memory is proportional to BLOCK_SIZE times the
+number of points in the series, so lower it for very long recordings."""
+BLOCK_SIZE = 256
+
+"""Number of templates (a multiple of 64) the packed backend compares a block
+of rows with at a time before packing the matches into bits, so its peak
+memory is that of the bitmaps plus BLOCK_SIZE times this number of floats."""
+PACKED_COLUMNS = 1024
+
+"""The backends sampen and apen can use to count template matches, they all
+give the same result (see match_counts)"""
+AVAILABLE_BACKENDS = ["discrete", "blocked", "packed", "sorted"]
+if scipy_available:
+    AVAILABLE_BACKENDS.append("kdtree")
+DEFAULT_BACKEND = "discrete"
+
+"""Number of bits set in each byte, to count the bits of the packed
+backend's words when numpy has no bitwise_count"""
+POPCOUNT_TABLE = numpy.array([bin(byte).count("1") for byte in range(256)], dtype=numpy.uint8)
+
+"""Biggest histogram (in cells, one per possible template) the discrete
+backend builds; for series with more distinct values (or longer templates) it
+falls back to the blocked backend."""
+DISCRETE_MAX_CELLS = 2 ** 22
+
+"""Largest block (in points) sampen_blocks slides over, the sliding kernel
+keeps the distances between all the templates of a block so its memory is
+proportional to the square of this number; bigger blocks are calculated one
+at a time with the chosen backend."""
+SLIDING_MAX_POINTS = 4096
+
+"""The box lengths over which the DFA scaling exponents are fitted, alpha1
+(short term) and alpha2 (long term) as in Peng et al. (1995)"""
+DFA_BOX_LENGTHS = {1: numpy.arange(4, 17), 2: numpy.arange(16, 65)}
+
+"""How the DFA boxes of each length are taken, consecutive boxes (as in pyeeg)
+or every box, one starting at each point"""
+DFA_BOXES = ["consecutive", "overlap"]
+
+"""The embedding lag of the largest Lyapunov exponent and its Theiler window,
+the number of points on either side of each vector that can't be its nearest
+neighbour (about one mean period)"""
+LLE_LAG = 1
+LLE_THEILER_WINDOW = 10
+
+"""Relative error allowed in the k-d tree's distances, distances this close
+are checked again for ties"""
+KDTREE_TIE_TOLERANCE = 1e-9
+
 
 # ENTRY POINT FUNCTION
-def entropy(input_name, function, dimension, tolerances):
+def entropy(input_name, function, dimension, tolerances, backend=DEFAULT_BACKEND, jobs=1, cache_dir=None):
     """
-    (str, str, int, float) -> EntropyData
+    (str, str, int, dict of str: float, str, int, str) -> dict of str: EntropyData
     
     Given a file or directory named input_name, calculate the desired
-    entropy to all the files.
+    entropy to all the files. The dimension and the tolerance for a file may
+    also be lists, in which case its entry in the result is a list with one
+    entry per dimension (each with one EntropyData per tolerance).
 
-    NOTE: This functions last two parameters are specific for the entropy 
+    The files in a directory are spread over jobs processes, a file whose
+    calculation fails (or that has no tolerance, because its std could not
+    be calculated) is reported in the log and left out of the result. With a
+    cache_dir the entropies of files that were already calculated with the
+    same parameters are read from the cache (see cache.cached).
+
+    NOTE: This functions last three parameters are specific for the entropy 
     calculating algorithms we are using (both apen and sampen use the dimension
-    and tolerance parameters.
+    and tolerance parameters, and count the template matches with the chosen
+    backend; apenv2 has its own counting scheme and ignores it, permen uses the
+    dimension as its order and ignores the other two, hurst ignores them all,
+    dfa uses the dimension as the exponent and the backend as the box
+    layout, and lle uses the dimension as the embedding dimension).
     """
 
     method_to_call = getattr(sys.modules[__name__], function)
-    entropy_dict = {}
     if os.path.isdir(input_name):
         filelist = os.listdir(input_name)
-        for filename in filelist:
-            entropyData = method_to_call(os.path.join(input_name, filename.strip()), dimension, tolerances[filename])
-            entropy_dict[filename.strip()] = entropyData
+        file_arguments = dict((filename.strip(), (os.path.join(input_name, filename.strip()), dimension,
+                                                  tolerances[filename], backend))
+                              for filename in filelist if filename in tolerances)
     else:
         tolerances = tolerances[list(tolerances.keys())[0]]
-        entropyData = method_to_call(input_name.strip(), dimension, tolerances)
-        entropy_dict[input_name.strip()] = entropyData
-    return entropy_dict
+        file_arguments = {input_name.strip(): (input_name.strip(), dimension, tolerances, backend)}
+
+    def calculate(filenames):
+        if os.path.isdir(input_name):
+            return run_in_pool(method_to_call, dict((filename, file_arguments[filename]) for filename in filenames),
+                               jobs)
+        return dict((filename, method_to_call(*file_arguments[filename])) for filename in filenames)
+
+    files = dict((filename, (file_arguments[filename][0], ("entropy", function) + file_arguments[filename][1:]))
+                 for filename in file_arguments)
+    return cache.cached(cache_dir, files, calculate)
+
+
+def sampen_blocks(blocks_dir, dimension, tolerances, backend=DEFAULT_BACKEND, jobs=1, cache_dir=None, sliding=False):
+    """
+    (str, int or list of int, dict of str: float or list of float, str, int, str, bool) -> dict of str: EntropyData
+
+    Calculate the sample entropy of all the blocks in blocks_dir, the files
+    <name>_1, <name>_2, ... written by tools.partition for a file cut in
+    (possibly overlapping) blocks. The result is the same as the one from
+    entropy(blocks_dir, "sampen", dimension, tolerances). With the backends
+    that compare every pair of templates (blocked and packed, and discrete
+    on real valued blocks, where it falls back to blocked) consecutive blocks
+    that overlap share the distances between the templates they have in
+    common (see sliding_samp_entropy), which is faster than calculating each
+    block from scratch. The other backends (discrete on integer valued
+    blocks, sorted and kdtree) skip most pairs and are faster on each block
+    on its own, so they slide only if sliding is True. Blocks bigger than
+    SLIDING_MAX_POINTS are always calculated on their own.
+
+    With more than one job the blocks are split into jobs runs of
+    consecutive blocks, and each run is slid over in its own process. The
+    cache is shared with entropy, only the blocks that aren't in it are
+    calculated (see sampen_block_files).
+    """
+    filelist = [filename.strip() for filename in os.listdir(blocks_dir)]
+    files = dict((filename, (os.path.join(blocks_dir, filename),
+                             ("entropy", "sampen", dimension, tolerances[filename], backend)))
+                 for filename in filelist)
+    return cache.cached(cache_dir, files,
+                        lambda filenames: sampen_block_files(blocks_dir, filenames, dimension, tolerances, backend,
+                                                             jobs, sliding))
 
 
-def calculate_std(input_name):
+def series_entropy(X, function, dimension, tolerance, backend=DEFAULT_BACKEND, cache_dir=None):
     """
-    (str) -> dict of str : float
+    (list, str, int or list of int, float or list of float, str, str) -> EntropyData or list of EntropyData
+
+    Calculate the entropy named function (sampen, apen or apenv2) of the
+    values in X, the result is the same as calling that function on a file
+    with these values. With a cache_dir an entropy already calculated for
+    the same values and parameters is read from the cache (see
+    cache.cached_value).
+    """
+    method_to_call = SERIES_FUNCTIONS[function]
+    return cache.cached_value(cache_dir, numpy.ascontiguousarray(X, dtype=float),
+                              ("series_entropy", function, dimension, tolerance, backend),
+                              lambda: entropy_data(len(X), method_to_call(X, dimension, tolerance, backend)))
+
+
+def calculate_std(input_name, jobs=1):
+    """
+    (str, int) -> dict of str : float
 
     Function to calculate the standard deviation for the values in a file/directory.
     Returns a dictionary that associate filenames to their respective std.
+    The files in a directory are spread over jobs processes. The stds give
+    the tolerances, so a file that can't be read is reported in the log and
+    raises a ValueError once the others are done, it is never left without
+    a tolerance.
     
     """
-    files_std = {}
     if os.path.isdir(input_name):
         filelist = os.listdir(input_name)
-        for filename in filelist:
-            files_std[filename] = calculate_file_std(os.path.join(input_name, filename))
+        files_std = run_in_pool(calculate_file_std, dict((filename, (os.path.join(input_name, filename),))
+                                                         for filename in filelist), jobs)
+        failed = sorted(set(filelist) - set(files_std))
+        if failed:
+            raise ValueError("No standard deviation for %s" % ', '.join(failed))
     else:
+        files_std = {}
         files_std[input_name] = calculate_file_std(input_name)
     return files_std
 
 
 # IMPLEMENTATION
-def apen(filename, dimension, tolerance):
+def sampen_block_files(blocks_dir, filelist, dimension, tolerances, backend, jobs, sliding=False):
+    """
+    (str, list of str, int or list of int, dict of str: float or list of float, str, int, bool)
+    -> dict of str: EntropyData
+
+    Calculate the sample entropy of the blocks in filelist (from blocks_dir)
+    as described in sampen_blocks, the blocks are taken in their order in
+    the file they were cut from.
+    """
+    filelist = sorted(filelist, key=lambda filename: int(filename.rsplit('_', 1)[1]))
+    blocks = []
+    for filename in filelist:
+        with open(os.path.join(blocks_dir, filename), 'r') as file_d:
+            blocks.append(list(map(float, file_d.readlines())))
+    block_tolerances = [tolerances[filename] for filename in filelist]
+    all_pairs = backend in ("blocked", "packed") or \
+        (backend == "discrete" and not all(integer_valued(numpy.asarray(block)) for block in blocks))
+    if max([len(block) for block in blocks] + [0]) > SLIDING_MAX_POINTS or not (all_pairs or sliding):
+        block_entropies = run_in_pool(samp_entropy, dict((filename, (block, dimension, block_tolerance, backend))
+                                                         for filename, block, block_tolerance
+                                                         in zip(filelist, blocks, block_tolerances)), jobs)
+    else:
+        n_runs = min(jobs, len(blocks))
+        run_arguments = {}
+        for run in range(n_runs):
+            run_blocks = slice(run * len(blocks) // n_runs, (run + 1) * len(blocks) // n_runs)
+            series, windows = block_windows(blocks[run_blocks])
+            run_arguments[run] = (series, windows, dimension, block_tolerances[run_blocks])
+        run_entropies = run_in_pool(sliding_samp_entropy, run_arguments, jobs)
+        block_entropies = {}
+        for run in run_entropies:
+            run_blocks = slice(run * len(blocks) // n_runs, (run + 1) * len(blocks) // n_runs)
+            block_entropies.update(zip(filelist[run_blocks], run_entropies[run]))
+    return dict((filename, entropy_data(len(block), block_entropies[filename]))
+                for filename, block in zip(filelist, blocks) if filename in block_entropies)
+
+
+def apen(filename, dimension, tolerance, backend=DEFAULT_BACKEND):
     """
-    (str, int, float) -> EntropyData
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
 
-    Given a filename, calculate the aproximate entropy. 
+    Given a filename, calculate the aproximate entropy. If a list of
+    dimensions and/or tolerances is given the result is a list with one entry
+    per dimension (each with one EntropyData per tolerance).
 
-    NOTE: Pyeeg implementation    
+    NOTE: Same result as the pyeeg implementation, the template matches are
+    counted with the chosen backend (see ap_entropy).
     """
     with open(filename, "r") as file_d:
         file_data = file_d.readlines()
     file_data = list(map(float, file_data))
-    return EntropyData(len(file_data), ap_entropy(file_data, dimension, tolerance))
+    return entropy_data(len(file_data), ap_entropy(file_data, dimension, tolerance, backend))
 
 
-def apenv2(filename, dimension, tolerance):
+def apenv2(filename, dimension, tolerance, backend=None):
     """
-    (str, int, float) -> EntropyData
+    (str, int, float, str) -> EntropyData
     
     An implementation of Aproximate entropy. The explanation of the algorithm is 
     a bit long because it is a little different from the original version it was 
-    based on. Although it is still an O(mn2) worst case algorithm it tends to get
-    better time by discarting some calculations.
+    based on. Although it is still an O(n2) algorithm it gets much better time
+    by working on whole diagonals of the matrix at a time. The backend parameter
+    is not used, it only exists so all the entropy functions have the same
+    signature.
 
     BIBLIGRAPHICAL REFERENCE:
     Fusheng, Y., Bo, H. and Qingyu, T. (2000) Approximate Entropy and Its 
@@ -157,59 +341,81 @@ def apenv2(filename, dimension, tolerance):
     and Nmp. Finaly the Phi's are calculated by avaraging the Cm and Cmp vectors
     and the entropy value is the subtraction of Phi of Cm and Phi of Cmp.
     
-    (*)As an implementatio boost we use this knowledge to skip some cell whose value
-    we already know to be 0. This is done by creating a burned_indexes that contains 
-    the columns we want to jump over in the upcoming rows. The columns are kept 
-    in a dictionary so the test if a particular column is to jumped is O(1).
+    (*)As an implementation boost we use this knowledge to work a whole
+    diagonal of the Crm matrix at a time. For the diagonal of the cells (i, i+d)
+    we first mark every pair of points (p, p+d) whose distance is bigger than
+    the tolerance. Crm(i, i+d) is 1 if none of the m pairs from (i, i+d) to
+    (i+m-1, i+d+m-1) is marked, so a running count of the marks along the
+    diagonal tells us every cell of the diagonal at once (the cell is 1 when
+    the count does not change over its m pairs), and the same running count
+    gives the Crm+1 cells. Each diagonal is a handful of vector operations, so
+    the calculation is still O(n2) but without any python level loop over the
+    cells. Since every cell is either 0 or 1 for the same reasons as above the
+    result is exactly the same as the original cell by cell implementation.
     
     """
 
     with open(filename, "r") as file_d:
         file_data = file_d.readlines()
     file_data = list(map(float, file_data))
+    return entropy_data(len(file_data), ap_entropy_v2(file_data, dimension, tolerance))
 
-    data_len = len(file_data)
 
-    Nm = [data_len - dimension + 1] * (data_len - dimension + 1)
-    Nmp = [data_len - dimension] * (data_len - dimension)
-    burned_indexes = [{} for i in range(data_len - dimension + 1)]
+def ap_entropy_v2(X, M, R, backend=None):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
 
-    for i in range(0, data_len - (dimension - 1)):
-        if i > 0:
-            burned_indexes[i - 1] = None
-        for j in range(i + 1, data_len - (dimension - 1)):
-            if j in burned_indexes[i]:
-                continue
-            m = dimension - 1
-            while m >= 0:
-                if abs(file_data[i + m] - file_data[j + m]) > tolerance:
-                    mabove = m
-                    while mabove >= 0:
-                        if i + mabove < data_len - (dimension - 1) and j + mabove < data_len - (dimension - 1):
-                            Nm[i + mabove] -= 1
-                            Nm[j + mabove] -= 1
-                        if i + mabove < data_len - dimension and j + mabove < data_len - dimension:
-                            Nmp[i + mabove] -= 1
-                            Nmp[j + mabove] -= 1
-                        if i + mabove < data_len - dimension + 1 and j + mabove < data_len - dimension + 1:
-                            burned_indexes[i + mabove][j + mabove] = None
-                        mabove -= 1
-                    break
-                m -= 1
-            if m < 0 and i < data_len - dimension and j < data_len - dimension and abs(
-                            file_data[i + dimension] - file_data[j + dimension]) > tolerance:
-                Nmp[i] -= 1
-                Nmp[j] -= 1
+    Aproximate entropy of the series X with dimension M and tolerance R as
+    calculated by apenv2 (see apenv2 for the algorithm). M and R may also be
+    lists, the result is then a list with the entropy for each dimension
+    (which is itself a list with the entropy for each tolerance if R is a list).
+    The backend is ignored, apenv2 has its own counting scheme.
+    """
+    data_len = len(X)
+    dimensions, tolerances = numpy.atleast_1d(M), numpy.atleast_1d(R)
+    counts = diagonal_match_counts(numpy.asarray(X, dtype=float), template_lengths(dimensions), tolerances)
+    Ap_En = []
+    for dimension in dimensions:
+        Ap_En_m = []
+        for Nm, Nmp in zip(counts[dimension], counts[dimension + 1]):
+            Cm = [line / float(data_len - dimension + 1) for line in Nm.tolist()]
+            Cmp = [line / float(data_len - dimension) for line in Nmp.tolist()]
 
-    Cm = [line / float(data_len - dimension + 1) for line in Nm]
-    Cmp = [line / float(data_len - dimension) for line in Nmp]
+            Phi_m = numpy.mean([numpy.log(pos) for pos in Cm])
+            Phi_mp = numpy.mean([numpy.log(pos) for pos in Cmp])
 
-    Phi_m = numpy.mean([numpy.log(pos) for pos in Cm])
-    Phi_mp = numpy.mean([numpy.log(pos) for pos in Cmp])
+            Ap_En_m.append(Phi_m - Phi_mp)
+        Ap_En.append(Ap_En_m if numpy.ndim(R) else Ap_En_m[0])
+    return Ap_En if numpy.ndim(M) else Ap_En[0]
 
-    Ap_En = Phi_m - Phi_mp
 
-    return EntropyData(len(file_data), Ap_En)
+def diagonal_match_counts(X, lengths, tolerances):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray) -> dict of int: numpy.ndarray
+
+    !!!Auxiliary function!!! The Nm vectors of apenv2 for each of the template
+    lengths, one row per tolerance, calculated one diagonal of the Crm matrix
+    at a time. Self-matches are counted and two points are within tolerance
+    unless their distance is bigger than the tolerance (as in the original
+    apenv2).
+    """
+    data_len = len(X)
+    counts = dict((length, numpy.ones((len(tolerances), data_len - length + 1), dtype=numpy.int64))
+                  for length in lengths)
+    for diagonal in range(1, data_len - lengths[0] + 1):
+        distances = numpy.abs(X[:data_len - diagonal] - X[diagonal:])
+        for row, tolerance in enumerate(tolerances):
+            # marks[p] is the number of pairs (q, q+diagonal) with q < p that are not within tolerance
+            marks = numpy.zeros(data_len - diagonal + 1, dtype=numpy.int64)
+            numpy.cumsum(distances > tolerance, out=marks[1:])
+            for length in lengths:
+                n_cells = data_len - length + 1 - diagonal
+                if n_cells <= 0:
+                    continue
+                in_range = marks[length:length + n_cells] == marks[:n_cells]
+                counts[length][row, :n_cells] += in_range
+                counts[length][row, diagonal:diagonal + n_cells] += in_range
+    return counts
 
 
 # def fast_apen(filename,args):
@@ -226,18 +432,829 @@ def apenv2(filename, dimension, tolerance):
 #    
 #    pointArray.sort()
 
-def sampen(filename, dimension, tolerance):
+def sampen(filename, dimension, tolerance, backend=DEFAULT_BACKEND):
     """
-    (str, int, float) -> EntropyData
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
 
-    Given a filename, calculate the sample entropy. 
+    Given a filename, calculate the sample entropy. If a list of dimensions
+    and/or tolerances is given the result is a list with one entry per
+    dimension (each with one EntropyData per tolerance).
 
-    NOTE: Pyeeg implementation    
+    NOTE: Same result as the pyeeg implementation, the template matches are
+    counted with the chosen backend (see samp_entropy).
     """
     with open(filename, 'r') as file_d:
         file_data = file_d.readlines()
     file_data = list(map(float, file_data))
-    return EntropyData(len(file_data), samp_entropy(file_data, dimension, tolerance))
+    return entropy_data(len(file_data), samp_entropy(file_data, dimension, tolerance, backend))
+
+
+def samp_entropy(X, M, R, backend=DEFAULT_BACKEND):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Sample entropy of the series X with dimension M and tolerance R. The
+    result is bit-for-bit the one returned by pyeeg's samp_entropy, the
+    template matches are counted by the match_counts_<backend> function.
+
+    M and R may also be lists, the result is then a list with the entropy for
+    each dimension (which is itself a list with the entropy for each
+    tolerance if R is a list). The distances between templates are
+    calculated only once for all the dimensions and tolerances.
+    """
+    Samp_En = []
+    for dimension_sums in sampen_match_sums(X, numpy.atleast_1d(M), numpy.atleast_1d(R), backend):
+        Samp_En_m = [numpy.log(Cm_sum / Cmp_sum) for Cm_sum, Cmp_sum in dimension_sums]
+        Samp_En.append(Samp_En_m if numpy.ndim(R) else Samp_En_m[0])
+    return Samp_En if numpy.ndim(M) else Samp_En[0]
+
+
+def composite_samp_entropy(series, M, R, backend=DEFAULT_BACKEND, refined=True):
+    """
+    (list of lists, int or list of int, float or list of float, str, bool) -> float or list
+
+    Composite sample entropy of a scale, series has the scale's coarse-grained
+    series, one for each starting point (see multiscale.composite_scales), all
+    with the same tolerance R. With refined (RCMSE) the template matches of
+    all the series are added before taking the log, otherwise (CMSE) the
+    result is the mean of the sample entropy of each series. With a single
+    series both are samp_entropy(series[0], M, R).
+
+    M and R may be lists, as in samp_entropy.
+
+    ALGORITHM: The matches of each series are counted once for all the
+    dimensions and tolerances (see sampen_match_sums), with the same backend
+    as samp_entropy, so RCMSE and CMSE cost the same as the sample entropy of
+    the series, and both come out of the same counts.
+    """
+    dimensions, tolerances = numpy.atleast_1d(M), numpy.atleast_1d(R)
+    series_sums = [sampen_match_sums(X, dimensions, tolerances, backend) for X in series]
+    Samp_En = []
+    for d_index in range(len(dimensions)):
+        Samp_En_m = []
+        for r_index in range(len(tolerances)):
+            sums = [X_sums[d_index][r_index] for X_sums in series_sums]
+            if refined:
+                Samp_En_m.append(numpy.log(sum(Cm_sum for Cm_sum, _ in sums) / sum(Cmp_sum for _, Cmp_sum in sums)))
+            else:
+                Samp_En_m.append(numpy.mean([numpy.log(Cm_sum / Cmp_sum) for Cm_sum, Cmp_sum in sums]))
+        Samp_En.append(Samp_En_m if numpy.ndim(R) else Samp_En_m[0])
+    return Samp_En if numpy.ndim(M) else Samp_En[0]
+
+
+def sliding_samp_entropy(X, windows, M, R):
+    """
+    (list, list of tuples (int, int), int or list of int, list) -> list
+
+    Sample entropy of each window X[start:stop] of the series, with dimension
+    M and the tolerance (or list of tolerances) in R for that window. Each
+    entry of the result is bit-for-bit samp_entropy(X[start:stop], M, R[w]).
+
+    ALGORITHM: The Chebyshev distances between all the templates of the
+    current window are kept (one matrix per template length, used as a ring
+    so nothing is ever copied). When the window slides the distances between
+    the templates that stay in it are reused, the ones of the templates that
+    left are dropped and only the distances from the templates that entered
+    are calculated (see slide_distances), so each step calculates
+    O(gap * window) distances instead of O(window^2). The tolerance may
+    change from window to window (it is usually a fraction of each block's
+    std), so the matching pairs are counted again on every window over all
+    the O(window^2) kept distances: each step still costs O(window^2), but
+    a single comparison per pair instead of a distance over every point of
+    the templates. Memory is O(window^2) per template length.
+    """
+    X = numpy.asarray(X, dtype=float)
+    dimensions = numpy.atleast_1d(M)
+    lengths = template_lengths(dimensions)
+    capacity = dict((length, max([stop - start - length + 1 for start, stop in windows] + [1])) for length in lengths)
+    distances = dict((length, numpy.full((capacity[length], capacity[length]), numpy.nan)) for length in lengths)
+    ring_templates = dict((length, numpy.full(capacity[length], -1)) for length in lengths)
+    templates = dict((length, (0, 0)) for length in lengths)
+    Samp_En = []
+    for (start, stop), window_R in zip(windows, R):
+        tolerances = numpy.atleast_1d(numpy.asarray(window_R, dtype=float))
+        matches = {}
+        for length in lengths:
+            window_templates = (start, max(stop - length + 1, start))
+            slide_distances(X, distances[length], ring_templates[length], templates[length], window_templates, length)
+            templates[length] = window_templates
+            matches[length] = [template_matches(numpy.count_nonzero(distances[length] <= tolerance),
+                                                window_templates[1] - window_templates[0])
+                               for tolerance in tolerances]
+        window_En = []
+        for dimension in dimensions:
+            Samp_En_m = [numpy.log(Cm_r / Cmp_r) for Cm_r, Cmp_r in zip(matches[dimension], matches[dimension + 1])]
+            window_En.append(Samp_En_m if numpy.ndim(window_R) else Samp_En_m[0])
+        Samp_En.append(window_En if numpy.ndim(M) else window_En[0])
+    return Samp_En
+
+
+def ap_entropy(X, M, R, backend=DEFAULT_BACKEND):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Aproximate entropy of the series X with dimension M and tolerance R. The
+    result is bit-for-bit the one returned by pyeeg's ap_entropy, the
+    template matches are counted by the match_counts_<backend> function.
+
+    M and R may also be lists, the result is then a list with the entropy for
+    each dimension (which is itself a list with the entropy for each
+    tolerance if R is a list). The distances between templates are
+    calculated only once for all the dimensions and tolerances.
+    """
+    N = len(X)
+    dimensions, tolerances = numpy.atleast_1d(M), numpy.atleast_1d(R)
+    counts = match_counts(X, template_lengths(dimensions), tolerances, True, backend)
+    Ap_En = []
+    for dimension in dimensions:
+        Ap_En_m = []
+        for Cm_r, Cmp_r in zip(counts[dimension], counts[dimension + 1]):
+            Cm_r = Cm_r / float(N - dimension + 1)
+            Cmp_r = Cmp_r / float(N - dimension)
+            Phi_m, Phi_mp = numpy.sum(numpy.log(Cm_r)), numpy.sum(numpy.log(Cmp_r))
+            Ap_En_m.append((Phi_m - Phi_mp) / (N - dimension))
+        Ap_En.append(Ap_En_m if numpy.ndim(R) else Ap_En_m[0])
+    return Ap_En if numpy.ndim(M) else Ap_En[0]
+
+
+def permen(filename, dimension, tolerance, backend=None):
+    """
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
+
+    Given a filename, calculate the permutation entropy with order dimension
+    (see perm_entropy). The tolerance and backend are not used, they only
+    exist so all the entropy functions have the same signature.
+    """
+    with open(filename, "r") as file_d:
+        file_data = file_d.readlines()
+    file_data = list(map(float, file_data))
+    return entropy_data(len(file_data), perm_entropy(file_data, dimension, tolerance))
+
+
+def perm_entropy(X, M, R, backend=None):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Permutation entropy of the series X with order M and lag 1, as returned
+    by pyeeg's permutation_entropy (where the permutations are counted as
+    Lehmer codes, all at once). M may be a list, the result is then a list
+    with the entropy for each order. There is no tolerance (see
+    tolerance_free).
+    """
+    return tolerance_free([pyeeg.permutation_entropy(numpy.asarray(X, dtype=float), int(dimension), 1)
+                           for dimension in numpy.atleast_1d(M)], M, R)
+
+
+def hurst(filename, dimension, tolerance, backend=None):
+    """
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
+
+    Given a filename, calculate the Hurst exponent of its values (see
+    hurst_exponent). The dimension, tolerance and backend are not used, they
+    only exist so all the functions in this module have the same signature.
+    """
+    with open(filename, "r") as file_d:
+        file_data = file_d.readlines()
+    file_data = list(map(float, file_data))
+    return entropy_data(len(file_data), hurst_exponent(file_data, dimension, tolerance))
+
+
+def hurst_exponent(X, M, R, backend=None):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Hurst exponent of the series X, as returned by pyeeg's hurst (where the
+    running std and range are calculated with running sums and convex hulls,
+    in O(N log N)). It has no dimension nor tolerance, the same exponent is
+    given for every dimension in M and tolerance in R (see tolerance_free).
+    """
+    return tolerance_free([pyeeg.hurst(X)] * len(numpy.atleast_1d(M)), M, R)
+
+
+def dfa(filename, dimension, tolerance, backend=DFA_BOXES[0]):
+    """
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
+
+    Given a filename, calculate the DFA scaling exponents of its values (see
+    dfa_alpha), the dimension is the exponent (1 for alpha1, 2 for alpha2)
+    and the backend is one of DFA_BOXES. The tolerance is not used, it only
+    exists so all the functions in this module have the same signature.
+    """
+    with open(filename, "r") as file_d:
+        file_data = file_d.readlines()
+    file_data = list(map(float, file_data))
+    return entropy_data(len(file_data), dfa_alpha(file_data, dimension, tolerance, backend))
+
+
+def dfa_alpha(X, M, R, backend=DFA_BOXES[0]):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Detrended fluctuation analysis scaling exponent of the series X, alpha1
+    (M is 1) or alpha2 (M is 2), the slope of pyeeg's dfa over the box lengths
+    in DFA_BOX_LENGTHS[M]. With the overlap backend every box of each length
+    is used, not just consecutive ones. M may be a list, the result is then
+    a list with each exponent. There is no tolerance (see tolerance_free).
+    """
+    return tolerance_free([pyeeg.dfa(X, L=DFA_BOX_LENGTHS[int(dimension)], Overlap=backend == "overlap")
+                           for dimension in numpy.atleast_1d(M)], M, R)
+
+
+def lle(filename, dimension, tolerance, backend=DEFAULT_BACKEND):
+    """
+    (str, int or list of int, float or list of float, str) -> EntropyData or list of EntropyData
+
+    Given a filename, calculate the largest Lyapunov exponent of its values
+    with embedding dimension dimension (see lyapunov_exponent). The
+    tolerance is not used, it only exists so all the functions in this
+    module have the same signature.
+    """
+    with open(filename, "r") as file_d:
+        file_data = file_d.readlines()
+    file_data = list(map(float, file_data))
+    return entropy_data(len(file_data), lyapunov_exponent(file_data, dimension, tolerance, backend))
+
+
+def lyapunov_exponent(X, M, R, backend=DEFAULT_BACKEND):
+    """
+    (list, int or list of int, float or list of float, str) -> float or list
+
+    Largest Lyapunov exponent of the series X (in 1/point), as returned by
+    pyeeg's LLE with embedding dimension M, lag LLE_LAG and Theiler window
+    LLE_THEILER_WINDOW. With the kdtree backend the nearest neighbours are
+    found with a k-d tree (see lle_neighbors_kdtree), with any other backend
+    by pyeeg's blocked search; they are the same neighbours. M may be a list,
+    the result is then a list with the exponent for each dimension. There is
+    no tolerance (see tolerance_free).
+    """
+    X = numpy.asarray(X, dtype=float)
+    Lexp = []
+    for dimension in numpy.atleast_1d(M):
+        Neighbors = None
+        if backend == "kdtree":
+            Neighbors = lle_neighbors_kdtree(pyeeg.embed_seq_cached(X, LLE_LAG, int(dimension)), LLE_THEILER_WINDOW)
+        Lexp.append(pyeeg.LLE(X, LLE_LAG, int(dimension), LLE_THEILER_WINDOW, 1, Neighbors))
+    return tolerance_free(Lexp, M, R)
+
+
+"""The function that calculates each of the entropies in this module from a
+series instead of a file"""
+SERIES_FUNCTIONS = {"sampen": samp_entropy, "apen": ap_entropy, "apenv2": ap_entropy_v2, "permen": perm_entropy,
+                    "hurst": hurst_exponent, "dfa": dfa_alpha, "lle": lyapunov_exponent}
+
+
+def match_counts(X, lengths, tolerances, self_matches, backend=DEFAULT_BACKEND):
+    """
+    (list, list of int, list of float, bool, str) -> dict of int: numpy.ndarray
+
+    Count for every template (of each of the lengths) in X how many templates
+    of the same length are within each of the tolerances of it. Two
+    templates match if the maximum absolute difference between their points
+    (their Chebyshev distance) is not greater than the tolerance.
+    Self-matches are only counted when self_matches is True.
+
+    The result associates each length L to an array where row r has the
+    counts for tolerances[r] of the N-L+1 templates of that length. All the
+    backends return exactly the same counts, they only differ in the time and
+    memory they take to get them.
+    """
+    method_to_call = getattr(sys.modules[__name__], 'match_counts_' + backend)
+    return method_to_call(numpy.asarray(X, dtype=float), sorted(lengths), numpy.asarray(tolerances, dtype=float),
+                          self_matches)
+
+
+def match_counts_blocked(X, lengths, tolerances, self_matches, block_size=BLOCK_SIZE):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray, bool, int) -> dict of int: numpy.ndarray
+
+    Blocked backend for match_counts.
+
+    ALGORITHM: The template-match matrix is symmetrical, so the number of
+    matches of template j is the sum of column j, which is the same as summing
+    the column over consecutive blocks of block_size rows. For each block
+    the Chebyshev distances are built one point at a time: the distance
+    between templates of length L+1 is the distance between the templates of
+    length L or the distance between the points after them, whichever is
+    bigger. So the distances for all the lengths (up to the longest one)
+    come out of the same pass, and each is compared against every tolerance
+    when its length is one of the requested ones. Only the running column
+    counts are kept, so peak memory is O(block_size * N) instead of the
+    O(N * N * M) of pyeeg.
+    """
+    N = len(X)
+    counts = dict((length, numpy.zeros((len(tolerances), N - length + 1), dtype=numpy.int64)) for length in lengths)
+    n_rows = N - lengths[0] + 1
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        distances = numpy.abs(X[start:stop, None] - X[:n_rows])
+        if not self_matches:
+            # nan is never within tolerance
+            rows = numpy.arange(stop - start)
+            distances[rows, rows + start] = numpy.nan
+        for length in range(1, lengths[-1] + 1):
+            n_templates = min(N - length + 1, n_rows)
+            if min(stop, n_templates) <= start:
+                break
+            if length > 1:
+                k = length - 1
+                distances = distances[:min(stop, n_templates) - start, :n_templates]
+                numpy.maximum(distances, numpy.abs(X[start + k:min(stop, n_templates) + k, None] - X[k:n_templates + k]),
+                              out=distances)
+            if length in counts:
+                count_within(distances, tolerances, counts[length])
+    return counts
+
+
+def match_counts_packed(X, lengths, tolerances, self_matches, block_size=BLOCK_SIZE):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray, bool, int) -> dict of int: numpy.ndarray
+
+    Bit-packed backend for match_counts.
+
+    ALGORITHM: As in the blocked backend the template-match matrix is built
+    one block of rows at a time, but each row is kept as a bitmap (one bit
+    per template, packed in 64 bit words) instead of one byte or float per
+    template. Two templates of length L+1 match if they match with length L
+    and their points after that are within tolerance, so the bitmap for
+    length L+1 is the bitmap for length L AND the bitmap of the next point's
+    matches. The number of matches of each template is the population count
+    of its row (the matrix is symmetrical, rows and columns have the same
+    counts). The points are compared PACKED_COLUMNS templates at a time and
+    packed straight into the block's bitmap, so no float or boolean row as
+    long as the series is ever built: the bitmaps take 1/64 of the memory of
+    the blocked backend's float rows, and the ANDs and counts go through 64
+    templates at a time.
+    """
+    N = len(X)
+    counts = dict((length, numpy.zeros((len(tolerances), N - length + 1), dtype=numpy.int64)) for length in lengths)
+    n_rows = N - lengths[0] + 1
+    if n_rows <= 0:
+        return counts
+    # Columns are padded to whole 64 bit words, the padding never matches
+    n_words = -(-n_rows // 64)
+    point_bits = numpy.zeros((min(block_size, n_rows), n_words * 8), dtype=numpy.uint8)
+    matches = numpy.zeros((min(block_size, n_rows), n_words), dtype=numpy.uint64)
+    for row, tolerance in enumerate(tolerances):
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            for length in range(1, lengths[-1] + 1):
+                k = length - 1
+                block_stop = min(stop, N - length + 1)
+                if block_stop <= start:
+                    break
+                block_rows = block_stop - start
+                n_columns = min(n_rows, N - k)
+                # Columns past n_columns (set for a shorter length) are padding now
+                point_bits[:block_rows] = 0
+                for column in range(0, n_columns, PACKED_COLUMNS):
+                    column_stop = min(column + PACKED_COLUMNS, n_columns)
+                    point_bits[:block_rows, column // 8:-(-column_stop // 8)] = numpy.packbits(
+                        numpy.abs(X[start + k:block_stop + k, None] - X[column + k:column_stop + k]) <= tolerance,
+                        axis=1)
+                if length == 1:
+                    matches[:block_rows] = point_bits[:block_rows].view(numpy.uint64)
+                else:
+                    matches[:block_rows] &= point_bits[:block_rows].view(numpy.uint64)
+                if length in counts:
+                    counts[length][row, start:block_stop] = popcount(matches[:block_rows]).sum(axis=1)
+    if not self_matches:
+        for length, self_counts in self_match_counts(X, lengths, tolerances).items():
+            counts[length] -= self_counts
+    return counts
+
+
+def match_counts_sorted(X, lengths, tolerances, self_matches):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray, bool) -> dict of int: numpy.ndarray
+
+    Sort-and-sweep backend for match_counts.
+
+    ALGORITHM: The templates are sorted by their first point. Two templates
+    can only match if their first points are within tolerance, and in the
+    sorted order those are close to each other: if the template d positions
+    ahead is already too far on the first point, so is every template after
+    it. So instead of comparing every pair we compare every template with the
+    one d positions ahead, for d = 1, 2, ..., dropping on each step the
+    templates that ran out of candidates (for the biggest tolerance), until
+    none is left. Each step is vectorized over all the remaining templates,
+    and the total work is proportional to the number of pairs whose first
+    points match instead of N^2. The distance of each candidate pair is
+    extended one point at a time, as in the blocked backend, to get the
+    counts for every length.
+    """
+    N = len(X)
+    n_templates = N - lengths[0] + 1
+    max_tolerance = numpy.max(tolerances)
+    order = numpy.argsort(X[:n_templates], kind='mergesort')
+    first = X[order]
+    counts = dict((length, numpy.zeros((len(tolerances), N - length + 1), dtype=numpy.int64)) for length in lengths)
+    positions = numpy.arange(n_templates)
+    distance = 1
+    while len(positions):
+        positions = positions[positions + distance < n_templates]
+        positions = positions[numpy.abs(first[positions + distance] - first[positions]) <= max_tolerance]
+        i, j = order[positions], order[positions + distance]
+        distances = numpy.abs(X[i] - X[j])
+        for length in range(1, lengths[-1] + 1):
+            if length > 1:
+                k = length - 1
+                in_range = (i < N - k) & (j < N - k)
+                i, j = i[in_range], j[in_range]
+                distances = numpy.maximum(distances[in_range], numpy.abs(X[i + k] - X[j + k]))
+            if length in counts:
+                count_pairs_within(i, j, distances, tolerances, counts[length])
+        distance += 1
+    if self_matches:
+        for length, self_counts in self_match_counts(X, lengths, tolerances).items():
+            counts[length] += self_counts
+    return counts
+
+
+def match_counts_kdtree(X, lengths, tolerances, self_matches):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray, bool) -> dict of int: numpy.ndarray
+
+    k-d tree backend for match_counts, available when scipy is installed.
+
+    ALGORITHM: The templates of each length are placed in a k-d tree using
+    the Chebyshev (maximum) distance, and each template's neighbours within
+    tolerance are counted by a range query, which only visits the tree nodes
+    whose bounding box is within tolerance of the template. For hrf series,
+    where each template has few neighbours, this is close to O(N log N). Each
+    tree is built once and queried for every tolerance.
+    """
+    N = len(X)
+    counts = {}
+    for length in lengths:
+        counts[length] = numpy.zeros((len(tolerances), N - length + 1), dtype=numpy.int64)
+        if N - length + 1 <= 0:
+            continue
+        Em = embed_seq(X, 1, length)
+        tree = cKDTree(Em)
+        for row, tolerance in enumerate(tolerances):
+            counts[length][row] = tree.query_ball_point(Em, tolerance, p=numpy.inf, return_length=True)
+    if not self_matches:
+        for length, self_counts in self_match_counts(X, lengths, tolerances).items():
+            counts[length] -= self_counts
+    return counts
+
+
+def lle_neighbors_kdtree(Em, T):
+    """
+    (numpy.ndarray, int) -> numpy.ndarray
+
+    k-d tree version of pyeeg's theiler_neighbors (the nearest neighbour of
+    each embedding vector more than T points away from it, the lowest index
+    among equally distant ones), available when scipy is installed.
+
+    ALGORITHM: The distinct vectors are placed in a k-d tree, each one with
+    the (sorted) points where it occurs. A vector is a possible neighbour of
+    a point if it occurs outside the point's Theiler window, and at most 2T+1
+    vectors (the ones occurring in the window) are not, so the nearest
+    possible neighbour is one of the 2T+2 nearest vectors, which the tree
+    finds in O(log N). The distances to these candidates are calculated
+    again as pyeeg does, and of the closest ones the earliest occurrence
+    outside the window is the neighbour. Only when a vector further away
+    than the candidates could be just as close (ties at the distance of the
+    last candidate) is the point searched against every other one.
+    """
+    M = len(Em)
+    if M <= 2 * T + 1:
+        return pyeeg.theiler_neighbors(Em, T)
+    Vectors, Groups = numpy.unique(Em, axis=0, return_inverse=True)
+    Groups = Groups.ravel()
+    # the points where each vector occurs, in order, are
+    # Members[Starts[group]:Starts[group + 1]]
+    Members = numpy.argsort(Groups, kind="stable")
+    Starts = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(Groups))))
+    k = min(2 * T + 2, len(Vectors))
+    Tree_Dists, Candidates = cKDTree(Vectors).query(Vectors, k=k)
+    Tree_Dists, Candidates = Tree_Dists.reshape(-1, k), Candidates.reshape(-1, k)
+
+    Points = numpy.arange(M)[:, None]
+    Candidates = Candidates[Groups]
+    # earliest occurrence of each candidate before the window, or else after it
+    First = Members[Starts[Candidates]]
+    After = numpy.searchsorted(Groups[Members] * M + Members, Candidates * M + Points + T, side="right")
+    Outside = numpy.where(First < Points - T, First, Members[numpy.minimum(After, M - 1)])
+    Dists = pyeeg.embedding_distances(Vectors, Groups[:, None], Candidates)
+    Dists[(First >= Points - T) & (After >= Starts[Candidates + 1])] = numpy.inf
+    Closest = Dists.min(axis=1)
+    Neighbors = numpy.where(Dists == Closest[:, None], Outside, M).min(axis=1)
+
+    if k < len(Vectors):
+        for point in numpy.nonzero(Closest >= Tree_Dists[Groups, -1] * (1 - KDTREE_TIE_TOLERANCE))[0]:
+            D = pyeeg.embedding_distances(Em, numpy.arange(M), point)
+            D[abs(numpy.arange(M) - point) <= T] = numpy.inf
+            Neighbors[point] = D.argmin()
+    return Neighbors
+
+
+def match_counts_discrete(X, lengths, tolerances, self_matches):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray, bool) -> dict of int: numpy.ndarray
+
+    Histogram backend for match_counts, for series with integer values (like
+    most of our hrf, and every series after --round-to-int); any other series
+    is handed over to the blocked backend.
+
+    ALGORITHM: With integer values the distance between two points is an
+    integer, so being within tolerance r is being within floor(r). Each
+    point is replaced by the index of its value among the K distinct values,
+    and the templates of length L become points of a K^L grid, counted in an
+    L dimensional histogram. The templates that match a template are the
+    ones in the box of values within tolerance of each of its points, which
+    is also a box of value indexes, so summing the histogram over it takes
+    2^L lookups in the histogram's prefix sums (inclusion-exclusion over the
+    corners of the box). This is O(N + K^L) for each length instead of
+    O(N^2). When K^L is bigger than DISCRETE_MAX_CELLS the blocked backend
+    is used instead.
+    """
+    N = len(X)
+    if not integer_valued(X):
+        return match_counts_blocked(X, lengths, tolerances, self_matches)
+    values, indexes = numpy.unique(X, return_inverse=True)
+    indexes = indexes.ravel()
+    n_values = len(values)
+    if n_values ** lengths[-1] > DISCRETE_MAX_CELLS:
+        return match_counts_blocked(X, lengths, tolerances, self_matches)
+    counts = {}
+    for length in lengths:
+        n_templates = N - length + 1
+        counts[length] = numpy.zeros((len(tolerances), max(n_templates, 0)), dtype=numpy.int64)
+        if n_templates <= 0:
+            continue
+        cells = numpy.zeros(n_templates, dtype=numpy.int64)
+        for k in range(length):
+            cells = cells * n_values + indexes[k:k + n_templates]
+        histogram = numpy.bincount(cells, minlength=n_values ** length).reshape((n_values,) * length)
+        # prefix_sums[i_1, ..., i_L] is the number of templates whose value
+        # indexes are below i_1, ..., i_L
+        prefix_sums = numpy.zeros((n_values + 1,) * length, dtype=numpy.int64)
+        prefix_sums[(slice(1, None),) * length] = histogram
+        for axis in range(length):
+            numpy.cumsum(prefix_sums, axis=axis, out=prefix_sums)
+        for row, tolerance in enumerate(tolerances):
+            if tolerance < 0:
+                continue
+            within = numpy.floor(tolerance)
+            lower = numpy.searchsorted(values, values - within, side='left')
+            upper = numpy.searchsorted(values, values + within, side='right')
+            for corner in range(2 ** length):
+                corner_index = []
+                n_upper = 0
+                for k in range(length):
+                    if corner >> k & 1:
+                        corner_index.append(upper[indexes[k:k + n_templates]])
+                        n_upper += 1
+                    else:
+                        corner_index.append(lower[indexes[k:k + n_templates]])
+                if (length - n_upper) % 2:
+                    counts[length][row] -= prefix_sums[tuple(corner_index)]
+                else:
+                    counts[length][row] += prefix_sums[tuple(corner_index)]
+            if not self_matches:
+                counts[length][row] -= 1
+    return counts
+
+
+def sampen_match_sums(X, dimensions, tolerances, backend):
+    """
+    (list, numpy.ndarray, numpy.ndarray, str) -> list of lists of tuples
+
+    !!!Auxiliary function!!! For each dimension, the list with the pair
+    (sum of the matches of the templates of that dimension, sum of the
+    matches of the templates of dimension+1) for each tolerance, the sample
+    entropy is the log of their ratio. As in pyeeg every template count has
+    1e-100 added to it to avoid taking log(0).
+    """
+    counts = match_counts(X, template_lengths(dimensions), tolerances, False, backend)
+    return [[(numpy.sum(Cm_r + 1e-100), numpy.sum(Cmp_r + 1e-100))
+             for Cm_r, Cmp_r in zip(counts[dimension], counts[dimension + 1])] for dimension in dimensions]
+
+
+def self_match_counts(X, lengths, tolerances):
+    """
+    (numpy.ndarray, list of int, numpy.ndarray) -> dict of int: numpy.ndarray
+
+    !!!Auxiliary function!!! Return 1 for every template that matches itself
+    and 0 otherwise (a template with a nan never matches), one row per
+    tolerance, for each of the lengths.
+    """
+    N = len(X)
+    counts = {}
+    distances = numpy.abs(X - X)
+    for length in range(1, lengths[-1] + 1):
+        if length > 1:
+            distances = numpy.maximum(distances[:-1], numpy.abs(X[length - 1:] - X[length - 1:]))
+        if length in lengths:
+            counts[length] = (distances <= tolerances[:, None]).astype(numpy.int64)
+    return counts
+
+
+def slide_distances(X, distances, ring_templates, old_templates, new_templates, length):
+    """
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, tuple (int, int), tuple (int, int), int) -> NoneType
+
+    !!!Auxiliary function!!! Update, in place, the ring with the Chebyshev
+    distances between the templates of the given length that start in the
+    range old_templates so that it has the ones between the templates in
+    new_templates. Template t is kept in slot t % len(distances), and
+    ring_templates has the template in each slot (-1 for an empty one).
+
+    Each pair of templates is kept only once, in the row of the template
+    that entered the ring last (the pairs of templates that entered together
+    go to the row of the first one), everything else is nan, which is never
+    within tolerance. The rows and columns of the templates that left the
+    range are cleared and only the distances from the templates that entered
+    it are calculated.
+    """
+    capacity = len(distances)
+    (old_start, old_stop), (new_start, new_stop) = old_templates, new_templates
+    for start, stop in ((old_start, min(new_start, old_stop)), (max(new_stop, old_start), old_stop)):
+        for first, last in ring_ranges(start, stop, capacity):
+            ring_slice = slice(first % capacity, first % capacity + last - first)
+            distances[ring_slice, :] = numpy.nan
+            distances[:, ring_slice] = numpy.nan
+            ring_templates[ring_slice] = -1
+    entering = ring_ranges(new_start, min(old_start, new_stop), capacity) + \
+               ring_ranges(max(old_stop, new_start), new_stop, capacity)
+    if not entering:
+        return
+    for first, last in entering:
+        ring_templates[first % capacity:first % capacity + last - first] = numpy.arange(first, last)
+    is_empty = ring_templates < 0
+    columns = numpy.where(is_empty, 0, ring_templates)
+    for first, last in entering:
+        rows = numpy.abs(X[first:last, None] - X[columns])
+        for k in range(1, length):
+            numpy.maximum(rows, numpy.abs(X[first + k:last + k, None] - X[columns + k]), out=rows)
+        rows[:, is_empty] = numpy.nan
+        for other_first, other_last in entering:
+            other = rows[:, other_first % capacity:other_first % capacity + other_last - other_first]
+            other[numpy.arange(other_first, other_last) <= numpy.arange(first, last)[:, None]] = numpy.nan
+        distances[first % capacity:first % capacity + last - first] = rows
+
+
+def ring_ranges(start, stop, capacity):
+    """
+    (int, int, int) -> list of tuples (int, int)
+
+    !!!Auxiliary function!!! Split the templates in [start, stop) in the
+    (at most two) ranges whose slots are contiguous in a ring with the given
+    capacity.
+    """
+    ranges = []
+    while start < stop:
+        end = min(stop, start - start % capacity + capacity)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def template_matches(pairs, n_templates):
+    """
+    (int, int) -> float
+
+    !!!Auxiliary function!!! The sum of the match counts (plus 1e-100 each)
+    of n_templates templates among which pairs pairs match, which is
+    numpy.sum(Cm + 1e-100) in samp_entropy bit for bit: the counts are
+    integers, so the 1e-100 only adds up to something when they are all 0.
+    """
+    if pairs:
+        return 2.0 * pairs
+    return numpy.sum(numpy.zeros(n_templates) + 1e-100)
+
+
+def integer_valued(X):
+    """
+    (numpy.ndarray) -> bool
+
+    !!!Auxiliary function!!! Whether X has points and all of them are
+    integers exactly represented as floats (the series the discrete backend
+    counts with histograms).
+    """
+    return len(X) > 0 and bool(numpy.all(numpy.isfinite(X))) and bool(numpy.all(X == numpy.floor(X))) and \
+        numpy.max(numpy.abs(X)) < 2 ** 52
+
+
+def block_windows(blocks):
+    """
+    (list of list) -> (numpy.ndarray, list of tuples (int, int))
+
+    !!!Auxiliary function!!! Lay consecutive blocks of a series over a single
+    array, and return it along with the (start, stop) of each block in it. A
+    block whose beginning is equal to the end of the blocks before it is
+    placed over them, otherwise it is placed after them.
+    """
+    pieces = []
+    windows = []
+    total = 0
+    tail = numpy.empty(0)
+    tail_start = 0
+    for block in blocks:
+        block = numpy.asarray(block, dtype=float)
+        offset = None
+        if len(block):
+            for candidate in numpy.flatnonzero(tail == block[0]):
+                overlap = min(len(tail) - candidate, len(block))
+                if numpy.array_equal(tail[candidate:candidate + overlap], block[:overlap]):
+                    offset = candidate
+                    break
+        if offset is None:
+            tail_start, tail = total, block
+        else:
+            tail_start, tail = tail_start + offset, numpy.concatenate((tail[offset:], block[len(tail) - offset:]))
+        windows.append((tail_start, tail_start + len(block)))
+        if tail_start + len(tail) > total:
+            pieces.append(tail[total - tail_start:])
+            total = tail_start + len(tail)
+    return numpy.concatenate(pieces) if pieces else numpy.empty(0), windows
+
+
+def template_lengths(dimensions):
+    """
+    (list of int) -> list of int
+
+    !!!Auxiliary function!!! The template lengths whose matches are needed to
+    calculate sampen or apen for each of the dimensions (m and m+1).
+    """
+    return sorted(set(int(dimension) for dimension in dimensions) | set(int(dimension) + 1 for dimension in dimensions))
+
+
+def popcount(words):
+    """
+    (numpy.ndarray) -> numpy.ndarray
+
+    !!!Auxiliary function!!! Number of bits set in each of the uint64 words.
+    """
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(words)
+    return POPCOUNT_TABLE[words.view(numpy.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def count_within(distances, tolerances, counts):
+    """
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray) -> NoneType
+
+    !!!Auxiliary function!!! Add to counts[r, j] the number of distances in
+    column j that are within tolerances[r].
+    """
+    for row, tolerance in enumerate(tolerances):
+        counts[row] += (distances <= tolerance).sum(axis=0)
+
+
+def count_pairs_within(i, j, distances, tolerances, counts):
+    """
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray) -> NoneType
+
+    !!!Auxiliary function!!! Add to counts[r] one match for both templates of
+    every pair (i[p], j[p]) whose distance is within tolerances[r].
+    """
+    n_templates = counts.shape[1]
+    for row, tolerance in enumerate(tolerances):
+        in_range = distances <= tolerance
+        counts[row] += numpy.bincount(i[in_range], minlength=n_templates)
+        counts[row] += numpy.bincount(j[in_range], minlength=n_templates)
+
+
+def entropy_data(points, entropies):
+    """
+    (int, float or list) -> EntropyData or list
+
+    !!!Auxiliary function!!! Wrap one entropy, or a (nested) list of
+    entropies, as EntropyData keeping the same list structure.
+    """
+    if numpy.ndim(entropies):
+        return [entropy_data(points, entropy_value) for entropy_value in entropies]
+    return EntropyData(points, entropies)
+
+
+def tolerance_free(values, M, R):
+    """
+    (list of float, int or list of int, float or list of float) -> float or list
+
+    !!!Auxiliary function!!! The result of a measure with no tolerance
+    (permen, hurst, dfa and lle), given its value for each dimension in M,
+    shaped as the entropies' results: if R is a list each value is repeated
+    once per tolerance, and if M isn't a list the result is its only value.
+    So every measure in this module has the same csv columns.
+    """
+    shaped = [[value] * len(R) if numpy.ndim(R) else value for value in values]
+    return shaped if numpy.ndim(M) else shaped[0]
+
+
+def entropy_values(entropy_results):
+    """
+    (EntropyData or list) -> list of float
+
+    !!!Auxiliary function!!! Flatten the result of an entropy function into a
+    list of entropies, dimensions first and then tolerances (the same order
+    as the columns from entropy_columns).
+    """
+    if isinstance(entropy_results, EntropyData):
+        return [entropy_results.entropy]
+    return [value for entropy_result in entropy_results for value in entropy_values(entropy_result)]
 
 
 def calculate_file_std(filename):
@@ -247,7 +1264,7 @@ def calculate_file_std(filename):
     Function to calculate the standard deviation of the values in a single file.
     
     """
-    with open(filename, "rU") as fdin:
+    with open(filename, "r") as fdin:
         file_data = fdin.readlines()
     file_data = list(map(float, file_data))
     return numpy.std(file_data)
@@ -255,34 +1272,170 @@ def calculate_file_std(filename):
 
 # AUXILIARY FUNCTIONS
 
-def add_parser_options(parser):
+def tolerance_list(tolerances):
+    """
+    (str) -> list of float
+
+    !!!Auxiliary function!!! Parse a comma separated list of tolerances
+    (argparse type for the tolerance option).
+    """
+    return [float(tolerance) for tolerance in tolerances.split(',')]
+
+
+def dimension_list(dimensions):
     """
-    (argparse.ArgumentParser) -> NoneType
+    (str) -> list of int
+
+    !!!Auxiliary function!!! Parse a comma separated list of dimensions where
+    each item may also be an inclusive range, e.g. 1:4 is 1,2,3,4 (argparse
+    type for the dimension option).
+    """
+    dimension_values = []
+    for dimension in dimensions.split(','):
+        if ':' in dimension:
+            first, last = dimension.split(':')
+            dimension_values.extend(range(int(first), int(last) + 1))
+        else:
+            dimension_values.append(int(dimension))
+    return dimension_values
+
+
+def entropy_backend(options):
+    """
+    (dict of str: object) -> str
+
+    !!!Auxiliary function!!! The backend to give options['entropy'] from the
+    parsed options, the box layout for dfa and the backend for the others.
+    """
+    if options['entropy'] == 'dfa':
+        return options['boxes']
+    return options['backend']
+
+
+def entropy_name(options):
+    """
+    (dict of str: object) -> str
+
+    !!!Auxiliary function!!! Name of options['entropy'] for the output
+    files, dfa also has its box layout (e.g. dfa_overlap) so the results of
+    each layout are kept apart.
+    """
+    if options['entropy'] == 'dfa':
+        return "%s_%s" % (options['entropy'], options['boxes'])
+    return options['entropy']
+
+
+def entropy_columns(dimensions, tolerances, prefix="Entropy", entropy_function=None):
+    """
+    (list of int, list of float, str, str) -> list of str
+
+    !!!Auxiliary function!!! Names of the csv columns with the entropy for
+    each dimension and tolerance (in the order of entropy_values). With only
+    one dimension and one tolerance the column is simply named prefix. The
+    dfa exponents are named after their dimension instead (Alpha1, Alpha2).
+    """
+    columns = []
+    for dimension in dimensions:
+        for tolerance in tolerances:
+            if entropy_function == "dfa":
+                column = "Alpha%d" % dimension
+            else:
+                column = prefix
+                if len(dimensions) > 1:
+                    column += " m%d" % dimension
+            if len(tolerances) > 1:
+                column += " %g" % tolerance
+            columns.append(column)
+    return columns
+
+
+def add_parser_options(parser, sliding_option=False):
+    """
+    (argparse.ArgumentParser, bool) -> NoneType
 
     !!!Auxiliary function!!!  These are arguments for an argparse
     parser or subparser, and are the optional arguments for
-    the entry function in this module
+    the entry function in this module. The sliding_option disables/enables
+    the presence of the sliding option (see sampen_blocks).
 
     """
+    parser.add_argument('--backend', dest="backend", action="store", choices=AVAILABLE_BACKENDS,
+                        default=DEFAULT_BACKEND,
+                        help="Algorithm used by sampen and apen to count template matches, the results are the same "
+                             "but discrete (for integer valued series, the others fall back to blocked), sorted and "
+                             "kdtree are much faster on long series, and packed keeps the matches as bits to use "
+                             "less memory. [default:%(default)s]")
+    parser.add_argument('-j', '--jobs', dest="jobs", action="store", type=job_count, metavar="N", default=1,
+                        help="Number of processes used to calculate the entropy of the files. [default:%(default)s]")
+    if sliding_option:
+        parser.add_argument('--sliding', dest="sliding", action="store_true", default=False,
+                            help="Slide sampen over overlapping blocks also with the discrete (on integer values), "
+                                 "sorted and kdtree backends, which are usually faster on each block on its own")
+    cache.add_parser_options(parser)
+    # Only dfa has a box layout
+    parser.set_defaults(boxes=DFA_BOXES[0])
     entropy_parsers = parser.add_subparsers(help='Diferent methods for calculating entropy', dest="entropy")
 
     samp_en = entropy_parsers.add_parser('sampen', help="Sample Entropy")
-    samp_en.add_argument('-t', '--tolerance', dest="tolerance", type=float, action="store", metavar="TOLERANCE",
-                         help="Tolerance level to be used when calculating sample entropy. [default:%(default)s]",
-                         default=0.1)
-    samp_en.add_argument('-d', '--dimension', dest="dimension", type=int, action="store", metavar="MATRIX DIMENSION",
-                         help="Matrix Dimension. [default:%(default)s]", default=2)
+    samp_en.add_argument('-t', '--tolerance', dest="tolerance", type=tolerance_list, action="store", metavar="TOLERANCE",
+                         help="Tolerance level to be used when calculating sample entropy, a comma separated list "
+                              "(e.g. 0.1,0.15,0.2) calculates the entropy for each of them. [default:%(default)s]",
+                         default="0.1")
+    samp_en.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                         metavar="MATRIX DIMENSION",
+                         help="Matrix Dimension, a comma separated list or a range (e.g. 1:4) calculates the entropy "
+                              "for each of them. [default:%(default)s]", default="2")
 
     ap_en = entropy_parsers.add_parser('apen', help="Aproximate Entropy")
-    ap_en.add_argument('-t', '--tolerance', dest="tolerance", type=float, action="store", metavar="TOLERANCE",
-                       help="Tolerance level to be used when calculating aproximate entropy. [default:%(default)s]",
-                       default=0.1)
-    ap_en.add_argument('-d', '--dimension', dest="dimension", type=int, action="store", metavar="MATRIX DIMENSION",
-                       help="Matrix Dimension. [default:%(default)s]", default=2)
+    ap_en.add_argument('-t', '--tolerance', dest="tolerance", type=tolerance_list, action="store", metavar="TOLERANCE",
+                       help="Tolerance level to be used when calculating aproximate entropy, a comma separated list "
+                            "(e.g. 0.1,0.15,0.2) calculates the entropy for each of them. [default:%(default)s]",
+                       default="0.1")
+    ap_en.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                       metavar="MATRIX DIMENSION",
+                       help="Matrix Dimension, a comma separated list or a range (e.g. 1:4) calculates the entropy "
+                            "for each of them. [default:%(default)s]", default="2")
 
     ap_en_v2 = entropy_parsers.add_parser('apenv2', help="Aproximate Entropy version 2")
-    ap_en_v2.add_argument('-t', '--tolerance', dest="tolerance", type=float, action="store", metavar="TOLERANCE",
-                          help="Tolerance level to be used when calculating aproximate entropy. [default:%(default)s]",
-                          default=0.1)
-    ap_en_v2.add_argument('-d', '--dimension', dest="dimension", type=int, action="store", metavar="MATRIX DIMENSION",
-                          help="Matrix Dimension. [default:%(default)s]", default=2)
+    ap_en_v2.add_argument('-t', '--tolerance', dest="tolerance", type=tolerance_list, action="store", metavar="TOLERANCE",
+                          help="Tolerance level to be used when calculating aproximate entropy, a comma separated list "
+                               "(e.g. 0.1,0.15,0.2) calculates the entropy for each of them. [default:%(default)s]",
+                          default="0.1")
+    ap_en_v2.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                          metavar="MATRIX DIMENSION",
+                          help="Matrix Dimension, a comma separated list or a range (e.g. 1:4) calculates the entropy "
+                               "for each of them. [default:%(default)s]", default="2")
+
+    perm_en = entropy_parsers.add_parser('permen', help="Permutation Entropy")
+    perm_en.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                         metavar="ORDER",
+                         help="Permutation order, a comma separated list or a range (e.g. 3:7) calculates the entropy "
+                              "for each of them. [default:%(default)s]", default="3")
+    # The permutation entropy has no tolerance, a single one keeps one column per order
+    perm_en.set_defaults(tolerance=[0.0])
+
+    hurst_exp = entropy_parsers.add_parser('hurst', help="Hurst exponent")
+    # No dimension or tolerance, a single one of each keeps a single column
+    hurst_exp.set_defaults(dimension=[1], tolerance=[0.0])
+
+    dfa_alphas = entropy_parsers.add_parser('dfa', help="Detrended fluctuation analysis")
+    dfa_alphas.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                            metavar="ALPHA",
+                            help="Scaling exponent, 1 for alpha1 (boxes of 4 to 16 points) and 2 for alpha2 (boxes of "
+                                 "16 to 64 points), 1,2 calculates both. [default:%(default)s]", default="1,2")
+    dfa_boxes = dfa_alphas.add_mutually_exclusive_group()
+    dfa_boxes.add_argument('--boxes', dest="boxes", action="store", choices=DFA_BOXES,
+                           help="Layout of the boxes of each length, consecutive boxes or every box (one starting "
+                                "at each point). [default:%(default)s]", default=DFA_BOXES[0])
+    dfa_boxes.add_argument('--overlap', dest="boxes", action="store_const", const=DFA_BOXES[1],
+                           help="Use every box of each length, the same as --boxes %s" % DFA_BOXES[1])
+    dfa_alphas.set_defaults(tolerance=[0.0])
+
+    lle_exp = entropy_parsers.add_parser('lle', help="Largest Lyapunov exponent")
+    lle_exp.add_argument('-d', '--dimension', dest="dimension", type=dimension_list, action="store",
+                         metavar="EMBEDDING DIMENSION",
+                         help="Embedding dimension, a comma separated list or a range (e.g. 2:5) calculates the "
+                              "exponent for each of them, with the kdtree backend the nearest neighbours are found "
+                              "with a k-d tree. [default:%(default)s]", default="3")
+    # The largest Lyapunov exponent has no tolerance, a single one keeps one column per dimension
+    lle_exp.set_defaults(tolerance=[0.0])
@@ -0,0 +1,283 @@
+"""
+Copyright (C) 2012 Mara Matias
+
+This file is part of HRFAnalyse.
+
+    HRFAnalyse is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published
+    by the Free Software Foundation, either version 3 of the License,
+    or (at your option) any later version.
+
+    HRFAnalyse is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with HRFAnalyse.  If not, see
+    <http://www.gnu.org/licenses/>.
+
+_______________________________________________________________________________
+
+This module calculates several measures (features) of the same series at
+once. Most of the pyeeg measures start from the same intermediate values (the
+series std, its first differences, its embedding and the embedding's
+normalized singular values); calculating them one at a time would build each
+of these values again for every measure, here they are built only once per
+series.
+
+The embeddings and singular values are taken from pyeeg's embedding cache
+(see pyeeg.embed_seq_cached) so they are also shared with any other pyeeg
+call on the same series.
+
+The spectral features, svd_entropy and fisher_info of a directory's files
+(usually the blocks of a recording) are calculated for all the files with the
+same length at once, with a single fft of the series stacked in a 2D array
+and a single svd of their embeddings stacked in a 3D array.
+
+MODULE EXTERNAL DEPENDENCIES:
+pyeeg(http://code.google.com/p/pyeeg/downloads/list),
+numpy(http://numpy.scipy.org/)
+
+ENTRY POINT: features(input_name,feature_names,dimension,tolerance,tau,order,embedding_dimension,kmax,fs)
+"""
+
+import os
+import numpy
+from tools import pyeeg
+from tools.entropy import samp_entropy, ap_entropy
+
+"""The measures features can calculate:
+sampen, apen -- sample and aproximate entropy with dimension and tolerance*std
+svd_entropy, fisher_info -- from the singular values of the embedding with
+                            lag tau and embedding_dimension
+permen -- permutation entropy of the given order and lag tau
+pfd -- Petrosian fractal dimension
+hfd -- Higuchi fractal dimension with curves of up to kmax-1 points apart
+hjorth_mobility, hjorth_complexity -- Hjorth parameters
+vlf, lf, hf -- power (as in pyeeg's bin_power) in the HRV_BANDS, the series
+               mean is removed first
+lf_hf -- ratio of the lf and hf powers
+spectral_entropy -- pyeeg's spectral entropy of the HRV_BANDS"""
+SPECTRAL_FEATURES = ["vlf", "lf", "hf", "lf_hf", "spectral_entropy"]
+AVAILABLE_FEATURES = ["sampen", "apen", "svd_entropy", "fisher_info", "permen", "pfd", "hfd", "hjorth_mobility",
+                      "hjorth_complexity"] + SPECTRAL_FEATURES
+
+"""The features calculated for all the series with the same length at once
+(see blocks_features)"""
+SINGULAR_FEATURES = ["svd_entropy", "fisher_info"]
+BATCHED_FEATURES = SINGULAR_FEATURES + SPECTRAL_FEATURES
+
+"""Frequency limits (in Hz) of the very low, low and high frequency bands of
+the heart rate variability"""
+HRV_BANDS = [0.003, 0.04, 0.15, 0.4]
+
+
+# ENTRY POINT FUNCTION
+def features(input_name, feature_names=AVAILABLE_FEATURES, dimension=2, tolerance=0.2, tau=1, order=3,
+             embedding_dimension=10, kmax=10, fs=2.0):
+    """
+    (str, list of str, int, float, int, int, int, int, float) -> dict of str: dict of str: float
+
+    Given a file or directory named input_name, calculate the features in
+    feature_names for all the files (with sampling frequency fs). Returns a
+    dictionary that associates each filename to a dictionary with the value
+    of each feature.
+    """
+    features_dict = {}
+    if os.path.isdir(input_name):
+        filelist = os.listdir(input_name)
+        series = dict((filename.strip(), read_series(os.path.join(input_name, filename.strip())))
+                      for filename in filelist)
+        series_feature_names = [feature_name for feature_name in feature_names
+                                if feature_name not in BATCHED_FEATURES]
+        for filename in series:
+            features_dict[filename] = series_features(series[filename], series_feature_names, dimension, tolerance,
+                                                      tau, order, embedding_dimension, kmax, fs)
+        for filename, block_features in blocks_features(series, feature_names, tau, embedding_dimension,
+                                                        fs).items():
+            features_dict[filename].update(block_features)
+    else:
+        features_dict[input_name.strip()] = file_features(input_name.strip(), feature_names, dimension, tolerance,
+                                                          tau, order, embedding_dimension, kmax, fs)
+    return features_dict
+
+
+# IMPLEMENTATION
+def file_features(filename, feature_names, dimension, tolerance, tau, order, embedding_dimension, kmax=10, fs=2.0):
+    """
+    (str, list of str, int, float, int, int, int, int, float) -> dict of str: float
+
+    Given a filename, calculate the features in feature_names of its values
+    (see series_features).
+    """
+    return series_features(read_series(filename), feature_names, dimension, tolerance, tau, order,
+                           embedding_dimension, kmax, fs)
+
+
+def series_features(X, feature_names=AVAILABLE_FEATURES, dimension=2, tolerance=0.2, tau=1, order=3,
+                    embedding_dimension=10, kmax=10, fs=2.0):
+    """
+    (list, list of str, int, float, int, int, int, int, float) -> dict of str: float
+
+    Calculate the features in feature_names of the series X. Each feature
+    has the same value as calling its function on its own, but the values
+    they have in common are only calculated once:
+
+        std -- the tolerance of sampen and apen is tolerance*std
+        first differences -- used by pfd and the Hjorth parameters
+        singular values -- the normalized singular values of the embedding
+                           are used by both svd_entropy and fisher_info
+        band powers -- used by all the spectral features
+    """
+    X = numpy.asarray(X, dtype=float)
+    results = {}
+    if "sampen" in feature_names or "apen" in feature_names:
+        R = tolerance * numpy.std(X)
+        if "sampen" in feature_names:
+            results["sampen"] = samp_entropy(X, dimension, R)
+        if "apen" in feature_names:
+            results["apen"] = ap_entropy(X, dimension, R)
+    if "svd_entropy" in feature_names or "fisher_info" in feature_names:
+        W = pyeeg.singular_spectrum(X, tau, embedding_dimension)
+        if "svd_entropy" in feature_names:
+            results["svd_entropy"] = pyeeg.svd_entropy(X, tau, embedding_dimension, W)
+        if "fisher_info" in feature_names:
+            results["fisher_info"] = pyeeg.fisher_info(X, tau, embedding_dimension, W)
+    if "permen" in feature_names:
+        results["permen"] = pyeeg.permutation_entropy(X, order, tau)
+    if "hfd" in feature_names:
+        results["hfd"] = pyeeg.hfd(X, kmax)
+    if set(feature_names) & set(["pfd", "hjorth_mobility", "hjorth_complexity"]):
+        D = numpy.diff(X)
+        if "pfd" in feature_names:
+            results["pfd"] = pyeeg.pfd(X, D)
+        if "hjorth_mobility" in feature_names or "hjorth_complexity" in feature_names:
+            mobility, complexity = pyeeg.hjorth(X, D)
+            if "hjorth_mobility" in feature_names:
+                results["hjorth_mobility"] = mobility
+            if "hjorth_complexity" in feature_names:
+                results["hjorth_complexity"] = complexity
+    if set(feature_names) & set(SPECTRAL_FEATURES):
+        spectral = spectral_features(X[None, :], fs)
+        for feature_name in SPECTRAL_FEATURES:
+            if feature_name in feature_names:
+                results[feature_name] = spectral[feature_name][0]
+    return results
+
+
+def singular_features(blocks, tau, embedding_dimension):
+    """
+    (numpy.ndarray, int, int) -> dict of str: numpy.ndarray
+
+    Calculate the SINGULAR_FEATURES of each row of blocks (series of the
+    same length), the value of each feature is an array with one entry per
+    row. The singular values of all the rows' embeddings come from a single
+    batched svd (see pyeeg.singular_spectrum_blocks).
+    """
+    W = pyeeg.singular_spectrum_blocks(blocks, tau, embedding_dimension)
+    return {"svd_entropy": pyeeg.svd_entropy_blocks(W),
+            "fisher_info": pyeeg.fisher_info_blocks(W)}
+
+
+def spectral_features(blocks, fs):
+    """
+    (numpy.ndarray, float) -> dict of str: numpy.ndarray
+
+    Calculate all the SPECTRAL_FEATURES of each row of blocks (series of the
+    same length with sampling frequency fs), the value of each feature is an
+    array with one entry per row. The band powers of all the rows come from
+    a single batched fft (see pyeeg.bin_power_blocks).
+    """
+    blocks = blocks - numpy.mean(blocks, axis=1)[:, None]
+    power, power_ratio = pyeeg.bin_power_blocks(blocks, HRV_BANDS, fs)
+    return {"vlf": power[:, 0],
+            "lf": power[:, 1],
+            "hf": power[:, 2],
+            "lf_hf": power[:, 1] / power[:, 2],
+            "spectral_entropy": pyeeg.spectral_entropy_blocks(power_ratio)}
+
+
+# AUXILIARY FUNCTIONS
+def blocks_features(series, feature_names, tau, embedding_dimension, fs):
+    """
+    (dict of str: numpy.ndarray, list of str, int, int, float) -> dict of str: dict of str: float
+
+    !!!Auxiliary function!!! Calculate the BATCHED_FEATURES in feature_names
+    of all the series, the series with the same length are stacked and
+    calculated at once (see singular_features and spectral_features).
+    """
+    results = dict((filename, {}) for filename in series)
+    lengths = {}
+    for filename in series:
+        lengths.setdefault(len(series[filename]), []).append(filename)
+    for filenames in lengths.values():
+        blocks = numpy.array([series[filename] for filename in filenames])
+        batched = {}
+        if set(feature_names) & set(SINGULAR_FEATURES):
+            batched.update(singular_features(blocks, tau, embedding_dimension))
+        if set(feature_names) & set(SPECTRAL_FEATURES):
+            batched.update(spectral_features(blocks, fs))
+        for row, filename in enumerate(filenames):
+            for feature_name in batched:
+                if feature_name in feature_names:
+                    results[filename][feature_name] = batched[feature_name][row]
+    return results
+
+
+def read_series(filename):
+    """
+    (str) -> numpy.ndarray
+
+    !!!Auxiliary function!!! Read the values of a file, one per line.
+    """
+    with open(filename, 'r') as file_d:
+        file_data = file_d.readlines()
+    return numpy.array(list(map(float, file_data)))
+
+
+def feature_list(feature_names):
+    """
+    (str) -> list of str
+
+    !!!Auxiliary function!!! Parse a comma separated list of features
+    (argparse type for the features option).
+    """
+    feature_names = [feature_name.strip() for feature_name in feature_names.split(',')]
+    for feature_name in feature_names:
+        if feature_name not in AVAILABLE_FEATURES:
+            raise ValueError("Unknown feature %s" % feature_name)
+    return feature_names
+
+
+def add_parser_options(parser):
+    """
+    (argparse.ArgumentParser) -> NoneType
+
+    !!!Auxiliary function!!!  These are arguments for an argparse
+    parser or subparser, and are the optional arguments for
+    the entry function in this module
+
+    """
+    parser.add_argument('-f', '--features', dest="features", type=feature_list, action="store", metavar="FEATURES",
+                        help="Comma separated list of the features to calculate, available features: %s. "
+                             "[default: all of them]" % ', '.join(AVAILABLE_FEATURES),
+                        default=AVAILABLE_FEATURES)
+    parser.add_argument('-d', '--dimension', dest="dimension", type=int, action="store", metavar="MATRIX DIMENSION",
+                        help="Matrix dimension of sampen and apen. [default:%(default)s]", default=2)
+    parser.add_argument('-t', '--tolerance', dest="tolerance", type=float, action="store", metavar="TOLERANCE",
+                        help="Tolerance of sampen and apen, a fraction of the series std. [default:%(default)s]",
+                        default=0.2)
+    parser.add_argument('--tau', dest="tau", type=int, action="store", metavar="LAG",
+                        help="Lag of the embeddings of svd_entropy, fisher_info and permen. [default:%(default)s]",
+                        default=1)
+    parser.add_argument('--order', dest="order", type=int, action="store", metavar="ORDER",
+                        help="Permutation order of permen. [default:%(default)s]", default=3)
+    parser.add_argument('--embedding-dimension', dest="embedding_dimension", type=int, action="store",
+                        metavar="DIMENSION",
+                        help="Embedding dimension of svd_entropy and fisher_info. [default:%(default)s]", default=10)
+    parser.add_argument('--kmax', dest="kmax", type=int, action="store", metavar="KMAX",
+                        help="Kmax of hfd. [default:%(default)s]", default=10)
+    parser.add_argument('--fs', dest="fs", type=float, action="store", metavar="HZ",
+                        help="Sampling frequency of the series, for the spectral features. [default:%(default)s]",
+                        default=2.0)
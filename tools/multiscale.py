@@ -27,24 +27,36 @@ case the practical creation of a scale N is achieved by taking every N
 numbers and transforming them into one by calculating their mean.
 
 Once the scales are created you can use this module to compress or calculate the 
-entropy of the different scales.
+entropy of the different scales. Neither needs the scale files, each file is
+read once and its scales are built in memory (see multiscale_compression and
+multiscale_entropy).
+The sample entropy can also be calculated with the composite (CMSE) and the
+refined composite (RCMSE) multiscale methods, which use every coarse-grained
+series of each scale and are more stable than MSE on short series.
 
 MODULE DEPENDENCIES:
 numpy(http://numpy.scipy.org/)
 
 ENTRY POINT: create_scales(input_name,dest_dir,start,stop,step,mul_order,round_to_int)
-             multiscale_compression(input_name,start,stop,step,compressor,level,decompress)
-             multiscale_entropy(input_name,start,stop,step,entropy_function,*args)
+             multiscale_compression(input_name,start,stop,step,compressor,level,decompress,mul_order,
+                                    round_to_int,jobs,cache_dir)
+             multiscale_entropy(input_name,start,stop,step,entropy_function,dimension,tolerance,backend,jobs,
+                                mul_order,round_to_int,composite,cache_dir)
 """
 
 import os
 import numpy
-from tools.compress import compress
-from tools.entropy import entropy, calculate_std
+from tools.compress import compress_bytes, compression_executor
+from tools.entropy import series_entropy, composite_samp_entropy, entropy_data, entropy_values, DEFAULT_BACKEND
+from tools.pool import run_in_pool
 import logging
 
 module_logger = logging.getLogger('hrfanalyse.multiscale')
 
+"""The composite multiscale methods, cmse averages the entropy of a scale's
+coarse-grained series and rcmse adds their template matches"""
+COMPOSITE_METHODS = ["rcmse", "cmse"]
+
 
 # ENTRY POINT FUNCTION
 
@@ -67,106 +79,107 @@ def create_scales(input_name, dest_dir, start, stop, step, mul_order, round_to_i
     the resulting scale point and output only the integer value.
     
     """
+    scales = []
     for scale in range(start, stop, step):
         output_dir = os.path.join(dest_dir, "Scale %d" % scale)
         if not os.path.isdir(output_dir):
             module_logger.info("Creating Scale %d..." % scale)
             os.makedirs(output_dir)
+            scales.append(scale)
         else:
             module_logger.warning("Scale %d exists, skipping..." % scale)
-            continue
-        if os.path.isdir(input_name):
-            filelist = os.listdir(input_name)
-            for filename in filelist:
-                create_scale(os.path.join(input_name, filename.strip()),
-                             output_dir,
-                             scale,
-                             mul_order,
-                             round_to_int)
-        else:
-            create_scale(input_name.strip(),
-                         output_dir,
-                         scale,
-                         mul_order,
-                         round_to_int)
+    if not scales:
+        return
+    if os.path.isdir(input_name):
+        filelist = os.listdir(input_name)
+        for filename in filelist:
+            create_file_scales(os.path.join(input_name, filename.strip()),
+                               dest_dir,
+                               scales,
+                               mul_order,
+                               round_to_int)
+    else:
+        create_file_scales(input_name.strip(),
+                           dest_dir,
+                           scales,
+                           mul_order,
+                           round_to_int)
 
 
-def multiscale_compression(input_name, start, stop, step, compressor, level, decompress):
+def multiscale_compression(input_name, start, stop, step, compressor, level, decompress, mul_order=-1,
+                           round_to_int=False, jobs=1, cache_dir=None):
     """
     Calculate the multiscale compression for a file or directory.
     
     ARGUMENTS: String input file/directory name, int start scale, int stop scale,
-    int step between scales, String compressor, int level, bool decompress.
+    int step between scales, String compressor, int level, bool decompress,
+    int mul_order, bool round_to_int (see create_scales), int number of
+    workers the files are spread over (see compress.compression_executor),
+    String cache directory or None (see compress.compress_bytes).
     
-    RETURN: Dictionary with filenames as keys and an array of CompressionData
-    (one for each scale) as values.
+    RETURN: Dictionary with filenames as keys and an array with the original
+    size, compressed size (and decompression time if decompress is True) of
+    each scale as values.
+
+    ALGORITHM: Each file is read only once and the text of its scales is
+    built in memory (see scale_text), exactly as create_scales would write it
+    to the scale files, and compressed from there (see
+    compress.compress_bytes), so the result is the same as compressing those
+    files.
     """
     if os.path.isdir(input_name):
-        compression_table = {}
-        filelist = os.listdir(input_name)
-        for filename in filelist:
-            compression_table[filename] = []
-            for scale in range(start, stop, step):
-                file_to_compress = os.path.join("%s_Scales" % input_name, "Scale %d" % scale, filename)
-                compression_results = compress(file_to_compress,
-                                               compressor,
-                                               level,
-                                               decompress)
-                compression_table[filename].append(compression_results[file_to_compress].original)
-                compression_table[filename].append(compression_results[file_to_compress].compressed)
-                if decompress:
-                    compression_table[filename].append(compression_results[file_to_compress].time)
+        filelist = [filename.strip() for filename in os.listdir(input_name)]
+        files = dict((filename, os.path.join(input_name, filename)) for filename in filelist)
     else:
-        for scale in range(start, stop, step):
-            file_to_compress = os.path.join("%s_Scales" % input_name, "Scale %d" % scale, input_name)
-            compression_results = compress(file_to_compress,
-                                           compressor,
-                                           level,
-                                           decompress)
-            compression_table[filename].append(compression_results[file_to_compress].original)
-            compression_table[filename].append(compression_results[file_to_compress].compressed)
-            if decompress:
-                compression_table[filename].append(compression_results[file_to_compress].time)
-    return compression_table
+        files = {os.path.basename(input_name.strip()): input_name.strip()}
+    file_arguments = dict((filename, (files[filename], start, stop, step, compressor, level, decompress, mul_order,
+                                      round_to_int, cache_dir))
+                          for filename in files)
+    return run_in_pool(file_multiscale_compression, file_arguments, jobs, compression_executor(compressor))
 
 
-def multiscale_entropy(input_name, start, stop, step, entropy_function, dimension, tolerance):
+def multiscale_entropy(input_name, start, stop, step, entropy_function, dimension, tolerance,
+                       backend=DEFAULT_BACKEND, jobs=1, mul_order=-1, round_to_int=False, composite=None,
+                       cache_dir=None):
     """
     Calculate the multiscale entropy for a file or directory.
     
     ARGUMENTS: String input file/directory name, int start scale, int stop scale,
-    int step between scales, String compressor, int dimension, float tolerance
+    int step between scales, String compressor, int dimension (or list of int
+    dimensions), float tolerance (or list of float tolerances), String backend
+    used to count template matches, int number of processes the files are
+    spread over, int mul_order, bool round_to_int (see create_scales), String
+    composite method (one of COMPOSITE_METHODS, only for sampen) or None for
+    plain multiscale entropy, String cache directory or None (see
+    entropy.series_entropy, the composite entropies are not cached).
     
-    RETURN: Dictionary with filenames as keys and an array of EntropyData (one 
-    for each scale) as values.
+    RETURN: Dictionary with filenames as keys and an array of entropies (one 
+    for each scale, or one for each dimension and tolerance in each scale if
+    lists are given) as values. A file that fails is reported in the log and
+    left out.
+
+    ALGORITHM: Each file is read only once and its scales are built in memory
+    (see coarse_grain), with exactly the values create_scales would write to
+    the scale files, so the result is the same as calculating the entropy of
+    those files. The tolerance is a fraction of the std of the start scale.
+    With a composite method the entropy of scale N comes from the N
+    coarse-grained series that start at each of the first N points (see
+    composite_scales and entropy.composite_samp_entropy), all with that same
+    tolerance.
     """
-    entropy_table = {}
+    if composite is not None and entropy_function != "sampen":
+        raise ValueError("Composite multiscale entropy is only implemented for sampen")
     if os.path.isdir(input_name):
-        filelist = os.listdir(input_name)
-        files_stds = calculate_std(os.path.join("%s_Scales" % input_name, "Scale %d" % start))
-        tolerances = dict((filename, files_stds[filename] * tolerance) for filename in files_stds)
-        for filename in filelist:
-            entropy_table[filename] = []
-            for scale in range(start, stop, step):
-                file_in_scale = os.path.join("%s_Scales" % input_name, "Scale %d" % scale, filename)
-                entropy_results = entropy(file_in_scale,
-                                          entropy_function,
-                                          dimension,
-                                          {filename: tolerances[filename]})
-                entropy_table[filename].append(entropy_results[file_in_scale][1])
+        filelist = [filename.strip() for filename in os.listdir(input_name)]
+        file_arguments = dict((filename, (os.path.join(input_name, filename), start, stop, step, entropy_function,
+                                          dimension, tolerance, backend, mul_order, round_to_int, composite,
+                                          cache_dir))
+                              for filename in filelist)
     else:
-        files_stds = calculate_std(os.path.join("%s_Scales" % input_name, "Scale %d" % start))
-        tolerances = [files_stds[filename] * tolerance for filename in files_stds]
-        entropy_table[input_name] = []
-        filename = os.path.basename(input_name)
-        for scale in range(start, stop, step):
-            file_in_scale = os.path.join("%s_Scales" % input_name, "Scale %d" % scale, filename)
-            entropy_results = entropy(file_in_scale,
-                                      entropy_function,
-                                      dimension,
-                                      tolerances)
-            entropy_table[input_name].append(entropy_results[1])
-    return entropy_table
+        file_arguments = {os.path.basename(input_name.strip()): (input_name.strip(), start, stop, step,
+                                                                 entropy_function, dimension, tolerance, backend,
+                                                                 mul_order, round_to_int, composite, cache_dir)}
+    return run_in_pool(file_multiscale_entropy, file_arguments, jobs)
 
 
 # IMPLEMENTATION
@@ -179,27 +192,172 @@ def create_scale(inputfile, output_dir, scale, mul_order, round_to_int):
 
     RETURN: None
 
-    ALGORITHM: For a scale N, read the file,on each iteration extract an interval
-    of N values, calculate the mean of these numbers and save it in the resulting
-    file. Each iteration's interval starts after the last number used in the 
-    previous iteration.
+    ALGORITHM: For a scale N, read the file, split it in intervals of N values
+    (each interval starts after the last number used in the previous one), and
+    save the mean of each interval in the resulting file (see scale_text).
     
+    """
+    write_scale(read_series(inputfile), os.path.join(output_dir, os.path.basename(inputfile)), scale, mul_order,
+                round_to_int)
+
+
+def create_file_scales(inputfile, dest_dir, scales, mul_order, round_to_int):
+    """
+    This function creates several scales for one file.
+
+    ARGUMENTS: String name of file, String directory with the scale
+    directories ("Scale N"), list of int scale sizes, int mul_order, bool
+    round_to_int.
+
+    RETURN: None
+
+    ALGORITHM: Same as create_scale for each scale, but the file is only read
+    once for all of them.
     """
     filename = os.path.basename(inputfile)
-    line_index = 0
-    with open(inputfile, "rU") as fdin:
+    lines = read_series(inputfile)
+    for scale in scales:
+        write_scale(lines, os.path.join(dest_dir, "Scale %d" % scale, filename), scale, mul_order, round_to_int)
+
+
+def file_multiscale_compression(inputfile, start, stop, step, compressor, level, decompress, mul_order,
+                                round_to_int, cache_dir=None):
+    """
+    This function calculates the multiscale compression of one file.
+
+    ARGUMENTS: String name of file, int start scale, int stop scale, int step
+    between scales, String compressor, int level, bool decompress, int
+    mul_order, bool round_to_int, String cache directory or None.
+
+    RETURN: List with the sizes (and times) of each scale (see
+    multiscale_compression).
+    """
+    lines = read_series(inputfile)
+    compression_values = []
+    for scale in range(start, stop, step):
+        scale_data = ''.join(point + '\n' for point in scale_text(lines, scale, mul_order, round_to_int))
+        compression_results = compress_bytes(scale_data.encode(), compressor, level, decompress, cache_dir)
+        compression_values.append(compression_results.original)
+        compression_values.append(compression_results.compressed)
+        if decompress:
+            compression_values.append(compression_results.time)
+    return compression_values
+
+
+def file_multiscale_entropy(inputfile, start, stop, step, entropy_function, dimension, tolerance, backend, mul_order,
+                            round_to_int, composite=None, cache_dir=None):
+    """
+    This function calculates the multiscale entropy of one file.
+
+    ARGUMENTS: String name of file, int start scale, int stop scale, int step
+    between scales, String entropy function, int dimension (or list), float
+    tolerance (or list), String backend, int mul_order, bool round_to_int,
+    String composite method or None, String cache directory or None.
+
+    RETURN: List with the entropies of each scale (see multiscale_entropy).
+    """
+    lines = read_series(inputfile)
+    file_std = numpy.std(coarse_grain(lines, start, mul_order, round_to_int))
+    if numpy.ndim(tolerance):
+        file_tolerance = [file_std * tolerance_value for tolerance_value in tolerance]
+    else:
+        file_tolerance = file_std * tolerance
+    entropies = []
+    for scale in range(start, stop, step):
+        if composite is None:
+            scale_values = coarse_grain(lines, scale, mul_order, round_to_int)
+            scale_entropy = series_entropy(scale_values, entropy_function, dimension, file_tolerance, backend,
+                                           cache_dir)
+        else:
+            scale_series = composite_scales(lines, scale, mul_order, round_to_int)
+            scale_entropy = entropy_data(len(scale_series[0]),
+                                         composite_samp_entropy(scale_series, dimension, file_tolerance, backend,
+                                                                composite == "rcmse"))
+        entropies.extend(entropy_values(scale_entropy))
+    return entropies
+
+
+def coarse_grain(lines, scale, mul_order, round_to_int):
+    """
+    Build one scale of a series in memory.
+
+    ARGUMENTS: numpy array with the series, int scale size, int mul_order, bool
+    round_to_int.
+
+    RETURN: numpy array with the values create_scale writes to the scale file
+    (read back as floats).
+    """
+    return scale_text(lines, scale, mul_order, round_to_int).astype(float)
+
+
+def composite_scales(lines, scale, mul_order, round_to_int):
+    """
+    Build the coarse-grained series of one scale used by the composite
+    methods.
+
+    ARGUMENTS: numpy array with the series, int scale size, int mul_order, bool
+    round_to_int.
+
+    RETURN: List with scale numpy arrays, the one in position k is the scale
+    of the series starting at its k-th point (see coarse_grain), so the first
+    one is the usual scale.
+    """
+    return [coarse_grain(lines[shift:], scale, mul_order, round_to_int) for shift in range(scale)]
+
+
+def write_scale(lines, output_file, scale, mul_order, round_to_int):
+    """
+    Write one scale of a series to output_file, one point per line.
+
+    ARGUMENTS: numpy array with the series, String name of the resulting file,
+    int scale size, int mul_order, bool round_to_int.
+
+    RETURN: None
+    """
+    with open(output_file, "w") as fdout:
+        fdout.writelines(point + '\n' for point in scale_text(lines, scale, mul_order, round_to_int))
+
+
+def scale_text(lines, scale, mul_order, round_to_int):
+    """
+    Build the text of one scale of a series.
+
+    ARGUMENTS: numpy array with the series, int scale size, int mul_order, bool
+    round_to_int.
+
+    RETURN: numpy array of strings, one for each scale point.
+
+    ALGORITHM: The series is cut to a multiple of the scale and seen as a matrix
+    with one interval of scale points per row (a view, nothing is copied), the
+    scale points are the rows' means, calculated all at once. These are
+    exactly the values of numpy.mean on each interval, a running (cumulative)
+    sum would be cheaper but its rounding errors change the last digit of
+    the points that fall on a '%.3f' tie, which happens often with the
+    monitors' resolution. If mul_order is not disabled (set to -1) the means
+    are multiplied by mul_order. If round_to_int is set to True the points are
+    rounded and written as integers ('%d'), otherwise they are written with
+    three decimal places ('%.3f').
+    """
+    n_points = len(lines) // scale
+    scaled_hrf = lines[:n_points * scale].reshape(n_points, scale).mean(axis=1)
+    if mul_order != -1:
+        scaled_hrf *= mul_order
+    if round_to_int:
+        return numpy.char.mod('%d', numpy.rint(scaled_hrf))
+    return numpy.char.mod('%.3f', scaled_hrf)
+
+
+def read_series(inputfile):
+    """
+    Read the series in inputfile, one value per line.
+
+    ARGUMENTS: String name of file.
+
+    RETURN: numpy array with the values.
+    """
+    with open(inputfile, "r") as fdin:
         lines = fdin.readlines()
-        lines = list(map(float, lines))
-    with open(os.path.join(output_dir, filename), "w") as fdout:
-        while line_index + scale <= len(lines):
-            scaled_hrf = numpy.mean(lines[line_index:line_index + scale])
-            if mul_order != -1:
-                scaled_hrf *= mul_order
-            if round_to_int:
-                fdout.write('%d\n' % round(scaled_hrf))
-            else:
-                fdout.write('%.3f\n' % scaled_hrf)
-            line_index += scale
+    return numpy.array(list(map(float, lines)))
 
 
 # AUXILIARY FUNCTIONS
@@ -249,3 +407,27 @@ def add_parser_options(parser):
                         dest="round",
                         action="store_true",
                         default=False)
+    parser.add_argument("--keep-scales",
+                        dest="keep_scales",
+                        action="store_true",
+                        help="Also write the scale files (the scales are always built in memory for the entropy and "
+                             "the compression)",
+                        default=False)
+
+
+def add_entropy_parser_options(parser):
+    """
+    !!!Auxiliary function!!!  These are the arguments for the multiscale
+    entropy command that only make sense in multiscale (added to the entropy
+    subparser next to entropy.add_parser_options).
+
+    ARGUMENTS: The parser to which you want the arguments added to.
+
+    RETURN: None
+    """
+    parser.add_argument("--composite",
+                        dest="composite",
+                        choices=COMPOSITE_METHODS,
+                        help="Use the refined composite (rcmse) or the composite (cmse) multiscale sample entropy, "
+                             "more stable than the plain multiscale entropy on short series",
+                        default=None)
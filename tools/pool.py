@@ -0,0 +1,81 @@
+"""
+Copyright (C) 2012 Mara Matias
+
+This file is part of HRFAnalyse.
+
+    HRFAnalyse is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published
+    by the Free Software Foundation, either version 3 of the License,
+    or (at your option) any later version.
+
+    HRFAnalyse is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with HRFAnalyse.  If not, see
+    <http://www.gnu.org/licenses/>.
+
+_______________________________________________________________________________
+
+This module spreads the files of a directory over several workers, it is
+shared by compress, entropy and multiscale (each with the jobs option built
+with job_count).
+
+A file whose calculation fails is reported in the log and left out of the
+results, so one bad file doesn't stop the others.
+
+ENTRY POINT: run_in_pool(method_to_call,file_arguments,jobs,executor_class)
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+module_logger = logging.getLogger('hrfanalyse.pool')
+
+
+# ENTRY POINT FUNCTION
+def run_in_pool(method_to_call, file_arguments, jobs=1, executor_class=ProcessPoolExecutor):
+    """
+    (function, dict of str: tuple, int, class) -> dict of str: object
+
+    Call method_to_call(*arguments) for the arguments of each file in
+    file_arguments, spread over jobs workers of executor_class (processes
+    by default, a ThreadPoolExecutor for calls that release the GIL) or in
+    this process if jobs is 1, and return a dictionary with the result of
+    each file. The files are handled in sorted order so the results come in
+    the same order no matter how many jobs are used. A file whose call fails
+    is reported in the log and left out of the result.
+    """
+    results = {}
+    if jobs > 1:
+        with executor_class(max_workers=jobs) as executor:
+            futures = [(filename, executor.submit(method_to_call, *file_arguments[filename]))
+                       for filename in sorted(file_arguments)]
+            for filename, future in futures:
+                try:
+                    results[filename] = future.result()
+                except Exception as error:
+                    module_logger.error("Failed to process %s: %s" % (filename, error))
+    else:
+        for filename in sorted(file_arguments):
+            try:
+                results[filename] = method_to_call(*file_arguments[filename])
+            except Exception as error:
+                module_logger.error("Failed to process %s: %s" % (filename, error))
+    return results
+
+
+# AUXILIARY FUNCTIONS
+
+def job_count(jobs):
+    """
+    (str) -> int
+
+    !!!Auxiliary function!!! Parse the number of workers to use, which must
+    be at least 1 (argparse type for the jobs options).
+    """
+    if int(jobs) < 1:
+        raise ValueError("at least one job is needed")
+    return int(jobs)
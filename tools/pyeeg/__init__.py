@@ -32,7 +32,20 @@ Functions listed alphabetically
 
 """
 from __future__ import print_function
+import hashlib
 import numpy
+from collections import OrderedDict
+from math import factorial
+from bisect import bisect_left
+
+# Number of embeddings (and the values derived from them) kept by
+# embed_seq_cached, the least recently used one is dropped first
+EMBEDDING_CACHE_SIZE = 16
+
+_embedding_cache = OrderedDict()
+
+# Number of distances LLE and theiler_neighbors calculate at once
+LLE_BLOCK_SIZE = 2 ** 22
 
 
 # ####################### Begin function definitions #######################
@@ -72,23 +85,35 @@ def hurst(X):
     >>> pyeeg.hurst(a)
     0.5057444
 
+    The running std comes from running sums of the values and their squares,
+    and the running range from the convex hulls of the cumulative sums, so
+    this is O(N log N) instead of calculating the std and range of every
+    prefix (O(N^2)). The exponent is the same up to rounding errors.
+
     """
-    X = numpy.array(X)
+    X = numpy.array(X, dtype=float)
     N = X.size
     T = numpy.arange(1, N + 1)
     Y = numpy.cumsum(X)
     Ave_T = Y / T
 
-    S_T = numpy.zeros(N)
-    R_T = numpy.zeros(N)
-
-    for i in range(N):
-        S_T[i] = numpy.std(X[:i + 1])
-        X_T = Y - T * Ave_T[i]
-        R_T[i] = numpy.ptp(X_T[:i + 1])
-
-    R_S = R_T / S_T
-    R_S = numpy.log(R_S)[1:]
+    # Running std from the running moments (of the values minus their mean,
+    # the std doesn't change and the sums stay small)
+    X_C = X - numpy.mean(X)
+    Ave_C = numpy.cumsum(X_C) / T
+    S_T = numpy.sqrt(numpy.maximum(numpy.cumsum(X_C * X_C) / T - Ave_C * Ave_C, 0))
+
+    # The deviations X_T = Y - T * Ave_T[i] use the mean up to i, so the range
+    # is taken where the line of slope Ave_T[i] touches the upper and lower
+    # convex hulls of the points (T, Y) seen so far
+    Max_T = _hull_extremes(T, Y, Ave_T)
+    Min_T = _hull_extremes(T, -Y, -Ave_T)
+    R_T = (Y[Max_T] - T[Max_T] * Ave_T) - (Y[Min_T] - T[Min_T] * Ave_T)
+
+    # A flat prefix has no range nor std, its 0/0 gives nan (as before) without warning
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        R_S = R_T / S_T
+        R_S = numpy.log(R_S)[1:]
     n = numpy.log(T)[1:]
     A = numpy.column_stack((n, numpy.ones(n.size)))
     [m, c] = numpy.linalg.lstsq(A, R_S)[0]
@@ -96,6 +121,30 @@ def hurst(X):
     return H
 
 
+def _hull_extremes(T, Y, Slopes):
+    """For each i, the index k <= i where Y[k] - T[k] * Slopes[i] is the
+    largest, with T increasing. The maximum is on the upper convex hull of
+    the points (T[k], Y[k]), at the vertex where the slopes of the hull's
+    edges (which decrease along the hull) go below Slopes[i], found with a
+    binary search. Each point enters and leaves the hull once.
+    """
+    T, Y, Slopes = T.tolist(), Y.tolist(), Slopes.tolist()
+    Hull = []
+    # Minus the slope of each hull edge, increasing along the hull
+    Edges = []
+    Extremes = []
+    for i in range(len(T)):
+        while len(Hull) > 1 and (Y[i] - Y[Hull[-1]]) * (T[Hull[-1]] - T[Hull[-2]]) >= \
+                (Y[Hull[-1]] - Y[Hull[-2]]) * (T[i] - T[Hull[-1]]):
+            Hull.pop()
+            Edges.pop()
+        if Hull:
+            Edges.append(-(Y[i] - Y[Hull[-1]]) / (T[i] - T[Hull[-1]]))
+        Hull.append(i)
+        Extremes.append(Hull[bisect_left(Edges, -Slopes[i])])
+    return numpy.array(Extremes, dtype=int)
+
+
 def embed_seq(X, Tau, D):
     """Build a set of embedding sequences from given time series X with lag Tau
     and embedding dimension DE. Let X = [x(1), x(2), ... , x(N)], then for each
@@ -163,6 +212,50 @@ def embed_seq(X, Tau, D):
     return numpy.lib.stride_tricks.as_strided(X, shape=shape, strides=strides)
 
 
+def embed_seq_cached(X, Tau, D):
+    """Same as embed_seq, but the embedding is shared by every function that
+    asks for the same series (same values, not just the same object), Tau and
+    D. The cache keeps the last EMBEDDING_CACHE_SIZE embeddings and drops the
+    least recently used one first. X may also be a list.
+
+    The embedding is built over a copy of X, so changing X afterwards doesn't
+    change it, and it is read-only because it is shared.
+    """
+    return _cached("embedding", X, Tau, D, embed_seq)
+
+
+def singular_spectrum(X, Tau, DE):
+    """Normalized singular values of the embedding matrix of X with lag Tau
+    and embedding dimension DE, the W used by svd_entropy and fisher_info.
+    They are kept in the embedding cache (see embed_seq_cached), so the SVD is
+    only calculated once for both.
+    """
+    def normalized_singular_values(X, Tau, DE):
+        W = numpy.linalg.svd(embed_seq(X, Tau, DE), compute_uv=0)
+        W /= sum(W)  # normalize singular values
+        return W
+
+    return _cached("singular spectrum", X, Tau, DE, normalized_singular_values)
+
+
+def _cached(kind, X, Tau, D, function):
+    """Return function(X, Tau, D) from the embedding cache, calculating (and
+    caching) it if the cache doesn't have it yet. The series is identified by
+    a hash of its values, type and shape.
+    """
+    X = numpy.asarray(X)
+    key = (kind, X.dtype.str, X.shape, hashlib.sha1(numpy.ascontiguousarray(X)).hexdigest(), Tau, D)
+    if key in _embedding_cache:
+        value = _embedding_cache.pop(key)
+    else:
+        value = function(numpy.array(X), Tau, D)
+        value.flags.writeable = False
+        while len(_embedding_cache) >= EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    _embedding_cache[key] = value
+    return value
+
+
 def bin_power(X, Band, Fs):
     """Compute power in each frequency bin specified by Band from FFT result of
     X. By default, X is a real signal.
@@ -183,7 +276,8 @@ def bin_power(X, Band, Fs):
         pass the generated list to this function.
 
         Each element of Band is a physical frequency and shall not exceed the
-        Nyquist frequency, i.e., half of sampling frequency.
+        Nyquist frequency, i.e., half of sampling frequency (a ValueError is
+        raised otherwise).
 
      X
         list
@@ -211,18 +305,31 @@ def bin_power(X, Band, Fs):
 
     """
 
-    C = numpy.fft.fft(X)
-    C = abs(C)
-    Power = numpy.zeros(len(Band) - 1)
-    for Freq_Index in range(0, len(Band) - 1):
-        Freq = float(Band[Freq_Index])
-        Next_Freq = float(Band[Freq_Index + 1])
-        Power[Freq_Index] = sum(
-            C[numpy.floor(
-                Freq / Fs * len(X)
-            ): numpy.floor(Next_Freq / Fs * len(X))]
-        )
-    Power_Ratio = Power / sum(Power)
+    Power, Power_Ratio = bin_power_blocks(numpy.atleast_2d(X), Band, Fs)
+    return Power[0], Power_Ratio[0]
+
+
+def bin_power_blocks(Blocks, Band, Fs):
+    """Same as bin_power, for each row of Blocks (a 2-D array of real series
+    of the same length). The spectra of all the rows come from a single rfft
+    (the bins are all below the Nyquist frequency, so the other half of the
+    fft isn't needed) and are summed into the bins at once, by multiplying
+    them by a mask with one row per bin. Returns Power and Power_Ratio with
+    one row per block.
+
+    A band edge above the Nyquist frequency (Fs / 2) raises a ValueError:
+    the full fft mirrors the spectrum there, and the rfft would silently cut
+    the band off.
+    """
+    if numpy.max(Band) > Fs / 2.0:
+        raise ValueError("Band edge %g is above the Nyquist frequency %g" % (numpy.max(Band), Fs / 2.0))
+    N = Blocks.shape[1]
+    C = abs(numpy.fft.rfft(Blocks, axis=1))
+    Freq_Index = numpy.floor(numpy.asarray(Band, dtype=float) / Fs * N).astype(int)
+    Bins = numpy.arange(C.shape[1])
+    Masks = (Bins >= Freq_Index[:-1, None]) & (Bins < Freq_Index[1:, None])
+    Power = numpy.dot(C, Masks.T)
+    Power_Ratio = Power / numpy.sum(Power, axis=1)[:, None]
     return Power, Power_Ratio
 
 
@@ -241,11 +348,9 @@ def pfd(X, D=None):
     """
     if D is None:
         D = numpy.diff(X)
-        D = D.tolist()
-    N_delta = 0  # number of sign changes in derivative of the signal
-    for i in range(1, len(D)):
-        if D[i] * D[i - 1] < 0:
-            N_delta += 1
+    D = numpy.asarray(D)
+    # number of sign changes in derivative of the signal
+    N_delta = numpy.count_nonzero(D[1:] * D[:-1] < 0)
     n = len(X)
     return numpy.log10(n) / (
         numpy.log10(n) + numpy.log10(n / n + 0.4 * N_delta)
@@ -253,18 +358,20 @@ def pfd(X, D=None):
 
 
 def hfd(X, Kmax):
-    """ Compute Hjorth Fractal Dimension of a time series X, kmax
-     is an HFD parameter
+    """ Compute Higuchi Fractal Dimension of a time series X, kmax
+     is an HFD parameter. The length of each curve X[m::k] is a single
+     array reduction over its points.
     """
     L = []
     x = []
+    X = numpy.asarray(X)
     N = len(X)
     for k in range(1, Kmax):
         Lk = []
         for m in range(0, k):
-            Lmk = 0
-            for i in range(1, int(numpy.floor((N - m) / k))):
-                Lmk += abs(X[m + i * k] - X[m + i * k - k])
+            # the floor((N - m) / k) points X[m], X[m + k], ...
+            Points = X[m::k][:(N - m) // k]
+            Lmk = numpy.sum(numpy.abs(numpy.diff(Points)))
             Lmk = Lmk * (N - 1) / numpy.floor((N - m) / float(k)) / k
             Lk.append(Lmk)
         L.append(numpy.log(numpy.mean(Lk)))
@@ -311,20 +418,17 @@ def hjorth(X, D=None):
 
     """
 
+    X = numpy.asarray(X)
     if D is None:
         D = numpy.diff(X)
-        D = D.tolist()
 
-    D.insert(0, X[0])  # pad the first difference
-    D = numpy.array(D)
+    D = numpy.concatenate(([X[0]], D))  # pad the first difference
 
     n = len(X)
 
-    M2 = float(sum(D ** 2)) / n
-    TP = sum(numpy.array(X) ** 2)
-    M4 = 0
-    for i in range(1, len(D)):
-        M4 += (D[i] - D[i - 1]) ** 2
+    M2 = float(numpy.sum(D ** 2)) / n
+    TP = numpy.sum(X ** 2)
+    M4 = numpy.sum(numpy.diff(D) ** 2)
     M4 = M4 / n
 
     return numpy.sqrt(M2 / TP), numpy.sqrt(
@@ -358,7 +462,8 @@ def spectral_entropy(X, Band, Fs, Power_Ratio=None):
         pass the generated list to this function.
 
         Each element of Band is a physical frequency and shall not exceed the
-        Nyquist frequency, i.e., half of sampling frequency.
+        Nyquist frequency, i.e., half of sampling frequency (a ValueError is
+        raised otherwise).
 
      X
         list
@@ -384,11 +489,17 @@ def spectral_entropy(X, Band, Fs, Power_Ratio=None):
     if Power_Ratio is None:
         Power, Power_Ratio = bin_power(X, Band, Fs)
 
-    Spectral_Entropy = 0
-    for i in range(0, len(Power_Ratio) - 1):
-        Spectral_Entropy += Power_Ratio[i] * numpy.log(Power_Ratio[i])
+    return spectral_entropy_blocks(numpy.atleast_2d(Power_Ratio))[0]
+
+
+def spectral_entropy_blocks(Power_Ratio):
+    """Same as spectral_entropy, for each row of Power_Ratio (as returned by
+    bin_power_blocks).
+    """
+    Power_Ratio = Power_Ratio[:, :-1]
+    Spectral_Entropy = numpy.sum(Power_Ratio * numpy.log(Power_Ratio), axis=1)
     Spectral_Entropy /= numpy.log(
-        len(Power_Ratio)
+        Power_Ratio.shape[1] + 1
     )  # to save time, minus one is omitted
     return -1 * Spectral_Entropy
 
@@ -421,15 +532,13 @@ def svd_entropy(X, Tau, DE, W=None):
     """
 
     if W is None:
-        Y = embed_seq(X, Tau, DE)
-        W = numpy.linalg.svd(Y, compute_uv=0)
-        W /= sum(W)  # normalize singular values
+        W = singular_spectrum(X, Tau, DE)
 
-    return -1 * sum(W * numpy.log(W))
+    return svd_entropy_blocks(numpy.atleast_2d(W))[0]
 
 
 def fisher_info(X, Tau, DE, W=None):
-    """Compute SVD Entropy from either two cases below:
+    """Compute Fisher information from either two cases below:
     1. a time series X, with lag tau and embedding dimension dE (default)
     2. a list, W, of normalized singular values of a matrix (if W is provided,
     recommend to speed up.)
@@ -447,6 +556,8 @@ def fisher_info(X, Tau, DE, W=None):
         At last, normalize W:
                     W /= sum(W)
 
+    The Fisher information is then the sum of (W[i+1] - W[i])^2 / W[i].
+
     Notes
     -------------
 
@@ -456,11 +567,36 @@ def fisher_info(X, Tau, DE, W=None):
     """
 
     if W is None:
-        Y = embed_seq(X, Tau, DE)
-        W = numpy.linalg.svd(Y, compute_uv=0)
-        W /= sum(W)  # normalize singular values
+        W = singular_spectrum(X, Tau, DE)
 
-    return -1 * sum(W * numpy.log(W))
+    return fisher_info_blocks(numpy.atleast_2d(W))[0]
+
+
+def singular_spectrum_blocks(Blocks, Tau, DE):
+    """Same as singular_spectrum, for each row of Blocks (a 2-D array of
+    series of the same length). The embedding matrices of all the rows are
+    stacked in a 3-D array and decomposed by a single svd call. Returns the
+    normalized singular values of each block, one row per block.
+    """
+    Blocks = numpy.asarray(Blocks, dtype=float)
+    Indexes = numpy.arange(Blocks.shape[1] - (DE - 1) * Tau)[:, None] + numpy.arange(DE) * Tau
+    W = numpy.linalg.svd(Blocks[:, Indexes], compute_uv=False)
+    W /= numpy.sum(W, axis=1)[:, None]  # normalize singular values
+    return W
+
+
+def svd_entropy_blocks(W):
+    """SVD entropy of each row of W, normalized singular values as returned
+    by singular_spectrum_blocks.
+    """
+    return -1 * numpy.sum(W * numpy.log(W), axis=1)
+
+
+def fisher_info_blocks(W):
+    """Fisher information of each row of W, normalized singular values as
+    returned by singular_spectrum_blocks.
+    """
+    return numpy.sum((W[:, 1:] - W[:, :-1]) ** 2 / W[:, :-1], axis=1)
 
 
 def ap_entropy(X, M, R):
@@ -514,7 +650,7 @@ def ap_entropy(X, M, R):
     """
     N = len(X)
 
-    Em = embed_seq(X, 1, M)
+    Em = embed_seq_cached(X, 1, M)
     A = numpy.tile(Em, (len(Em), 1, 1))
     B = numpy.transpose(A, [1, 0, 2])
     D = numpy.abs(A - B) #  D[i,j,k] = |Em[i][k] - Em[j][k]|
@@ -579,7 +715,7 @@ def samp_entropy(X, M, R):
 
     N = len(X)
 
-    Em = embed_seq(X, 1, M)
+    Em = embed_seq_cached(X, 1, M)
     A = numpy.tile(Em, (len(Em), 1, 1))
     B = numpy.transpose(A, [1, 0, 2])
     D = numpy.abs(A - B) #  D[i,j,k] = |Em[i][k] - Em[j][k]|
@@ -603,7 +739,7 @@ def samp_entropy(X, M, R):
     return Samp_En
 
 
-def dfa(X, Ave=None, L=None):
+def dfa(X, Ave=None, L=None, Overlap=False):
     """Compute Detrended Fluctuation Analysis from a time series X and length of
     boxes L.
 
@@ -656,6 +792,11 @@ def dfa(X, Ave=None, L=None):
         1-D Python list of integers
         A list of box size, integers in ascending order
 
+    Overlap:
+        boolean, optional
+        Use every box of each length (one starting at each point) instead of
+        consecutive boxes that don't overlap
+
     Returns
     -------
 
@@ -691,15 +832,18 @@ def dfa(X, Ave=None, L=None):
     You may generate a list of box sizes and pass in such a list as a
     parameter.
 
-    """
+    The residue of the linear fit of every box of a given length is
+    calculated at once from closed-form sums (the boxes are the rows of Y
+    reshaped, or running sums when they overlap) instead of one least squares
+    fit per box. A linear fit isn't changed by adding a line to Y, so the
+    boxes are taken from the cumulative sum of X minus its mean, whatever Ave
+    is, which keeps the sums small.
 
-    X = numpy.array(X)
+    """
 
-    if Ave is None:
-        Ave = numpy.mean(X)
+    X = numpy.array(X, dtype=float)
 
-    Y = numpy.cumsum(X)
-    Y -= Ave
+    Y = numpy.cumsum(X - numpy.mean(X))
 
     if L is None:
         L = numpy.floor(len(X) * 1 / (
@@ -714,16 +858,13 @@ def dfa(X, Ave=None, L=None):
             print("time series is too short while the box length is too big")
             print("abort")
             exit()
-        for j in range(0, len(X), n):  # for each box
-            if j + n < len(X):
-                c = list(range(j, j + n))
-                # coordinates of time in the box
-                c = numpy.vstack([c, numpy.ones(n)]).T
-                # the value of data in the box
-                y = Y[j:j + n]
-                # add residue in this box
-                F[i] += numpy.linalg.lstsq(c, y)[1]
-        F[i] /= ((len(X) / n) * n)
+        if Overlap:
+            Residues = _overlapping_box_residues(Y, n)
+            F[i] = numpy.sum(Residues) / (len(Residues) * n)
+        else:
+            # the boxes that end before the last point
+            Boxes = Y[:(len(X) - 1) // n * n].reshape(-1, n)
+            F[i] = numpy.sum(_box_residues(Boxes)) / ((len(X) / n) * n)
     F = numpy.sqrt(F)
 
     Alpha = numpy.linalg.lstsq(numpy.vstack(
@@ -733,6 +874,45 @@ def dfa(X, Ave=None, L=None):
     return Alpha
 
 
+def _box_residues(Boxes):
+    """Residue (sum of the squared offsets) of the linear least squares fit of
+    each row of Boxes, from the sums of the row centered on its mean:
+    sum(y^2) - sum(t*y)^2 / sum(t^2).
+    """
+    n = Boxes.shape[1]
+    t = numpy.arange(n) - (n - 1) / 2.0
+    y = Boxes - numpy.mean(Boxes, axis=1)[:, None]
+    return numpy.sum(y * y, axis=1) - numpy.dot(y, t) ** 2 / numpy.dot(t, t)
+
+
+def _overlapping_box_residues(Y, n):
+    """Residue of the linear least squares fit of every box of n consecutive
+    points of Y, from running sums of y, y^2 and t*y (the same formula as
+    _box_residues, with the sums of each box taken as differences of the
+    running sums). The running sums are taken over chunks of Y (with the
+    boxes that start in 16*n consecutive points), each one first detrended
+    with its own linear fit, so they stay close to the size of the boxes'
+    values and their differences don't lose precision.
+    """
+    N_Boxes = len(Y) - n + 1
+    C = 16 * n
+    N_Chunks = -(-N_Boxes // C)
+    # pad so the last chunk is whole, the boxes that start in the padding
+    # are dropped at the end
+    Y = numpy.concatenate((Y, numpy.repeat(Y[-1:], N_Chunks * C - N_Boxes)))
+    Chunks = Y[numpy.arange(N_Chunks)[:, None] * C + numpy.arange(C + n - 1)]
+    t = numpy.arange(C + n - 1) - (C + n - 2) / 2.0
+    Chunks = Chunks - numpy.mean(Chunks, axis=1)[:, None]
+    Chunks -= numpy.outer(numpy.dot(Chunks, t) / numpy.dot(t, t), t)
+    Sums = [numpy.concatenate((numpy.zeros((N_Chunks, 1)), numpy.cumsum(Z, axis=1)), axis=1)
+            for Z in (Chunks, Chunks * Chunks, t * Chunks)]
+    S_y, S_yy, S_ty = [Sum[:, n:] - Sum[:, :-n] for Sum in Sums]
+    # centered on the t of the center of each box
+    S_ty -= (t[:C] + (n - 1) / 2.0) * S_y
+    Residues = S_yy - S_y * S_y / n - S_ty * S_ty / (n * (n * n - 1) / 12.0)
+    return Residues.ravel()[:N_Boxes]
+
+
 def permutation_entropy(x, n, tau):
     """Compute Permutation Entropy of a given time series x, specified by
     permutation order n and embedding lag tau.
@@ -801,32 +981,18 @@ def permutation_entropy(x, n, tau):
 
     """
 
-    PeSeq = []
-    Em = embed_seq(x, tau, n)
+    Em = embed_seq_cached(x, tau, n)
 
-    for i in range(0, len(Em)):
-        r = []
-        z = []
+    # Lehmer code of each row, the number of later elements smaller than
+    # each element (ties keep their order) weighted by the factorials
+    PeSeq = numpy.zeros(len(Em), dtype=numpy.int64)
+    for j in range(0, n):
+        smaller = numpy.sum(Em[:, j + 1:] < Em[:, j:j + 1], axis=1)
+        PeSeq += smaller * factorial(n - 1 - j)
 
-        for j in range(0, len(Em[i])):
-            z.append(Em[i][j])
-
-        for j in range(0, len(Em[i])):
-            z.sort()
-            r.append(z.index(Em[i][j]))
-            z[z.index(Em[i][j])] = -1
-
-        PeSeq.append(r)
-
-    RankMat = []
-
-    while len(PeSeq) > 0:
-        RankMat.append(PeSeq.count(PeSeq[0]))
-        x = PeSeq[0]
-        for j in range(0, PeSeq.count(PeSeq[0])):
-            PeSeq.pop(PeSeq.index(x))
-
-    RankMat = numpy.array(RankMat)
+    # Counted in the order each permutation first appears
+    Perms, First, RankMat = numpy.unique(PeSeq, return_index=True, return_counts=True)
+    RankMat = RankMat[numpy.argsort(First)]
     RankMat = numpy.true_divide(RankMat, RankMat.sum())
     EntropyMat = numpy.multiply(numpy.log2(RankMat), RankMat)
     PE = -1 * EntropyMat.sum()
@@ -1004,7 +1170,7 @@ def information_based_similarity(x, y, n):
     return IBS
 
 
-def LLE(x, tau, n, T, fs):
+def LLE(x, tau, n, T, fs, Neighbors=None):
     """Calculate largest Lyauponov exponent of a given time series x using
     Rosenstein algorithm.
 
@@ -1036,6 +1202,13 @@ def LLE(x, tau, n, T, fs):
 
         Mean period
 
+    Neighbors
+        numpy.ndarray
+
+        Optional, the nearest neighbour of each embedding vector more than T
+        steps away from it (as returned by theiler_neighbors), so it can be
+        found some other way, e.g. with a k-d tree
+
     Returns
     ----------
 
@@ -1059,6 +1232,12 @@ def LLE(x, tau, n, T, fs):
     calculated. The slope of this line gives an accurate estimate of the
     largest Lyapunov exponent.
 
+    Neither the neighbour search nor the divergence keep the distance matrix
+    of the embedding, both are calculated a block of LLE_BLOCK_SIZE values at
+    a time, so the memory used only grows linearly with the series length.
+    Both are still quadratic in time, the neighbours can be found in
+    O(N log N) with a k-d tree and passed as Neighbors.
+
     References
     ----------
     Rosenstein, Michael T., James J. Collins, and Carlo J. De Luca. "A
@@ -1075,38 +1254,63 @@ def LLE(x, tau, n, T, fs):
 
     """
 
-    Em = embed_seq(x, tau, n)
+    Em = embed_seq_cached(x, tau, n)
     M = len(Em)
-    A = numpy.tile(Em, (len(Em), 1, 1))
-    B = numpy.transpose(A, [1, 0, 2])
-    square_dists = (A - B) ** 2 #  square_dists[i,j,k] = (Em[i][k]-Em[j][k])^2
-    D = numpy.sqrt(square_dists[:,:,:].sum(axis=2)) #  D[i,j] = ||Em[i]-Em[j]||_2
-
-    # Exclude elements within T of the diagonal
-    band = numpy.tri(D.shape[0], k=T) - numpy.tri(D.shape[0], k=-T-1)
-    band[band == 1] = numpy.inf
-    neighbors = (D + band).argmin(axis=0) #  nearest neighbors more than T steps away
-
-    # in_bounds[i,j] = (i+j <= M-1 and i+neighbors[j] <= M-1)
-    inc = numpy.tile(numpy.arange(M), (M, 1))
-    row_inds = (numpy.tile(numpy.arange(M), (M, 1)).T + inc)
-    col_inds = (numpy.tile(neighbors, (M, 1)) + inc.T)
-    in_bounds = numpy.logical_and(row_inds <= M - 1, col_inds <= M - 1)
-    # Uncomment for old (miscounted) version
-    #in_bounds = numpy.logical_and(row_inds < M - 1, col_inds < M - 1)
-    row_inds[-in_bounds] = 0
-    col_inds[-in_bounds] = 0
-
-    # neighbor_dists[i,j] = ||Em[i+j]-Em[i+neighbors[j]]||_2
-    neighbor_dists = numpy.ma.MaskedArray(D[row_inds, col_inds], -in_bounds)
-    J = (-neighbor_dists.mask).sum(axis=1) #  number of in-bounds indices by row
-    # Set invalid (zero) values to 1; log(1) = 0 so sum is unchanged
-    neighbor_dists[neighbor_dists == 0] = 1
-    d_ij = numpy.sum(numpy.log(neighbor_dists.data), axis=1)
+    if Neighbors is None:
+        Neighbors = theiler_neighbors(Em, T)
+
+    # Last[j] is the last step i with j+i <= M-1 and Neighbors[j]+i <= M-1,
+    # J[i] the number of pairs still in bounds at step i
+    Last = M - 1 - numpy.maximum(numpy.arange(M), Neighbors)
+    J = numpy.cumsum(numpy.bincount(Last, minlength=M)[::-1])[::-1]
+
+    # d_ij[i] = sum over j of log(||Em[i+j]-Em[i+Neighbors[j]]||_2), a block of
+    # steps at a time; out of bounds and zero distances are set to 1, log(1)
+    # = 0 so they don't change the sum
+    d_ij = numpy.zeros(M)
+    Steps = max(1, LLE_BLOCK_SIZE // M)
+    for Start in range(0, Last.max() + 1, Steps):
+        i = numpy.arange(Start, min(Start + Steps, M))[:, None]
+        In_Bounds = Last >= i
+        Rows = numpy.where(In_Bounds, numpy.arange(M) + i, 0)
+        Cols = numpy.where(In_Bounds, Neighbors + i, 0)
+        Neighbor_Dists = embedding_distances(Em, Rows, Cols)
+        Neighbor_Dists[~In_Bounds | (Neighbor_Dists == 0)] = 1
+        d_ij[Start:Start + len(i)] = numpy.sum(numpy.log(Neighbor_Dists), axis=1)
     mean_d = d_ij[J > 0] / J[J > 0]
 
     x = numpy.arange(len(mean_d))
     X = numpy.vstack((x, numpy.ones(len(mean_d)))).T
-    [m, c] = numpy.linalg.lstsq(X, mean_d)[0]
+    [m, c] = numpy.linalg.lstsq(X, mean_d, rcond=-1)[0]
     Lexp = fs * m
     return Lexp
+
+
+def theiler_neighbors(Em, T):
+    """Index of the nearest neighbour (Euclidean distance) of each row of Em
+    among the rows more than T rows away from it, the lowest index among
+    equally distant ones. The distances are calculated for a block of rows at
+    a time, so only LLE_BLOCK_SIZE values are kept instead of the whole
+    distance matrix.
+    """
+    M = len(Em)
+    Neighbors = numpy.zeros(M, dtype=int)
+    Block = max(1, LLE_BLOCK_SIZE // M)
+    for Start in range(0, M, Block):
+        j = numpy.arange(Start, min(Start + Block, M))
+        D = embedding_distances(Em, numpy.arange(M)[:, None], j)
+        D[numpy.abs(numpy.arange(M)[:, None] - j) <= T] = numpy.inf
+        Neighbors[j] = D.argmin(axis=0)
+    return Neighbors
+
+
+def embedding_distances(Em, Rows, Cols):
+    """Euclidean distance between the rows of Em indexed by Rows and Cols
+    (index arrays that are broadcast together). The squares are added one
+    coordinate at a time, so the rows themselves are never copied.
+    """
+    Square_Dists = 0
+    for k in range(Em.shape[1]):
+        Diffs = Em[Cols, k] - Em[Rows, k]
+        Square_Dists = Square_Dists + Diffs * Diffs
+    return numpy.sqrt(Square_Dists)
@@ -0,0 +1,95 @@
+import tools.cache
+import tools.compress
+import tools.entropy
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestCacheModule(unittest.TestCase):
+    """
+    Tests for the cache module, a cached result must be the one that would be
+    calculated, and only results of the same contents and parameters may be
+    returned.
+    """
+
+    def setUp(self):
+        random_state = numpy.random.RandomState(42)
+        self.series = 140 + numpy.cumsum(random_state.randn(300))
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.data_dir = os.path.join(self.directory, "data")
+        os.mkdir(self.data_dir)
+        for index in range(3):
+            with open(os.path.join(self.data_dir, "series%d.txt" % index), "w") as fdout:
+                fdout.writelines("%.2f\n" % value for value in self.series[index * 50:])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def calculate(self, filenames):
+        self.calculated.extend(filenames)
+        return dict((filename, len(filename)) for filename in filenames)
+
+    def test_cached(self):
+        self.calculated = []
+        files = dict((filename, (os.path.join(self.data_dir, filename), ("measure", 2, [0.1, 0.2])))
+                     for filename in os.listdir(self.data_dir))
+        expected = self.calculate(list(files))
+        self.calculated = []
+        self.assertEqual(tools.cache.cached(self.cache_dir, files, self.calculate), expected)
+        self.assertEqual(sorted(self.calculated), sorted(files))
+        self.calculated = []
+        self.assertEqual(tools.cache.cached(self.cache_dir, files, self.calculate), expected)
+        self.assertEqual(self.calculated, [])
+        # numpy values give the same key as the python values they hold
+        files["series0.txt"] = (files["series0.txt"][0], ("measure", numpy.int64(2), numpy.array([0.1, 0.2])))
+        tools.cache.cached(self.cache_dir, files, self.calculate)
+        self.assertEqual(self.calculated, [])
+        # other contents or parameters are calculated again
+        with open(files["series1.txt"][0], "a") as fdout:
+            fdout.write("1.00\n")
+        files["series2.txt"] = (files["series2.txt"][0], ("measure", 3, [0.1, 0.2]))
+        tools.cache.cached(self.cache_dir, files, self.calculate)
+        self.assertEqual(sorted(self.calculated), ["series1.txt", "series2.txt"])
+        self.calculated = []
+        tools.cache.cached(None, files, self.calculate)
+        self.assertEqual(sorted(self.calculated), sorted(files))
+
+    def test_eviction(self):
+        max_size = tools.cache.CACHE_MAX_SIZE
+        tools.cache.CACHE_MAX_SIZE = 2 ** 16
+        try:
+            for index in range(64):
+                tools.cache.store(self.cache_dir, {"key%d" % index: os.urandom(2 ** 10)})
+            found = tools.cache.lookup(self.cache_dir, ["key%d" % index for index in range(64)])
+        finally:
+            tools.cache.CACHE_MAX_SIZE = max_size
+        self.assertIn("key63", found)
+        self.assertNotIn("key0", found)
+        self.assertLess(len(found), 64)
+
+    def test_entry_points(self):
+        for compressor in ("gzip", "bzip2"):
+            expected = tools.compress.compress(self.data_dir, compressor, 9)
+            for repeat in range(2):
+                self.assertEqual(tools.compress.compress(self.data_dir, compressor, 9, cache_dir=self.cache_dir),
+                                 expected)
+            for repeat in range(2):
+                self.assertEqual(tools.compress.compress_bytes(self.series, compressor, 9, cache_dir=self.cache_dir),
+                                 tools.compress.compress_bytes(self.series, compressor, 9))
+        tolerances = dict((filename, [0.1, 0.2]) for filename in os.listdir(self.data_dir))
+        for function in ("sampen", "apen"):
+            expected = tools.entropy.entropy(self.data_dir, function, [1, 2], tolerances)
+            for repeat in range(2):
+                self.assertEqual(tools.entropy.entropy(self.data_dir, function, [1, 2], tolerances,
+                                                       cache_dir=self.cache_dir), expected)
+                self.assertEqual(tools.entropy.series_entropy(self.series, function, 2, 0.2,
+                                                              cache_dir=self.cache_dir),
+                                 tools.entropy.series_entropy(self.series, function, 2, 0.2))
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False, verbosity=2)
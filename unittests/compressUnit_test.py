@@ -1,7 +1,9 @@
 import tools.compress
 import tools.clean
+import numpy
 import os
 import shutil
+import tempfile
 import unittest
 
 
@@ -99,5 +101,105 @@ class TestCompressModule(unittest.TestCase):
         self.assertEqual(cd.compressed, 9741)
 
 
+
+class TestCompressBytes(unittest.TestCase):
+    """
+    Tests for the buffer compression, any buffer must give what compressing
+    a file with the same contents gives.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        random_state = numpy.random.RandomState(42)
+        cls.series = 140 + numpy.cumsum(random_state.randn(500))
+        cls.text = ''.join("%.2f\n" % value for value in cls.series).encode()
+        cls.directory = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.directory, "series.txt")
+        with open(cls.filename, "wb") as fdout:
+            fdout.write(cls.text)
+        # The external compressors store the file's name, a buffer is compressed as a file named data
+        cls.buffer_directory = tempfile.mkdtemp()
+        cls.buffer_filename = os.path.join(cls.buffer_directory, "data")
+        shutil.copyfile(cls.filename, cls.buffer_filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        shutil.rmtree(cls.buffer_directory)
+
+    def test_compress_bytes(self):
+        for compressor in tools.compress.AVAILABLE_COMPRESSORS:
+            if compressor == "spbio":
+                continue
+            level = tools.compress.AVAILABLE_COMPRESSORS[compressor][1]
+            expected = tools.compress.compress(self.buffer_filename, compressor, level)[self.buffer_filename]
+            for data in (self.text, bytearray(self.text), memoryview(self.text),
+                         numpy.frombuffer(self.text, dtype=numpy.uint8)):
+                self.assertEqual(tools.compress.compress_bytes(data, compressor, level), expected)
+            # levels out of range are set to the compressor's maximum, as in compress
+            self.assertEqual(tools.compress.compress_bytes(self.text, compressor, level + 100), expected)
+        series_data = tools.compress.compress_bytes(self.series, "gzip", 9)
+        self.assertEqual(series_data.original, self.series.nbytes)
+        self.assertEqual(tools.compress.compress_bytes(self.series[::2], "gzip", 9).original, self.series.nbytes // 2)
+
+    def test_line_endings(self):
+        """
+    Files are compressed as text, with their line endings translated to
+    '\\n', but their original size is the size of the file.
+    """
+        windows_file = os.path.join(self.directory, "windows.txt")
+        with open(windows_file, "wb") as fdout:
+            fdout.write(self.text.replace(b"\n", b"\r\n"))
+        compression_data = tools.compress.compress(windows_file, "gzip", 9)[windows_file]
+        self.assertEqual(compression_data.original, len(self.text) + len(self.series))
+        self.assertEqual(compression_data.compressed, tools.compress.compress_bytes(self.text, "gzip", 9).compressed)
+
+    def test_jobs(self):
+        for index in range(1, 4):
+            with open(os.path.join(self.directory, "series%d.txt" % index), "wb") as fdout:
+                fdout.write(self.text[::index])
+        for compressor in tools.compress.AVAILABLE_COMPRESSORS:
+            if compressor == "spbio":
+                continue
+            level = tools.compress.AVAILABLE_COMPRESSORS[compressor][1]
+            expected = tools.compress.compress(self.directory, compressor, level)
+            self.assertEqual(tools.compress.compress(self.directory, compressor, level, jobs=3), expected)
+
+    def test_failed_file(self):
+        """
+    A file that can't be compressed is left out of the results, the other
+    files in the directory are still compressed.
+    """
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copyfile(self.filename, os.path.join(directory, "series.txt"))
+            os.mkdir(os.path.join(directory, "unreadable"))
+            for compressor in ("gzip", "bzip2", "paq8l", "ppmd"):
+                if compressor not in tools.compress.AVAILABLE_COMPRESSORS:
+                    continue
+                level = tools.compress.AVAILABLE_COMPRESSORS[compressor][1]
+                expected = {"series.txt": tools.compress.compress(self.filename, compressor, level)[self.filename]}
+                for jobs in (1, 3):
+                    with self.assertLogs('hrfanalyse.pool', 'ERROR'):
+                        self.assertEqual(tools.compress.compress(directory, compressor, level, jobs=jobs), expected)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_scratch(self):
+        """
+    The external compressors run in scratch directories of their own, nothing
+    is written next to the files they compress.
+    """
+        for compressor in ("paq8l", "ppmd"):
+            if compressor not in tools.compress.AVAILABLE_COMPRESSORS:
+                continue
+            filelist = sorted(os.listdir(self.directory))
+            level = tools.compress.AVAILABLE_COMPRESSORS[compressor][1]
+            expected = tools.compress.compress(self.directory, compressor, level)
+            self.assertEqual(sorted(os.listdir(self.directory)), filelist)
+            self.assertEqual(tools.compress.compress(self.directory, compressor, level, jobs=len(filelist)), expected)
+            self.assertEqual(sorted(os.listdir(self.directory)), filelist)
+
+
 if __name__ == '__main__':
     unittest.main(exit=False, verbosity=2)
@@ -1,8 +1,14 @@
 import tools.entropy
 import tools.clean
+import tools.pyeeg
+import argparse
+import numpy
 import os
 import shutil
+import tempfile
+import tracemalloc
 import unittest
+from unittest import mock
 
 
 class TestEntropyModule(unittest.TestCase):
@@ -24,5 +30,348 @@ class TestEntropyModule(unittest.TestCase):
         shutil.rmtree('unittest_dataset_clean')
 
 
+class TestEntropyKernels(unittest.TestCase):
+    """
+    Tests for the entropy kernels, the results must be exactly the ones of
+    the pyeeg reference implementation.
+
+    One real valued and one integer valued (like most of our hrf) series are
+    used.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        random_state = numpy.random.RandomState(42)
+        cls.series = [numpy.cumsum(random_state.randn(300)),
+                      random_state.randint(120, 150, 300).astype(float)]
+
+    def test_sampen_backends(self):
+        """
+    Sample entropy must be bit-for-bit pyeeg's samp_entropy with every
+    available backend.
+    """
+        for series in self.series:
+            tolerance = 0.2 * numpy.std(series)
+            expected = tools.pyeeg.samp_entropy(series, 2, tolerance)
+            for backend in tools.entropy.AVAILABLE_BACKENDS:
+                self.assertEqual(tools.entropy.samp_entropy(series, 2, tolerance, backend), expected)
+
+    def test_apen_backends(self):
+        """
+    Aproximate entropy must be bit-for-bit pyeeg's ap_entropy with every
+    available backend.
+    """
+        for series in self.series:
+            tolerance = 0.2 * numpy.std(series)
+            expected = tools.pyeeg.ap_entropy(series, 2, tolerance)
+            for backend in tools.entropy.AVAILABLE_BACKENDS:
+                self.assertEqual(tools.entropy.ap_entropy(series, 2, tolerance, backend), expected)
+
+    def test_discrete_counts(self):
+        """
+    The histogram counts of the discrete backend must be the blocked
+    backend's, also for tolerances that fall exactly on the distance
+    between values (and for real valued series, which it hands over).
+    """
+        tolerances = numpy.array([0.0, 1.0, 2.5, 4.0])
+        for series in self.series:
+            for self_matches in (True, False):
+                counts = tools.entropy.match_counts_discrete(series, [1, 2, 3], tolerances, self_matches)
+                expected = tools.entropy.match_counts_blocked(series, [1, 2, 3], tolerances, self_matches)
+                for length in (1, 2, 3):
+                    self.assertTrue(numpy.array_equal(counts[length], expected[length]))
+
+    def test_packed_counts(self):
+        """
+    The bitmap counts of the packed backend must be the blocked backend's for
+    any block size (including blocks that don't fill a 64 bit word).
+    """
+        tolerances = numpy.array([0.0, 1.0, 2.5])
+        for series in self.series:
+            expected = tools.entropy.match_counts_blocked(series, [2, 3], tolerances, False)
+            for block_size in (7, 64, tools.entropy.BLOCK_SIZE):
+                counts = tools.entropy.match_counts_packed(series, [2, 3], tolerances, False, block_size)
+                for length in (2, 3):
+                    self.assertTrue(numpy.array_equal(counts[length], expected[length]))
+            # Rows compared in several chunks of columns
+            with mock.patch.object(tools.entropy, "PACKED_COLUMNS", 64):
+                counts = tools.entropy.match_counts_packed(series, [2, 3], tolerances, False, 7)
+            for length in (2, 3):
+                self.assertTrue(numpy.array_equal(counts[length], expected[length]))
+
+    def test_packed_memory(self):
+        """
+    The packed backend must never hold a block of rows as floats or
+    booleans, its peak memory stays under 1/8 of one block of the blocked
+    backend's float rows.
+    """
+        series = numpy.cumsum(numpy.random.RandomState(42).randn(6000))
+        tolerances = numpy.array([0.2 * numpy.std(series)])
+        with mock.patch.object(tools.entropy, "PACKED_COLUMNS", 64):
+            tracemalloc.start()
+            try:
+                tools.entropy.match_counts_packed(series, [2, 3], tolerances, False)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        # One block of float rows takes BLOCK_SIZE * len(series) * 8 bytes
+        self.assertLess(peak, tools.entropy.BLOCK_SIZE * len(series))
+
+    def test_blocked_block_size(self):
+        """
+    The match counts of the blocked backend must not depend on the block size.
+    """
+        series = self.series[0]
+        tolerances = numpy.array([0.2 * numpy.std(series)])
+        expected = tools.entropy.match_counts_blocked(series, [2, 3], tolerances, False, len(series))
+        for block_size in (1, 17):
+            counts = tools.entropy.match_counts_blocked(series, [2, 3], tolerances, False, block_size)
+            self.assertTrue(numpy.array_equal(counts[2], expected[2]))
+            self.assertTrue(numpy.array_equal(counts[3], expected[3]))
+
+    def test_tolerance_list(self):
+        """
+    A list of tolerances must give the same entropies as one call per
+    tolerance.
+    """
+        series = self.series[1]
+        tolerances = [factor * numpy.std(series) for factor in (0.1, 0.15, 0.2, 0.25)]
+        for backend in tools.entropy.AVAILABLE_BACKENDS:
+            self.assertEqual(tools.entropy.samp_entropy(series, 2, tolerances, backend),
+                             [tools.pyeeg.samp_entropy(series, 2, tolerance) for tolerance in tolerances])
+            self.assertEqual(tools.entropy.ap_entropy(series, 2, tolerances, backend),
+                             [tools.pyeeg.ap_entropy(series, 2, tolerance) for tolerance in tolerances])
+
+    def test_dimension_list(self):
+        """
+    A list of dimensions must give the same entropies as one call per
+    dimension.
+    """
+        series = self.series[0]
+        tolerance = 0.2 * numpy.std(series)
+        for backend in tools.entropy.AVAILABLE_BACKENDS:
+            self.assertEqual(tools.entropy.samp_entropy(series, [1, 2, 3, 4], tolerance, backend),
+                             [tools.pyeeg.samp_entropy(series, dimension, tolerance) for dimension in (1, 2, 3, 4)])
+            self.assertEqual(tools.entropy.ap_entropy(series, [1, 2, 3, 4], tolerance, backend),
+                             [tools.pyeeg.ap_entropy(series, dimension, tolerance) for dimension in (1, 2, 3, 4)])
+
+    def test_tolerance_free(self):
+        """
+    The measures with no tolerance have the shape of the entropies' results,
+    and the dfa exponents have columns of their own.
+    """
+        self.assertEqual(tools.entropy.tolerance_free([0.5], 2, 0.1), 0.5)
+        self.assertEqual(tools.entropy.tolerance_free([0.5], 2, [0.1, 0.2]), [0.5, 0.5])
+        self.assertEqual(tools.entropy.tolerance_free([0.5, 0.7], [1, 2], 0.1), [0.5, 0.7])
+        self.assertEqual(tools.entropy.tolerance_free([0.5, 0.7], [1, 2], [0.1, 0.2]), [[0.5, 0.5], [0.7, 0.7]])
+        self.assertEqual(tools.entropy.entropy_columns([1, 2], [0.0], entropy_function="dfa"), ["Alpha1", "Alpha2"])
+        self.assertEqual(tools.entropy.entropy_columns([2], [0.0], entropy_function="dfa"), ["Alpha2"])
+        self.assertEqual(tools.entropy.entropy_columns([1, 2], [0.0]), ["Entropy m1", "Entropy m2"])
+
+    def test_apenv2_counts(self):
+        """
+    The Nm vectors apenv2 builds one diagonal at a time must be the template
+    match counts with self-matches.
+    """
+        for series in self.series:
+            tolerances = numpy.array([0.1, 0.2]) * numpy.std(series)
+            counts = tools.entropy.diagonal_match_counts(series, [2, 3], tolerances)
+            expected = tools.entropy.match_counts_blocked(series, [2, 3], tolerances, True)
+            self.assertTrue(numpy.array_equal(counts[2], expected[2]))
+            self.assertTrue(numpy.array_equal(counts[3], expected[3]))
+
+    def test_apenv2(self):
+        """
+    The vectorized apenv2 must keep the results of the original cell by cell
+    implementation (reference values calculated with it).
+    """
+        for series, expected in zip(self.series, (0.7496942204610599, 1.020107403996982)):
+            self.assertEqual(tools.entropy.ap_entropy_v2(series, 2, 0.2 * numpy.std(series)), expected)
+
+    def test_permutation_entropy(self):
+        """
+    The Lehmer code permutation entropy must keep the results of pyeeg's
+    original rank lists (reference values calculated with it, on series above
+    -1 where its permutations are the ordinal patterns).
+    """
+        references = ((2.512869620701068, 4.386669581441124, 6.138439546989735),
+                      (2.581234753765147, 4.5452488886173406, 6.622080239655855))
+        for series, expected in zip((self.series[0] + 10 - numpy.min(self.series[0]), self.series[1]), references):
+            self.assertEqual([tools.pyeeg.permutation_entropy(series, n, tau) for n, tau in ((3, 1), (4, 2), (5, 1))],
+                             list(expected))
+        self.assertEqual(tools.pyeeg.permutation_entropy([1, 2, 4, 5, 12, 3, 4, 5], 5, 1), 2.0)
+        self.assertEqual(tools.entropy.perm_entropy(self.series[1], [3, 5], [0.1, 0.2]),
+                         [[references[1][0]] * 2, [references[1][2]] * 2])
+
+    def test_hurst(self):
+        """
+    The running moments and hulls must give the exponent of pyeeg's original
+    prefix by prefix implementation (reference values calculated with it).
+    """
+        for series, expected in zip(self.series, (0.9618272588057636, 0.4943805600281218)):
+            self.assertAlmostEqual(tools.pyeeg.hurst(series), expected, places=12)
+        self.assertEqual(tools.entropy.hurst_exponent(self.series[0], [2, 3], 0.1),
+                         [tools.pyeeg.hurst(self.series[0])] * 2)
+
+    def test_dfa(self):
+        """
+    The closed-form residues must be the ones of a least squares fit of each
+    box, consecutive or overlapping.
+    """
+        for series in self.series:
+            Y = numpy.cumsum(series - numpy.mean(series))
+            for n in (4, 16, 64):
+                fit = numpy.vstack([numpy.arange(n), numpy.ones(n)]).T
+                residues = [numpy.linalg.lstsq(fit, Y[j:j + n], rcond=None)[1][0] for j in range(len(Y) - n + 1)]
+                self.assertTrue(numpy.allclose(tools.pyeeg._overlapping_box_residues(Y, n), residues))
+                self.assertTrue(numpy.allclose(tools.pyeeg._box_residues(Y[:len(Y) // n * n].reshape(-1, n)),
+                                               residues[::n]))
+        alphas = tools.entropy.dfa_alpha(self.series[0], [1, 2], 0.1, "overlap")
+        self.assertEqual(alphas, [tools.pyeeg.dfa(self.series[0], L=numpy.arange(4, 17), Overlap=True),
+                                  tools.pyeeg.dfa(self.series[0], L=numpy.arange(16, 65), Overlap=True)])
+
+    def test_dfa_boxes(self):
+        """
+    The box layout is an option of its own, it doesn't replace the backend
+    and is part of the name of the output files.
+    """
+        parser = argparse.ArgumentParser()
+        tools.entropy.add_parser_options(parser)
+        names = set()
+        for arguments in (["dfa"], ["dfa", "--overlap"], ["dfa", "--boxes", "overlap"], ["sampen"]):
+            options = vars(parser.parse_args(["--backend", "sorted"] + arguments))
+            self.assertEqual(options["backend"], "sorted")
+            if options["entropy"] == "dfa":
+                self.assertEqual(tools.entropy.entropy_backend(options), options["boxes"])
+            else:
+                self.assertEqual(tools.entropy.entropy_backend(options), "sorted")
+            names.add(tools.entropy.entropy_name(options))
+        self.assertEqual(names, {"dfa_consecutive", "dfa_overlap", "sampen"})
+
+    def test_lle(self):
+        """
+    The blocked neighbour search and divergence must give the exponent of
+    Rosenstein's algorithm over the whole distance matrix, and the k-d tree
+    must find the same neighbours (ties included, the integer series has
+    many).
+    """
+        for series in self.series:
+            for dimension, theiler in ((2, 0), (3, 10)):
+                Em = tools.pyeeg.embed_seq(series, 1, dimension)
+                M = len(Em)
+                D = numpy.sqrt(((Em[:, None, :] - Em[None, :, :]) ** 2).sum(axis=2))
+                D[abs(numpy.subtract.outer(numpy.arange(M), numpy.arange(M))) <= theiler] = numpy.inf
+                neighbors = D.argmin(axis=0)
+                self.assertTrue((tools.pyeeg.theiler_neighbors(Em, theiler) == neighbors).all())
+                if tools.entropy.scipy_available:
+                    self.assertTrue((tools.entropy.lle_neighbors_kdtree(Em, theiler) == neighbors).all())
+                divergence = []
+                for i in range(M):
+                    pairs = [(j + i, neighbors[j] + i) for j in range(M) if max(j, neighbors[j]) + i < M]
+                    if pairs:
+                        dists = [numpy.linalg.norm(Em[a] - Em[b]) for a, b in pairs]
+                        divergence.append(numpy.mean([numpy.log(d) if d else 0 for d in dists]))
+                slope = numpy.polyfit(numpy.arange(len(divergence)), divergence, 1)[0]
+                self.assertAlmostEqual(tools.pyeeg.LLE(series, 1, dimension, theiler, 2), 2 * slope, places=10)
+        self.assertEqual(tools.entropy.lyapunov_exponent(self.series[0], [2, 3], [0.1, 0.2]),
+                         [[tools.pyeeg.LLE(self.series[0], 1, dimension, tools.entropy.LLE_THEILER_WINDOW, 1)] * 2
+                          for dimension in (2, 3)])
+
+    def test_sliding_sampen(self):
+        """
+    Sliding over overlapping (and uneven) blocks must give, for each block,
+    the same sample entropy as calculating it on its own.
+    """
+        for series in self.series:
+            windows = [(start, start + 100 + start % 7) for start in range(0, 180, 20)] + [(190, 300), (290, 300)]
+            blocks = [series[start:stop] for start, stop in windows]
+            tolerances = [[0.1 * numpy.std(block), 0.2 * numpy.std(block)] for block in blocks]
+            laid_series, laid_windows = tools.entropy.block_windows(blocks)
+            for (start, stop), block in zip(laid_windows, blocks):
+                self.assertTrue(numpy.array_equal(laid_series[start:stop], block))
+            results = tools.entropy.sliding_samp_entropy(laid_series, laid_windows, [1, 2], tolerances)
+            for result, block, block_tolerances in zip(results, blocks, tolerances):
+                self.assertEqual(result, tools.entropy.samp_entropy(block, [1, 2], block_tolerances))
+
+    def test_sampen_blocks_jobs(self):
+        """
+    Every block must get its entropy however many jobs are used, also when
+    there are more jobs than blocks.
+    """
+        blocks_dir = tempfile.mkdtemp()
+        try:
+            for series in self.series:
+                tolerances = {}
+                for block, start in enumerate(range(0, 100, 50)):
+                    filename = "series_%d" % (block + 1)
+                    with open(os.path.join(blocks_dir, filename), "w") as fdout:
+                        fdout.writelines("%r\n" % float(value) for value in series[start:start + 200])
+                    tolerances[filename] = [0.2 * numpy.std(series[start:start + 200])]
+                expected = tools.entropy.sampen_blocks(blocks_dir, [2], tolerances, "blocked", 1)
+                self.assertEqual(sorted(expected), sorted(tolerances))
+                for jobs in (2, 4):
+                    self.assertEqual(tools.entropy.sampen_blocks(blocks_dir, [2], tolerances, "blocked", jobs),
+                                     expected)
+        finally:
+            shutil.rmtree(blocks_dir)
+
+    def test_sampen_blocks_backend(self):
+        """
+    The backends that compare every pair (blocked, packed and discrete on
+    real valued blocks) slide over the blocks, the others calculate each
+    block on its own with the chosen backend unless sliding is asked for,
+    and the entropies are the same either way.
+    """
+        blocks_dir = tempfile.mkdtemp()
+        try:
+            for series, integer_blocks in zip(self.series, (False, True)):
+                tolerances = {}
+                for block, start in enumerate(range(0, 100, 50)):
+                    filename = "series_%d" % (block + 1)
+                    with open(os.path.join(blocks_dir, filename), "w") as fdout:
+                        fdout.writelines("%r\n" % float(value) for value in series[start:start + 200])
+                    tolerances[filename] = [0.2 * numpy.std(series[start:start + 200])]
+                expected = tools.entropy.sampen_blocks(blocks_dir, [2], tolerances, "blocked")
+                for backend in tools.entropy.AVAILABLE_BACKENDS:
+                    for sliding_asked in (False, True):
+                        with mock.patch("tools.entropy.samp_entropy",
+                                        wraps=tools.entropy.samp_entropy) as per_block, \
+                                mock.patch("tools.entropy.sliding_samp_entropy",
+                                           wraps=tools.entropy.sliding_samp_entropy) as sliding:
+                            entropies = tools.entropy.sampen_blocks(blocks_dir, [2], tolerances, backend,
+                                                                    sliding=sliding_asked)
+                        slides = sliding_asked or backend in ("blocked", "packed") or \
+                            (backend == "discrete" and not integer_blocks)
+                        self.assertEqual(sliding.called, slides)
+                        self.assertEqual(per_block.called, not slides)
+                        if not slides:
+                            self.assertTrue(all(call[0][3] == backend for call in per_block.call_args_list))
+                        for filename in expected:
+                            self.assertTrue(numpy.allclose(tools.entropy.entropy_values(entropies[filename]),
+                                                           tools.entropy.entropy_values(expected[filename])))
+        finally:
+            shutil.rmtree(blocks_dir)
+
+    def test_calculate_std(self):
+        """
+    Every file gets its standard deviation however many jobs are used, and
+    a file that can't be read raises instead of being left without one.
+    """
+        directory = tempfile.mkdtemp()
+        try:
+            for n, series in enumerate(self.series):
+                with open(os.path.join(directory, "series%d.txt" % n), "w") as fdout:
+                    fdout.writelines("%r\n" % float(value) for value in series)
+            expected = dict(("series%d.txt" % n, numpy.std(series)) for n, series in enumerate(self.series))
+            for jobs in (1, 2):
+                self.assertEqual(tools.entropy.calculate_std(directory, jobs), expected)
+            os.mkdir(os.path.join(directory, "unreadable"))
+            for jobs in (1, 2):
+                with self.assertLogs('hrfanalyse.pool', 'ERROR'), self.assertRaises(ValueError):
+                    tools.entropy.calculate_std(directory, jobs)
+        finally:
+            shutil.rmtree(directory)
+
+
 if __name__ == '__main__':
     unittest.main(exit=False, verbosity=2)
@@ -0,0 +1,112 @@
+import tools.features
+import tools.pyeeg
+import numpy
+import os
+import shutil
+import unittest
+
+
+class TestFeaturesModule(unittest.TestCase):
+    """
+    Tests for the features module, each feature must have exactly the value
+    its own function gives.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        random_state = numpy.random.RandomState(42)
+        cls.series = numpy.cumsum(random_state.randn(300))
+
+    def test_series_features(self):
+        features = tools.features.series_features(self.series)
+        tolerance = 0.2 * numpy.std(self.series)
+        mobility, complexity = tools.pyeeg.hjorth(list(self.series))
+        expected = {"sampen": tools.pyeeg.samp_entropy(self.series, 2, tolerance),
+                    "apen": tools.pyeeg.ap_entropy(self.series, 2, tolerance),
+                    "svd_entropy": tools.pyeeg.svd_entropy(self.series, 1, 10),
+                    "fisher_info": tools.pyeeg.fisher_info(self.series, 1, 10),
+                    "permen": tools.pyeeg.permutation_entropy(self.series, 3, 1),
+                    "pfd": tools.pyeeg.pfd(list(self.series)),
+                    "hfd": tools.pyeeg.hfd(list(self.series), 10),
+                    "hjorth_mobility": mobility,
+                    "hjorth_complexity": complexity}
+        centered = self.series - numpy.mean(self.series)
+        power, power_ratio = tools.pyeeg.bin_power(centered, tools.features.HRV_BANDS, 2.0)
+        expected.update({"vlf": power[0], "lf": power[1], "hf": power[2], "lf_hf": power[1] / power[2],
+                         "spectral_entropy": tools.pyeeg.spectral_entropy(centered, tools.features.HRV_BANDS, 2.0)})
+        self.assertEqual(features, expected)
+
+    def test_spectral_features(self):
+        """
+    The batched band powers must be the sums of each block's fft magnitudes,
+    the batched singular values each block's own, and the blocks of a
+    directory (stacked by length) must get the features they have on their
+    own.
+    """
+        blocks = self.series[:280].reshape(4, 70)
+        power, power_ratio = tools.pyeeg.bin_power_blocks(blocks, [0.1, 0.25, 0.6, 1.0], 2.0)
+        for block, block_power in zip(blocks, power):
+            magnitudes = abs(numpy.fft.fft(block))
+            self.assertTrue(numpy.allclose(block_power, [sum(magnitudes[3:8]), sum(magnitudes[8:21]),
+                                                         sum(magnitudes[21:35])]))
+        self.assertTrue(numpy.allclose(power_ratio.sum(axis=1), 1))
+        # Bands above the Nyquist frequency can't be measured
+        with self.assertRaises(ValueError):
+            tools.pyeeg.bin_power_blocks(blocks, [0.1, 0.25, 0.6, 1.5], 2.0)
+        with self.assertRaises(ValueError):
+            tools.pyeeg.bin_power(blocks[0], [0.1, 1.2], 2.0)
+        singular_values = tools.pyeeg.singular_spectrum_blocks(blocks, 2, 5)
+        for block, block_values in zip(blocks, singular_values):
+            self.assertTrue(numpy.allclose(block_values, tools.pyeeg.singular_spectrum(block, 2, 5)))
+            fisher_info = sum((block_values[i + 1] - block_values[i]) ** 2 / block_values[i] for i in range(4))
+            self.assertAlmostEqual(tools.pyeeg.fisher_info(block, 2, 5), fisher_info, places=12)
+
+        if not os.path.exists('unittest_blocks'):
+            os.mkdir('unittest_blocks')
+        try:
+            windows = [(0, 120), (120, 240), (50, 150), (100, 300)]
+            for number, (start, stop) in enumerate(windows):
+                with open(os.path.join('unittest_blocks', 'block_%d' % number), 'w') as block_file:
+                    block_file.write(''.join('%f\n' % value for value in self.series[start:stop]))
+            feature_names = ["pfd", "svd_entropy", "fisher_info", "lf_hf", "spectral_entropy"]
+            features = tools.features.features('unittest_blocks', feature_names, fs=4.0)
+            for number in range(len(windows)):
+                block = tools.features.read_series(os.path.join('unittest_blocks', 'block_%d' % number))
+                expected = tools.features.series_features(block, feature_names, fs=4.0)
+                self.assertEqual(sorted(features['block_%d' % number]), sorted(feature_names))
+                for feature_name in feature_names:
+                    self.assertAlmostEqual(features['block_%d' % number][feature_name], expected[feature_name],
+                                           places=12)
+        finally:
+            shutil.rmtree('unittest_blocks')
+
+    def test_fractal_dimensions(self):
+        """
+    The vectorized hfd, pfd and hjorth must keep the results of pyeeg's
+    original loops (reference values calculated with them).
+    """
+        self.assertAlmostEqual(tools.pyeeg.hfd(self.series, 10), 0.5689522674232126, places=12)
+        self.assertEqual(tools.pyeeg.pfd(self.series), 0.5785041677875186)
+        differences = list(numpy.diff(self.series))
+        mobility, complexity = tools.pyeeg.hjorth(self.series, differences)
+        self.assertAlmostEqual(mobility, 0.007568989073730552, places=12)
+        self.assertAlmostEqual(complexity, 193.88677811828495, places=9)
+        self.assertEqual(len(differences), len(self.series) - 1)
+
+    def test_embedding_cache(self):
+        """
+    The same values give the same (read-only) embedding, even from a copy
+    or a list, and the least recently used embeddings are dropped first.
+    """
+        embedding = tools.pyeeg.embed_seq_cached(self.series, 1, 3)
+        self.assertTrue(tools.pyeeg.embed_seq_cached(list(self.series), 1, 3) is embedding)
+        self.assertTrue(numpy.array_equal(embedding, tools.pyeeg.embed_seq(self.series, 1, 3)))
+        self.assertFalse(embedding.flags.writeable)
+        for dimension in range(4, 4 + tools.pyeeg.EMBEDDING_CACHE_SIZE):
+            tools.pyeeg.embed_seq_cached(self.series, 1, dimension)
+        self.assertEqual(len(tools.pyeeg._embedding_cache), tools.pyeeg.EMBEDDING_CACHE_SIZE)
+        self.assertFalse(tools.pyeeg.embed_seq_cached(self.series, 1, 3) is embedding)
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False, verbosity=2)
@@ -0,0 +1,112 @@
+import tools.multiscale
+import tools.entropy
+import tools.compress
+import tools.pyeeg
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestMultiscaleModule(unittest.TestCase):
+    """
+    Tests for the multiscale module, the scales built in memory must have
+    exactly the values of the scale files.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        random_state = numpy.random.RandomState(42)
+        cls.series = 140 + numpy.cumsum(random_state.randn(301))
+        cls.directory = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.directory, "series.txt")
+        with open(cls.filename, "w") as fdout:
+            fdout.writelines("%.2f\n" % value for value in cls.series)
+        cls.series = numpy.loadtxt(cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def read_scale(self, scale, mul_order, round_to_int):
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        tools.multiscale.create_scale(self.filename, output_dir, scale, mul_order, round_to_int)
+        return numpy.loadtxt(os.path.join(output_dir, "series.txt"))
+
+    def test_create_scale(self):
+        for scale in (1, 2, 7):
+            for mul_order, round_to_int in ((-1, False), (-1, True), (10, True)):
+                expected = []
+                for line_index in range(0, len(self.series) - scale + 1, scale):
+                    scaled_hrf = numpy.mean(list(self.series[line_index:line_index + scale]))
+                    if mul_order != -1:
+                        scaled_hrf *= mul_order
+                    if round_to_int:
+                        expected.append('%d\n' % round(scaled_hrf))
+                    else:
+                        expected.append('%.3f\n' % scaled_hrf)
+                output_dir = tempfile.mkdtemp(dir=self.directory)
+                tools.multiscale.create_scale(self.filename, output_dir, scale, mul_order, round_to_int)
+                with open(os.path.join(output_dir, "series.txt")) as fdin:
+                    self.assertEqual(fdin.readlines(), expected)
+
+    def test_coarse_grain(self):
+        for scale in (1, 2, 7):
+            for mul_order, round_to_int in ((-1, False), (-1, True), (10, True)):
+                self.assertTrue(numpy.array_equal(tools.multiscale.coarse_grain(self.series, scale, mul_order,
+                                                                                round_to_int),
+                                                  self.read_scale(scale, mul_order, round_to_int)))
+
+    def test_multiscale_compression(self):
+        """
+    The scales compressed in memory must give the sizes of the scale files.
+    """
+        for mul_order, round_to_int in ((-1, False), (10, True)):
+            expected = []
+            for scale in (1, 3, 5):
+                output_dir = tempfile.mkdtemp(dir=self.directory)
+                tools.multiscale.create_scale(self.filename, output_dir, scale, mul_order, round_to_int)
+                scale_file = os.path.join(output_dir, "series.txt")
+                compression_data = tools.compress.compress(scale_file, "gzip", 9)[scale_file]
+                expected += [compression_data.original, compression_data.compressed]
+            compression_table = tools.multiscale.multiscale_compression(self.filename, 1, 6, 2, "gzip", 9, False,
+                                                                        mul_order, round_to_int)
+            self.assertEqual(compression_table, {"series.txt": expected})
+
+    def test_multiscale_entropy(self):
+        entropies = tools.multiscale.multiscale_entropy(self.filename, 1, 4, 2, "sampen", 2, [0.1, 0.2])
+        tolerances = [0.1 * numpy.std(self.series), 0.2 * numpy.std(self.series)]
+        expected = []
+        for scale in (1, 3):
+            expected.extend(tools.entropy.entropy_values(tools.entropy.series_entropy(
+                self.read_scale(scale, -1, False), "sampen", 2, tolerances)))
+        self.assertEqual(entropies, {"series.txt": expected})
+
+    def test_composite_entropy(self):
+        tolerance = 0.15 * numpy.std(self.series)
+        mse = tools.multiscale.multiscale_entropy(self.filename, 1, 3, 1, "sampen", 2, 0.15)["series.txt"]
+        rcmse = tools.multiscale.multiscale_entropy(self.filename, 1, 3, 1, "sampen", 2, 0.15,
+                                                    composite="rcmse")["series.txt"]
+        cmse = tools.multiscale.multiscale_entropy(self.filename, 1, 3, 1, "sampen", 2, 0.15,
+                                                   composite="cmse")["series.txt"]
+        self.assertEqual(rcmse[0], mse[0])
+        self.assertEqual(cmse[0], mse[0])
+        # pyeeg counts the matches of all the templates of each length
+        matches = {2: 0, 3: 0}
+        shifted_entropies = []
+        for shift in range(2):
+            scale_values = tools.multiscale.coarse_grain(self.series[shift:], 2, -1, False)
+            for length in (2, 3):
+                templates = tools.pyeeg.embed_seq(scale_values, 1, length)
+                distances = numpy.max(numpy.abs(templates[:, None] - templates[None, :]), axis=2)
+                matches[length] += numpy.count_nonzero(numpy.triu(distances <= tolerance, 1))
+            shifted_entropies.append(tools.pyeeg.samp_entropy(scale_values, 2, tolerance))
+        self.assertAlmostEqual(rcmse[1], numpy.log(matches[2] / float(matches[3])))
+        self.assertAlmostEqual(cmse[1], numpy.mean(shifted_entropies))
+        self.assertRaises(ValueError, tools.multiscale.multiscale_entropy, self.filename, 1, 3, 1, "apen", 2, 0.15,
+                          composite="cmse")
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False, verbosity=2)
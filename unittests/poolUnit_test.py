@@ -0,0 +1,42 @@
+import tools.entropy
+import tools.pool
+import numpy
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class TestPoolModule(unittest.TestCase):
+    """
+    Tests for the pool module, spreading the files over workers must give the
+    same results as running them one at a time, and a file that fails must
+    only be left out.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        random_state = numpy.random.RandomState(42)
+        cls.series = [140 + numpy.cumsum(random_state.randn(300)) for series in range(3)]
+
+    def test_run_in_pool(self):
+        file_arguments = dict(("file%d" % n, (series, 2, 0.2 * numpy.std(series)))
+                              for n, series in enumerate(self.series))
+        file_arguments["broken"] = (["not a number"], 2, 0.2)
+        expected = dict((filename, tools.entropy.samp_entropy(*file_arguments[filename]))
+                        for filename in file_arguments if filename != "broken")
+        for jobs in (1, 2):
+            for executor_class in (ProcessPoolExecutor, ThreadPoolExecutor):
+                with self.assertLogs('hrfanalyse.pool', 'ERROR'):
+                    results = tools.pool.run_in_pool(tools.entropy.samp_entropy, file_arguments, jobs,
+                                                     executor_class)
+                self.assertEqual(results, expected)
+                self.assertEqual(list(results), sorted(expected))
+
+    def test_job_count(self):
+        self.assertEqual(tools.pool.job_count("3"), 3)
+        for jobs in ("0", "-1", "two"):
+            with self.assertRaises(ValueError):
+                tools.pool.job_count(jobs)
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False, verbosity=2)